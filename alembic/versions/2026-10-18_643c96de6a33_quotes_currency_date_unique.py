@@ -0,0 +1,33 @@
+"""quotes_currency_date_unique
+
+Revision ID: 643c96de6a33
+Revises: fda2983f0d45
+Create Date: 2026-10-18 10:02:11.518204
+
+"""
+from alembic import op
+
+from cbr_data_receiver.models import schema_name
+
+# revision identifiers, used by Alembic.
+revision = '643c96de6a33'
+down_revision = 'fda2983f0d45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keep the last loaded quote of every (currency, date)
+    op.execute(f'''
+        DELETE FROM {schema_name}.quotes q
+        USING {schema_name}.quotes d
+        WHERE q.currency = d.currency AND q.date = d.date AND q.id < d.id
+    ''')
+    op.execute(f'''
+        CREATE UNIQUE INDEX IF NOT EXISTS quotes_currency_date_idx
+        ON {schema_name}.quotes (currency, date)
+    ''')
+
+
+def downgrade():
+    op.execute(f'DROP INDEX IF EXISTS {schema_name}.quotes_currency_date_idx')
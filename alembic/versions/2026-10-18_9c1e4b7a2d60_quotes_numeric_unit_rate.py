@@ -0,0 +1,43 @@
+"""quotes_numeric_unit_rate
+
+Revision ID: 9c1e4b7a2d60
+Revises: b5fe3d54c390
+Create Date: 2026-10-18 14:05:52.730184
+
+"""
+from alembic import op
+
+from cbr_data_receiver.models import UNIT_RATE_SCALE, VALUE_SCALE, schema_name
+
+# revision identifiers, used by Alembic.
+revision = '9c1e4b7a2d60'
+down_revision = 'b5fe3d54c390'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # float8 is converted by its shortest text form, so 41.1437 stays 41.1437
+    op.execute(f'''
+        ALTER TABLE {schema_name}.quotes
+        ALTER COLUMN value TYPE numeric(18, {VALUE_SCALE})
+        USING round(value::numeric, {VALUE_SCALE})
+    ''')
+    op.execute(f'''
+        ALTER TABLE {schema_name}.quotes
+        ADD COLUMN IF NOT EXISTS unit_rate numeric(24, {UNIT_RATE_SCALE})
+    ''')
+    op.execute(f'''
+        UPDATE {schema_name}.quotes q
+        SET unit_rate = round(q.value / c.nominal, {UNIT_RATE_SCALE})
+        FROM {schema_name}.currencies c
+        WHERE c.id = q.currency AND q.unit_rate IS NULL
+    ''')
+
+
+def downgrade():
+    op.execute(f'ALTER TABLE {schema_name}.quotes DROP COLUMN IF EXISTS unit_rate')
+    op.execute(f'''
+        ALTER TABLE {schema_name}.quotes
+        ALTER COLUMN value TYPE double precision
+    ''')
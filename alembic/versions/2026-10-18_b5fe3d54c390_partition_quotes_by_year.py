@@ -0,0 +1,95 @@
+"""partition_quotes_by_year
+
+Revision ID: b5fe3d54c390
+Revises: 643c96de6a33
+Create Date: 2026-10-18 12:41:37.207315
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from cbr_data_receiver.models import quotes_partition_ddl, schema_name
+
+# revision identifiers, used by Alembic.
+revision = 'b5fe3d54c390'
+down_revision = '643c96de6a33'
+branch_labels = None
+depends_on = None
+
+
+def _is_partitioned(connection):
+    return connection.execute(sa.text(
+        "SELECT c.relkind = 'p' FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = :schema AND c.relname = 'quotes'"), schema=schema_name).scalar()
+
+
+def _create_partitions(connection, table):
+    first_year, last_year = connection.execute(sa.text(
+        f"SELECT extract(year FROM min(date))::int, extract(year FROM max(date))::int "
+        f"FROM {schema_name}.{table}")).fetchone()
+    current_year = datetime.date.today().year
+    for year in range(min(first_year or current_year, current_year),
+                      max(last_year or current_year, current_year) + 1):
+        op.execute(quotes_partition_ddl(year))
+
+
+def upgrade():
+    connection = op.get_bind()
+    if _is_partitioned(connection):
+        # The table was created from the current models by the init revision
+        op.execute(f'CREATE INDEX IF NOT EXISTS quotes_date_brin_idx '
+                   f'ON {schema_name}.quotes USING brin (date)')
+        _create_partitions(connection, 'quotes')
+        return
+
+    op.execute(f'ALTER TABLE {schema_name}.quotes RENAME TO quotes_old')
+    op.execute(f'ALTER INDEX {schema_name}.quotes_pkey RENAME TO quotes_old_pkey')
+    op.execute(f'DROP INDEX IF EXISTS {schema_name}.quotes_currency_date_idx')
+    op.execute(f'ALTER SEQUENCE {schema_name}.quotes_id_seq OWNED BY NONE')
+    op.execute(f'''
+        CREATE TABLE {schema_name}.quotes (
+            id integer NOT NULL DEFAULT nextval('{schema_name}.quotes_id_seq'),
+            currency varchar,
+            date date NOT NULL,
+            value double precision,
+            PRIMARY KEY (id, date)
+        ) PARTITION BY RANGE (date)
+    ''')
+    op.execute(f'ALTER SEQUENCE {schema_name}.quotes_id_seq OWNED BY {schema_name}.quotes.id')
+    op.execute(f'CREATE UNIQUE INDEX quotes_currency_date_idx '
+               f'ON {schema_name}.quotes (currency, date)')
+    op.execute(f'CREATE INDEX quotes_date_brin_idx ON {schema_name}.quotes USING brin (date)')
+    _create_partitions(connection, 'quotes_old')
+    op.execute(f'''
+        INSERT INTO {schema_name}.quotes (id, currency, date, value)
+        SELECT id, currency, date, value FROM {schema_name}.quotes_old
+        WHERE date IS NOT NULL
+    ''')
+    op.execute(f'DROP TABLE {schema_name}.quotes_old')
+
+
+def downgrade():
+    op.execute(f'ALTER TABLE {schema_name}.quotes RENAME TO quotes_partitioned')
+    op.execute(f'ALTER INDEX {schema_name}.quotes_pkey RENAME TO quotes_partitioned_pkey')
+    op.execute(f'ALTER INDEX {schema_name}.quotes_currency_date_idx '
+               f'RENAME TO quotes_partitioned_currency_date_idx')
+    op.execute(f'ALTER SEQUENCE {schema_name}.quotes_id_seq OWNED BY NONE')
+    op.execute(f'''
+        CREATE TABLE {schema_name}.quotes (
+            id integer NOT NULL DEFAULT nextval('{schema_name}.quotes_id_seq') PRIMARY KEY,
+            currency varchar,
+            date date,
+            value double precision
+        )
+    ''')
+    op.execute(f'ALTER SEQUENCE {schema_name}.quotes_id_seq OWNED BY {schema_name}.quotes.id')
+    op.execute(f'''
+        INSERT INTO {schema_name}.quotes (id, currency, date, value)
+        SELECT id, currency, date, value FROM {schema_name}.quotes_partitioned
+    ''')
+    op.execute(f'DROP TABLE {schema_name}.quotes_partitioned')
+    op.execute(f'CREATE UNIQUE INDEX quotes_currency_date_idx '
+               f'ON {schema_name}.quotes (currency, date)')
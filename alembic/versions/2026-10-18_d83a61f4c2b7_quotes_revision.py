@@ -0,0 +1,33 @@
+"""quotes_revision
+
+Revision ID: d83a61f4c2b7
+Revises: e47d0a5b9f13
+Create Date: 2026-10-18 18:41:27.305116
+
+"""
+from alembic import op
+
+from cbr_data_receiver.models import CURRENT_REVISION, schema_name
+
+# revision identifiers, used by Alembic.
+revision = 'd83a61f4c2b7'
+down_revision = 'e47d0a5b9f13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The existing quotes get the id of this transaction
+    op.execute(f'''
+        ALTER TABLE {schema_name}.quotes
+        ADD COLUMN IF NOT EXISTS revision bigint NOT NULL DEFAULT {CURRENT_REVISION}
+    ''')
+    op.execute(f'''
+        CREATE INDEX IF NOT EXISTS quotes_revision_idx
+        ON {schema_name}.quotes (revision)
+    ''')
+
+
+def downgrade():
+    op.execute(f'DROP INDEX IF EXISTS {schema_name}.quotes_revision_idx')
+    op.execute(f'ALTER TABLE {schema_name}.quotes DROP COLUMN IF EXISTS revision')
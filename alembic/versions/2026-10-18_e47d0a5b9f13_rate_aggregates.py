@@ -0,0 +1,44 @@
+"""rate_aggregates
+
+Revision ID: e47d0a5b9f13
+Revises: 9c1e4b7a2d60
+Create Date: 2026-10-18 15:12:08.914523
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from cbr_data_receiver.models import AGGREGATE_PERIODS, UNIT_RATE_SCALE, rate_aggregates_sql, \
+    schema_name
+
+# revision identifiers, used by Alembic.
+revision = 'e47d0a5b9f13'
+down_revision = '9c1e4b7a2d60'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(f'''
+        CREATE TABLE IF NOT EXISTS {schema_name}.rate_aggregates (
+            period varchar NOT NULL,
+            currency varchar NOT NULL,
+            bucket date NOT NULL,
+            min_rate numeric(24, {UNIT_RATE_SCALE}),
+            max_rate numeric(24, {UNIT_RATE_SCALE}),
+            avg_rate numeric(24, {UNIT_RATE_SCALE}),
+            last_rate numeric(24, {UNIT_RATE_SCALE}),
+            last_date date,
+            count integer,
+            PRIMARY KEY (period, currency, bucket)
+        )
+    ''')
+    date_from, date_to = op.get_bind().execute(sa.text(
+        f"SELECT min(date), max(date) FROM {schema_name}.quotes")).fetchone()
+    if date_from is not None:
+        for period in AGGREGATE_PERIODS:
+            op.execute(rate_aggregates_sql(period, date_from, date_to))
+
+
+def downgrade():
+    op.execute(f'DROP TABLE IF EXISTS {schema_name}.rate_aggregates')
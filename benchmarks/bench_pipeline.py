@@ -0,0 +1,186 @@
+"""
+Benchmark suite of the parse, transform and load stages.
+
+Synthetic ValCurs documents (N currencies x M days) go through every
+stage, the throughput and the peak traced memory of each stage are
+reported and saved as JSON, so results of two versions can be compared:
+
+    python -m benchmarks.bench_pipeline --currencies 50 --days 2000
+    python -m benchmarks.bench_pipeline --db -c access.yaml --compare benchmarks/results/old.json
+
+The load stages (--db) write into the database from the service config,
+use a throwaway one.
+"""
+import datetime
+import json
+import os
+import os.path
+import subprocess
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from typing import Any, Callable, Dict, List
+
+import xmltodict
+
+from benchmarks.synthetic import make_days
+from cbr_data_receiver import __verison__
+from cbr_data_receiver.parser import parse_val_curs
+from cbr_data_receiver.worker import CurrenciesTask, QuotesTask
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def parse_bench_args():
+    parser = ArgumentParser("bench_pipeline")
+    parser.add_argument("--currencies", type=int, default=50, help="Currencies per document.")
+    parser.add_argument("--days", type=int, default=1000, help="Number of documents.")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs, the best is kept.")
+    parser.add_argument("--db", action="store_true", help="Also benchmark the DB load paths.")
+    parser.add_argument("--output", type=str, default=None, help="Results file.")
+    parser.add_argument("--compare", type=str, default=None, help="Previous results file.")
+    # The remaining arguments are the ones of the config
+    return parser.parse_known_args(sys.argv[1:])
+
+
+def measure(name: str, stage: Callable[[], Any], items: int,
+            nbytes: int = 0, repeat: int = 3) -> Dict[str, Any]:
+    """
+    Best wall time of the stage, then its peak memory in a separate traced run
+    """
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        stage()
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    stage()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    best = min(seconds)
+    result = {'stage': name, 'items': items, 'seconds': best,
+              'items_per_sec': items / best, 'peak_memory': peak}
+    if nbytes:
+        result['mb_per_sec'] = nbytes / best / 2 ** 20
+    return result
+
+
+def pipeline_stages(currencies: int, days: int, repeat: int) -> List[Dict[str, Any]]:
+    documents = [content for _, content in make_days(currencies, days)]
+    nbytes = sum(len(content) for content in documents)
+    parsed = [parse_val_curs(content) for content in documents]
+    rows = currencies * days
+    return [
+        measure('xmltodict.parse', lambda: [xmltodict.parse(c) for c in documents],
+                rows, nbytes, repeat),
+        measure('parse_val_curs', lambda: [parse_val_curs(c) for c in documents],
+                rows, nbytes, repeat),
+        measure('QuotesTask._get_quotes',
+                lambda: [QuotesTask._get_quotes(d.date, d.valutes) for d in parsed], rows,
+                repeat=repeat),
+        measure('CurrenciesTask._get_currencies',
+                lambda: [CurrenciesTask._get_currencies(d.valutes) for d in parsed], rows,
+                repeat=repeat),
+    ]
+
+
+def load_stages(currencies: int, days: int, repeat: int,
+                config_argv: List[str]) -> List[Dict[str, Any]]:
+    from benchmarks.bench_quotes_load import BENCH_CURRENCY_PREFIX, cleanup
+    from cbr_data_receiver.models import currencies as currencies_table
+    from cbr_data_receiver.singletons import get_config
+    from cbr_data_receiver.worker import PostgreSQLClient
+
+    db_client = PostgreSQLClient.get_client(conf=get_config(config_argv).pgdb)
+    parsed = [parse_val_curs(content) for _, content in make_days(currencies, days)]
+    quotes_rows = [row._replace(currency=f"{BENCH_CURRENCY_PREFIX}{row.currency}")
+                   for d in parsed for row in QuotesTask._get_quotes(d.date, d.valutes)]
+    currencies_rows = [row._replace(id=f"{BENCH_CURRENCY_PREFIX}{row.id}")
+                       for row in CurrenciesTask._get_currencies(parsed[0].valutes)]
+    db_client._create_partitions({row.date.year for row in quotes_rows})
+
+    def load(path):
+        def stage():
+            cleanup(db_client)
+            path(quotes_rows)
+        return stage
+
+    def cleanup_currencies():
+        with db_client.engine.begin() as connection:
+            connection.execute(currencies_table.delete().where(
+                currencies_table.c.id.like(f'{BENCH_CURRENCY_PREFIX}%')))
+
+    def load_currencies(cold):
+        def stage():
+            if cold:
+                # The cache is read again and every currency is written
+                cleanup_currencies()
+                db_client._currency_cache = None
+            db_client.insert_data_currencies(currencies_rows)
+        return stage
+
+    try:
+        return [
+            measure('PostgreSQLClient._insert_data_quotes',
+                    load(db_client._insert_data_quotes), len(quotes_rows), repeat=repeat),
+            measure('PostgreSQLClient._copy_data_quotes',
+                    load(db_client._copy_data_quotes), len(quotes_rows), repeat=repeat),
+            measure('PostgreSQLClient.insert_data_currencies (cold)',
+                    load_currencies(cold=True), len(currencies_rows), repeat=repeat),
+            # The cache holds the currencies of the cold runs, nothing is written
+            measure('PostgreSQLClient.insert_data_currencies (warm)',
+                    load_currencies(cold=False), len(currencies_rows), repeat=repeat),
+        ]
+    finally:
+        cleanup(db_client)
+        cleanup_currencies()
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def report(results: Dict[str, Any], previous: Dict[str, Any] = None) -> None:
+    before = {r['stage']: r for r in (previous or {}).get('stages', [])}
+    print(f"version {results['version']} ({results['revision']}), "
+          f"{results['currencies']} currencies x {results['days']} days")
+    for stage in results['stages']:
+        line = (f"{stage['stage']:>46}: {stage['items_per_sec']:12.0f} items/sec "
+                f"{stage['peak_memory'] / 2 ** 20:9.1f} MiB peak")
+        if stage['stage'] in before:
+            ratio = stage['items_per_sec'] / before[stage['stage']]['items_per_sec']
+            line += f"  x{ratio:.2f} vs {previous['version']} ({previous['revision']})"
+        print(line)
+
+
+def main():
+    params, config_argv = parse_bench_args()
+    stages = pipeline_stages(params.currencies, params.days, params.repeat)
+    if params.db:
+        stages += load_stages(params.currencies, params.days, params.repeat, config_argv)
+    results = {'version': __verison__,
+               'revision': git_revision(),
+               'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'currencies': params.currencies,
+               'days': params.days,
+               'stages': stages}
+    output = params.output or os.path.join(
+        RESULTS_DIR, f"{results['version']}-{results['revision']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    previous = None
+    if params.compare:
+        with open(params.compare) as file:
+            previous = json.load(file)
+    report(results, previous)
+    print(f"Results are saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
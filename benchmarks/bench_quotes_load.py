@@ -0,0 +1,65 @@
+"""
+Benchmark of the quotes load paths: executemany INSERT and COPY.
+
+Runs against the database from the service config, use a throwaway one:
+
+    python benchmarks/bench_quotes_load.py -c access.yaml --rows 100000
+"""
+import datetime
+import sys
+import time
+from argparse import ArgumentParser
+from decimal import Decimal
+
+from cbr_data_receiver.models import quotes
+from cbr_data_receiver.records import Quote
+from cbr_data_receiver.singletons import get_config
+from cbr_data_receiver.worker import PostgreSQLClient
+
+BENCH_CURRENCY_PREFIX = 'BENCH'
+
+
+def parse_bench_args():
+    parser = ArgumentParser("bench_quotes_load")
+    parser.add_argument("--rows", type=int, default=100000, help="Rows per load path.")
+    # The remaining arguments are the ones of the config
+    return parser.parse_known_args(sys.argv[1:])
+
+
+def make_rows(count):
+    start = datetime.date(1992, 7, 1)
+    return [Quote(f'{BENCH_CURRENCY_PREFIX}{i % 50:02d}',
+                  start + datetime.timedelta(days=i // 50),
+                  Decimal(i).scaleb(-3) + 1,
+                  Decimal(i).scaleb(-3) + 1)
+            for i in range(count)]
+
+
+def measure(load, rows):
+    started = time.perf_counter()
+    load(rows)
+    return len(rows) / (time.perf_counter() - started)
+
+
+def cleanup(db_client):
+    with db_client.engine.begin() as connection:
+        connection.execute(quotes.delete().where(
+            quotes.c.currency.like(f'{BENCH_CURRENCY_PREFIX}%')))
+
+
+def main():
+    params, config_argv = parse_bench_args()
+    db_client = PostgreSQLClient.get_client(conf=get_config(config_argv).pgdb)
+    rows = make_rows(params.rows)
+    db_client._create_partitions({row.date.year for row in rows})
+    try:
+        for name, load in (('insert', db_client._insert_data_quotes),
+                           ('copy', db_client._copy_data_quotes)):
+            cleanup(db_client)
+            print(f'{name:>8}: {measure(load, rows):12.0f} rows/sec ({len(rows)} rows)')
+    finally:
+        cleanup(db_client)
+
+
+if __name__ == '__main__':
+    main()
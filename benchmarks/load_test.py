@@ -0,0 +1,151 @@
+"""
+End-to-end load test of the fetch, parse and load pipeline.
+
+Starts the mock CBR API (benchmarks.mock_cbr) in process and runs a
+CbrWorker iteration per day against it and the database from the service
+config, use a throwaway one:
+
+    python -m benchmarks.load_test -c access.yaml --days 500 --concurrency 4 \\
+        --latency 0.02 --error-rate 0.05 --burst-every 200 --burst-length 3
+
+Reports the throughput, the p50/p99 latency of the iterations, the
+responses of the mock by status and the retries. The backoff of the
+requester is scaled by --retry-scale, so that a burst of errors takes
+seconds rather than minutes.
+"""
+import datetime
+import json
+import logging
+import os
+import os.path
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from tenacity import wait_random_exponential
+
+from benchmarks.bench_pipeline import RESULTS_DIR, git_revision
+from benchmarks.bench_quotes_load import BENCH_CURRENCY_PREFIX
+from benchmarks.mock_cbr import API_PATH, add_mock_args, mock_from_args
+from cbr_data_receiver import __verison__
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.metrics import RETRIES
+from cbr_data_receiver.models import currencies, quotes, rate_aggregates
+from cbr_data_receiver.scheduler import RETRY_MAX_WAIT, RETRY_MULTIPLIER
+from cbr_data_receiver.singletons import get_config
+from cbr_data_receiver.worker import CbrWorker, PostgreSQLClient, Requester
+
+
+def parse_load_args():
+    parser = ArgumentParser("load_test")
+    parser.add_argument("--days", type=int, default=200, help="Days to ingest.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent workers.")
+    parser.add_argument("--retry-scale", type=float, default=0.01,
+                        help="Factor of the requester backoff waits.")
+    parser.add_argument("--output", type=str, default=None, help="Results file.")
+    add_mock_args(parser)
+    # The remaining arguments are the ones of the config
+    return parser.parse_known_args(sys.argv[1:])
+
+
+def cleanup(db_client):
+    with db_client.engine.begin() as connection:
+        for table, column in ((rate_aggregates, rate_aggregates.c.currency),
+                              (quotes, quotes.c.currency),
+                              (currencies, currencies.c.id)):
+            connection.execute(table.delete().where(column.like(f'{BENCH_CURRENCY_PREFIX}%')))
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def run_days(api: str, db_client, days: List[datetime.date],
+             concurrency: int) -> Tuple[float, List[Tuple[float, bool]]]:
+    """
+    Ingests the days, every worker thread has its own requester.
+    Returns the elapsed time and the latency and the outcome of every day
+    """
+    config = get_config()
+    local = threading.local()
+
+    def iteration(day):
+        if not hasattr(local, 'requester'):
+            local.requester = Requester(api)
+        started = time.perf_counter()
+        worker = CbrWorker(config=config, db_client=db_client,
+                           requester=local.requester).run_once(day)
+        return time.perf_counter() - started, worker.completed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(iteration, days))
+    return time.perf_counter() - started, results
+
+
+def report(results: Dict[str, Any]) -> None:
+    print(f"version {results['version']} ({results['revision']}), "
+          f"{results['days']} days x {results['currencies']} currencies, "
+          f"concurrency {results['concurrency']}")
+    print(f"{'throughput':>12}: {results['days_per_sec']:.1f} days/sec, "
+          f"{results['rows_per_sec']:.0f} rows/sec")
+    print(f"{'latency':>12}: p50 {results['p50'] * 1000:.1f} ms, "
+          f"p99 {results['p99'] * 1000:.1f} ms, max {results['max'] * 1000:.1f} ms")
+    print(f"{'responses':>12}: " + ', '.join(f"{status}: {count}" for status, count
+                                             in sorted(results['responses'].items())))
+    print(f"{'retries':>12}: {results['retries']}, failed days: {results['failed']}")
+
+
+def main():
+    params, config_argv = parse_load_args()
+    get_logger(logging.WARNING)
+    mock = mock_from_args(params, id_prefix=BENCH_CURRENCY_PREFIX)
+    server = mock.serve()
+    api = f"http://127.0.0.1:{server.server_port}{API_PATH}"
+    Requester._request.retry.wait = wait_random_exponential(
+        multiplier=RETRY_MULTIPLIER * params.retry_scale,
+        max=RETRY_MAX_WAIT * params.retry_scale)
+    db_client = PostgreSQLClient.get_client(conf=get_config(config_argv).pgdb)
+    days = [datetime.date(2000, 1, 1) + datetime.timedelta(days=i) for i in range(params.days)]
+    db_client._create_partitions({day.year for day in days})
+    cleanup(db_client)
+    retries = RETRIES.value()
+    try:
+        elapsed, outcomes = run_days(api, db_client, days, params.concurrency)
+    finally:
+        cleanup(db_client)
+        server.shutdown()
+    latencies = [latency for latency, _ in outcomes]
+    results = {'version': __verison__,
+               'revision': git_revision(),
+               'created': datetime.datetime.now().isoformat(timespec='seconds'),
+               'days': params.days,
+               'currencies': params.currencies,
+               'concurrency': params.concurrency,
+               'mock': {'latency': params.latency, 'jitter': params.jitter,
+                        'error_rate': params.error_rate, 'burst_every': params.burst_every,
+                        'burst_length': params.burst_length},
+               'seconds': elapsed,
+               'days_per_sec': params.days / elapsed,
+               'rows_per_sec': params.days * params.currencies / elapsed,
+               'p50': percentile(latencies, 0.5),
+               'p99': percentile(latencies, 0.99),
+               'max': max(latencies),
+               'responses': {str(status): count for status, count in mock.statuses.items()},
+               'retries': int(RETRIES.value() - retries),
+               'failed': sum(not completed for _, completed in outcomes)}
+    output = params.output or os.path.join(
+        RESULTS_DIR, f"load-{results['version']}-{results['revision']}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    report(results)
+    print(f"Results are saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Local stand-in of the CBR daily rates API for load tests.
+
+Serves synthetic ValCurs documents in windows-1251 on the path of the
+real API, the day is taken from date_req (today without it):
+
+    GET /scripts/XML_daily.asp?date_req=11/06/2022
+
+The latency, the rate of random 500 responses, periodic bursts of 503
+responses and the number of currencies (the payload size) are set on
+the command line:
+
+    python -m benchmarks.mock_cbr --port 8099 --latency 0.05 --error-rate 0.1 \\
+        --burst-every 100 --burst-length 5 --currencies 200
+"""
+import datetime
+import functools
+import hashlib
+import random
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from collections import Counter
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.synthetic import make_val_curs
+
+API_PATH = '/scripts/XML_daily.asp'
+
+
+class MockCbr:
+    """
+    Behaviour of the mock API: a request gets a 503 inside a burst (the
+    first burst_length of every burst_every requests), otherwise a 500
+    with the probability error_rate, otherwise the document of the day.
+    Every response is delayed by latency +- jitter (a fraction) seconds
+    """
+
+    def __init__(self, currencies: int = 50, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, burst_every: int = 0, burst_length: int = 0,
+                 id_prefix: str = 'R', seed: int = 0) -> None:
+        self.currencies = currencies
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.id_prefix = id_prefix
+        self.requests = 0
+        self.statuses: Counter = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._document = functools.lru_cache(maxsize=1024)(self._make_document)
+
+    def respond(self, date_req: Optional[datetime.date]) -> tuple:
+        """
+        Status and body of the next request
+        """
+        with self._lock:
+            number = self.requests
+            self.requests += 1
+            delay = self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            failed = self._random.random() < self.error_rate
+        time.sleep(max(delay, 0))
+        if self.burst_every and number % self.burst_every < self.burst_length:
+            status, body = HTTPStatus.SERVICE_UNAVAILABLE, b''
+        elif failed:
+            status, body = HTTPStatus.INTERNAL_SERVER_ERROR, b''
+        else:
+            status, body = HTTPStatus.OK, self._document(date_req or datetime.date.today())
+        with self._lock:
+            self.statuses[int(status)] += 1
+        return status, body
+
+    def _make_document(self, day: datetime.date) -> bytes:
+        return make_val_curs(self.currencies, day, id_prefix=self.id_prefix)
+
+    def serve(self, bind: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        """
+        Starts the server in a daemon thread, port 0 picks a free one
+        """
+        mock = self
+
+        class MockCbrRequestHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path != API_PATH:
+                    self.send_error(HTTPStatus.NOT_FOUND)
+                    return
+                try:
+                    date_req = parse_qs(url.query).get('date_req')
+                    day = datetime.datetime.strptime(date_req[0], '%d/%m/%Y').date() \
+                        if date_req else None
+                except ValueError:
+                    self.send_error(HTTPStatus.BAD_REQUEST)
+                    return
+                status, body = mock.respond(day)
+                etag = f'"{hashlib.sha1(body).hexdigest()}"'
+                if status == HTTPStatus.OK and self.headers.get('If-None-Match') == etag:
+                    status, body = HTTPStatus.NOT_MODIFIED, b''
+                self.send_response(status)
+                if status == HTTPStatus.OK:
+                    self.send_header('Content-Type', 'application/xml; charset=windows-1251')
+                    self.send_header('ETag', etag)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((bind, port), MockCbrRequestHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def add_mock_args(parser: ArgumentParser) -> None:
+    """
+    Options of the mock API behaviour
+    """
+    parser.add_argument("--currencies", type=int, default=50, help="Currencies per document.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Response delay, seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Spread of the delay, a fraction of the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Probability of a 500 response.")
+    parser.add_argument("--burst-every", type=int, default=0,
+                        help="A burst of 503 responses starts every N requests.")
+    parser.add_argument("--burst-length", type=int, default=0,
+                        help="503 responses in a burst.")
+
+
+def mock_from_args(params, id_prefix: str = 'R') -> MockCbr:
+    return MockCbr(currencies=params.currencies, latency=params.latency,
+                   jitter=params.jitter, error_rate=params.error_rate,
+                   burst_every=params.burst_every, burst_length=params.burst_length,
+                   id_prefix=id_prefix)
+
+
+def main():
+    parser = ArgumentParser("mock_cbr")
+    parser.add_argument("--bind", type=str, default='127.0.0.1', help="The server host.")
+    parser.add_argument("--port", type=int, default=8099, help="The server port.")
+    add_mock_args(parser)
+    params = parser.parse_args(sys.argv[1:])
+    server = mock_from_args(params).serve(params.bind, params.port)
+    print(f"Mock CBR API on http://{params.bind}:{server.server_port}{API_PATH}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Synthetic ValCurs documents for benchmarks and load tests
+"""
+import datetime
+import random
+from typing import Iterator, Tuple
+
+HEADER = '<?xml version="1.0" encoding="windows-1251"?>'
+
+
+def currency_ids(currencies: int, prefix: str = 'R') -> list:
+    """
+    CBR-like ids of the synthetic currencies
+    """
+    return [f'{prefix}{i:05d}' for i in range(currencies)]
+
+
+def make_val_curs(currencies: int, day: datetime.date, seed: int = 0,
+                  id_prefix: str = 'R') -> bytes:
+    """
+    ValCurs document of the day with N currencies, windows-1251 encoded
+    """
+    rnd = random.Random(f'{seed}-{day}')
+    valutes = ''.join(
+        f'<Valute ID="{currency_id}">'
+        f'<NumCode>{i % 1000:03d}</NumCode>'
+        f'<CharCode>{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}{chr(65 + i // 676 % 26)}</CharCode>'
+        f'<Nominal>{10 ** (i % 4)}</Nominal>'
+        f'<Name>Синтетическая валюта {i}</Name>'
+        f'<Value>{rnd.uniform(0.5, 150):.4f}</Value>'.replace('.', ',') +
+        '</Valute>'
+        for i, currency_id in enumerate(currency_ids(currencies, id_prefix)))
+    return (f'{HEADER}<ValCurs Date="{day:%d.%m.%Y}" name="Foreign Currency Market">'
+            f'{valutes}</ValCurs>').encode('windows-1251')
+
+
+def make_days(currencies: int, days: int,
+              start: datetime.date = datetime.date(2000, 1, 1)) -> Iterator[Tuple[datetime.date, bytes]]:
+    """
+    ValCurs documents of M consecutive days
+    """
+    for i in range(days):
+        day = start + datetime.timedelta(days=i)
+        yield day, make_val_curs(currencies, day)
@@ -0,0 +1,405 @@
+"""
+Asyncio runtime of the worker.
+
+Fetches go through one aiohttp session and DB writes through an asyncpg
+connection pool, so a single process can overlap many requests and
+writes without a thread per request. Requires the "async" extra.
+
+The response cache, the SQL and the iteration steps are shared with the
+threaded runtime of the worker module. Blocking work - the cache files,
+the checkpoint, leader election and the tasks without an async version
+(sinks, rate matrix) - runs in the default executor, off the event loop
+"""
+import asyncio
+import datetime
+import sys
+from typing import List, Optional, Tuple, Type
+
+import aiohttp
+import asyncpg
+import sqlalchemy as sa
+from tenacity import RetryError, TryAgain
+
+from cbr_data_receiver.backfill import Backfill, Checkpoint
+from cbr_data_receiver.cache import CachedResponse
+from cbr_data_receiver.metrics import REQUESTS, STAGE_DURATION
+from cbr_data_receiver.models import AGGREGATE_PERIODS, CURRENCIES_SELECT_SQL, \
+    QUOTES_STAGING_DDL, currencies_upsert_sql, quotes_ingested_sql, quotes_merge_sql, \
+    quotes_partition_ddl, quotes_upsert_sql, rate_aggregates_sql
+from cbr_data_receiver.notify import CHANNEL, notification_payloads
+from cbr_data_receiver.parser import ValCurs
+from cbr_data_receiver.profiling import NO_PROFILER, Profiler
+from cbr_data_receiver.records import Currency, CurrencyCache, Quote
+from cbr_data_receiver.scheduler import PublicationScheduler, backoff_retry
+from cbr_data_receiver.singletons import Config, get_config
+from cbr_data_receiver.spool import Spool
+from cbr_data_receiver.worker import BaseRequester, CbrWorker, PostgreSQLClient, count_retry
+
+
+class AsyncRequester(BaseRequester):
+    """
+    Async HTTP client, behaves like Requester
+    """
+
+    def __init__(self, cbrf_api: str, cache_dir: Optional[str] = None,
+                 max_connections: int = 10) -> None:
+        super().__init__(cbrf_api, cache_dir)
+        self._max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> 'AsyncRequester':
+        connector = aiohttp.TCPConnector(limit=self._max_connections)
+        self._session = aiohttp.ClientSession(connector=connector)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._session.close()
+
+    async def make_cbrf_request(self, date_req: Optional[datetime.date] = None) -> Optional[bytes]:
+        """
+        Making a request.
+        Returns None if the response did not change since the last
+        committed response of the same day
+        """
+        loop = asyncio.get_running_loop()
+        cached = await loop.run_in_executor(None, self._cached, date_req)
+        if self._is_final(date_req, cached):
+            REQUESTS.inc(status='cache')
+            return self._changed(date_req, cached.content)
+        return self._changed(date_req, await self._request(date_req, cached))
+
+    @backoff_retry(aiohttp.ClientError, asyncio.TimeoutError, before_sleep=count_retry)
+    async def _request(self, date_req: Optional[datetime.date],
+                       cached: Optional[CachedResponse]) -> bytes:
+        """
+        In case of unsuccessful result, repeat with a backoff.
+        """
+        async with self._session.get(self._cbrf_api, params=self._request_params(date_req),
+                                     headers=self._conditional_headers(cached)) as result:
+            REQUESTS.inc(status=str(result.status))
+            if result.status == 304 and cached:
+                return cached.content
+            if result.status == 200:
+                content = await result.read()
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._store, date_req, content, result.headers)
+                return content
+        raise TryAgain
+
+
+class AsyncPostgreSQLClient:
+    """
+    Async PostgreSQL DB client with a connection pool,
+    has the same methods as PostgreSQLClient
+    """
+    POOL_SIZE = 10
+
+    def __init__(self, conf: Config) -> None:
+        self.conf = conf
+        self._bulk_threshold = conf.get('bulk_threshold', PostgreSQLClient.BULK_THRESHOLD)
+        self._partition_years: set = set()
+        self._currency_cache: Optional[CurrencyCache] = None
+        self._notify_channel = conf.get('notify_channel', CHANNEL)
+        self.pool: Optional[asyncpg.Pool] = None
+
+    @classmethod
+    async def get_client(cls, **options):
+        """
+        Creates DB client
+        """
+        self = cls(**options)
+        await self._init_connect()
+        return self
+
+    async def _init_connect(self) -> None:
+        """
+        Initializes the connection pool
+        """
+        self.pool = await asyncpg.create_pool(user=self.conf['user'],
+                                              password=self.conf['password'],
+                                              host=self.conf['host'],
+                                              port=self.conf['port'],
+                                              database=self.conf['dbname'],
+                                              max_size=self.conf.get('pool_size', self.POOL_SIZE))
+
+    async def close(self) -> None:
+        """
+        Closes the connection pool
+        """
+        await self.pool.close()
+
+    async def insert_data_quotes(self, data_lst: List[Quote]) -> None:
+        """
+        Adds data to the quotes table.
+        Large batches are loaded with COPY, small ones are inserted.
+        Quotes already in the table are updated only if the value changed.
+        The listeners are notified of the changed quotes on commit.
+        The aggregates of the loaded dates are updated once the quotes are committed
+        """
+        if not data_lst:
+            return
+        await self._create_partitions({row.date.year for row in data_lst})
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                if len(data_lst) >= self._bulk_threshold:
+                    await connection.execute(QUOTES_STAGING_DDL)
+                    await connection.copy_records_to_table(
+                        'quotes_staging', records=data_lst, columns=Quote._fields)
+                    changed = await connection.fetch(quotes_merge_sql())
+                else:
+                    # One statement cannot update a row twice, the last row wins
+                    unique_rows = {(row.currency, row.date): row for row in data_lst}
+                    changed = await connection.fetch(quotes_upsert_sql('$1', '$2', '$3', '$4'),
+                                                     *map(list, zip(*unique_rows.values())))
+                for payload in notification_payloads(changed):
+                    await connection.execute("SELECT pg_notify($1, $2)",
+                                             self._notify_channel, payload)
+        date_from = min(row.date for row in data_lst)
+        date_to = max(row.date for row in data_lst)
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                for period in AGGREGATE_PERIODS:
+                    await connection.execute(rate_aggregates_sql(period, date_from, date_to))
+
+    async def _create_partitions(self, years: set) -> None:
+        """
+        Creates the yearly partitions of the quotes table,
+        which were not created by this client yet
+        """
+        for year in sorted(years - self._partition_years):
+            await self.pool.execute(quotes_partition_ddl(year))
+            self._partition_years.add(year)
+
+    async def is_quotes_ingested(self, date: datetime.date, currency_ids: List[str]) -> bool:
+        """
+        Checks whether the quotes of all the currencies are already
+        in the quotes table for the date
+        """
+        count = await self.pool.fetchval(quotes_ingested_sql('$1', '$2'), date, currency_ids)
+        return count >= len(set(currency_ids))
+
+    async def insert_data_currencies(self, data_lst: List[Currency]) -> None:
+        """
+        Adds data to the currencies table.
+        In case of conflict currencies_pkey, update the data.
+        Only the currencies changed since the last load are sent,
+        the cache is read again when it expires
+        """
+        if self._currency_cache is None or self._currency_cache.expired:
+            rows = await self.pool.fetch(CURRENCIES_SELECT_SQL)
+            self._currency_cache = CurrencyCache(
+                (Currency(*row) for row in rows),
+                ttl=self.conf.get('currency_cache_ttl', PostgreSQLClient.CURRENCY_CACHE_TTL))
+        changed = self._currency_cache.changed(data_lst)
+        if not changed:
+            return
+        await self.pool.executemany(currencies_upsert_sql('$1', '$2', '$3', '$4'), changed)
+        self._currency_cache.update(changed)
+
+
+class AsyncCbrWorker(CbrWorker):
+    """
+    Async counterpart of CbrWorker, runs the same tasks.
+    The tasks without start_async run in the executor
+    with the sync DB client
+    """
+    DB_UNAVAILABLE: Tuple[Type[BaseException], ...] = (
+        OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, sa.exc.OperationalError)
+
+    def __init__(self, config: Config,
+                 db_client: AsyncPostgreSQLClient,
+                 requester: AsyncRequester,
+                 scheduler: Optional[PublicationScheduler] = None,
+                 tasks: Optional[List[type]] = None,
+                 spool: Optional[Spool] = None,
+                 profiler: Profiler = NO_PROFILER,
+                 sync_db_client: Optional[PostgreSQLClient] = None) -> None:
+        super().__init__(config=config, db_client=db_client, requester=requester,
+                         scheduler=scheduler, tasks=tasks, spool=spool, profiler=profiler)
+        self._sync_db_client = sync_db_client
+
+    async def start(self):
+        """
+        Starts running tasks
+        """
+        await self.run_once()
+        self._logger.info('Waiting for the next iteration ...')
+        await self._wait_for_the_next_iteration()
+        return self
+
+    async def run_once(self, date_req: Optional[datetime.date] = None):
+        """
+        Fetches, parses and stores the rates of one day
+        """
+        with self._profiler.iteration():
+            await self._run_iteration(date_req)
+        return self
+
+    async def _run_iteration(self, date_req: Optional[datetime.date]) -> None:
+        try:
+            with STAGE_DURATION.time(stage='fetch'):
+                server_response = await self._requester.make_cbrf_request(date_req)
+        except RetryError:
+            self._fetch_failed()
+            server_response = None
+        else:
+            self._fetched(server_response)
+        if server_response is not None:
+            document = self._parse(server_response)
+            spooled = False
+            for task in self._tasks:
+                if not self._params['completed']:
+                    break
+                try:
+                    with self._profiler.stage(task.__name__), \
+                            STAGE_DURATION.time(stage='task', task=task.__name__):
+                        await self._start_task(task, document)
+                except self.DB_UNAVAILABLE:
+                    if self._spool is None:
+                        raise
+                    self._spool_document(task, document)
+                    spooled = True
+                    break
+            self._complete(date_req, document, spooled)
+        self._finish()
+
+    async def _start_task(self, task: type, document: ValCurs) -> None:
+        if hasattr(task, 'start_async'):
+            await task.start_async(document, self._db_client, self._params)
+        else:
+            await asyncio.get_running_loop().run_in_executor(
+                None, task.start, document, self._sync_db_client, self._params)
+
+    async def _wait_for_the_next_iteration(self):
+        """
+        Wait for the next publication, or poll while it is expected
+        """
+        await asyncio.sleep(self._scheduler.next_delay(self._date))
+
+
+class AsyncBackfill(Backfill):
+    """
+    Backfill on the async clients.
+    The days of a batch are fetched concurrently, at most "workers"
+    at a time, while the previous batch is loaded into the DB
+    """
+
+    def __init__(self, requester: AsyncRequester,
+                 db_client: AsyncPostgreSQLClient,
+                 *args, **kwargs) -> None:
+        super().__init__(requester, db_client, *args, **kwargs)
+
+    async def run(self, date_from: datetime.date, date_to: datetime.date) -> None:
+        """
+        Starts the backfill, resuming an interrupted one
+        """
+        loop = asyncio.get_running_loop()
+        done = await loop.run_in_executor(None, self._checkpoint.load)
+        if done:
+            self._logger.info(f"Resuming backfill after {done}")
+            date_from = done + datetime.timedelta(days=1)
+        semaphore = asyncio.Semaphore(self._workers)
+        loading: Optional[asyncio.Future] = None
+        for batch in self._batches(date_from, date_to):
+            documents = await asyncio.gather(*(self._fetch_async(day, semaphore)
+                                               for day in batch))
+            if loading is not None:
+                await loading
+            loading = asyncio.ensure_future(
+                self._load_async(batch[-1], self._collect([doc for doc in documents if doc])))
+        if loading is not None:
+            await loading
+        await loop.run_in_executor(None, self._checkpoint.clear)
+
+    async def _fetch_async(self, day: datetime.date,
+                           semaphore: asyncio.Semaphore) -> Optional[ValCurs]:
+        async with semaphore:
+            server_response = await self._requester.make_cbrf_request(day)
+        return self._parse(day, server_response)
+
+    async def _load_async(self, done: datetime.date,
+                          rows: Tuple[List[Currency], List[Quote]]) -> None:
+        currencies_data, quotes_data = rows
+        if quotes_data:
+            await self._db_client.insert_data_currencies(currencies_data)
+            await self._db_client.insert_data_quotes(quotes_data)
+        await asyncio.get_running_loop().run_in_executor(None, self._checkpoint.save, done)
+        self._logger.info(f"Backfill loaded up to {done}")
+
+
+async def run(config: Config) -> int:
+    """
+    Async worker loop, wired like the threaded one of run.main.
+    Leader election and the spool drainer use a sync DB client
+    """
+    # run.py imports the worker modules lazily, it is safe to import here
+    from cbr_data_receiver.run import LEADER_POLL_INTERVAL, get_fanout, get_profiler, \
+        get_spool, get_tasks
+    from cbr_data_receiver.spool import SpoolDrainer
+
+    loop = asyncio.get_running_loop()
+    sync_db_client = await loop.run_in_executor(
+        None, lambda: PostgreSQLClient.get_client(conf=config.pgdb))
+    db_client = await AsyncPostgreSQLClient.get_client(conf=config.pgdb)
+    spool = get_spool(config)
+    fanout = get_fanout(config)
+    scheduler = PublicationScheduler.from_config(config.schedule)
+    drainer = SpoolDrainer(spool, sync_db_client)
+    if config.once:
+        await loop.run_in_executor(None, drainer.drain_pending)
+    else:
+        drainer.start()
+    if config.metrics and not config.once:
+        from cbr_data_receiver.metrics import start_metrics_server
+        start_metrics_server(config.metrics.get('bind', '127.0.0.1'), config.metrics['port'])
+    try:
+        async with AsyncRequester(config.cbrf_api, cache_dir=config.cache_dir) as requester:
+            worker_options = dict(config=config,
+                                  db_client=db_client,
+                                  requester=requester,
+                                  scheduler=scheduler,
+                                  tasks=get_tasks(config, fanout),
+                                  spool=spool,
+                                  profiler=get_profiler(config),
+                                  sync_db_client=sync_db_client)
+            if config.once:
+                # Like run.run_once, the leader lock is not taken
+                worker = await AsyncCbrWorker(**worker_options).run_once()
+                return 0 if worker.completed else 1
+            while True:
+                if not await loop.run_in_executor(None, sync_db_client.acquire_leadership):
+                    # Another replica runs the ingest loop
+                    await asyncio.sleep(LEADER_POLL_INTERVAL)
+                    continue
+                await AsyncCbrWorker(**worker_options).start()
+    finally:
+        await loop.run_in_executor(None, sync_db_client.release_leadership)
+        await db_client.close()
+        if fanout is not None:
+            fanout.close()
+
+
+async def run_backfill(config: Config, params) -> None:
+    """
+    Runs the backfill of the CLI params on the async clients
+    """
+    db_client = await AsyncPostgreSQLClient.get_client(conf=config.pgdb)
+    try:
+        async with AsyncRequester(config.cbrf_api, cache_dir=config.cache_dir,
+                                  max_connections=params.workers) as requester:
+            await AsyncBackfill(requester=requester,
+                                db_client=db_client,
+                                checkpoint=Checkpoint(params.checkpoint,
+                                                      params.date_from, params.date_to),
+                                workers=params.workers,
+                                batch_size=params.batch_size).run(params.date_from,
+                                                                  params.date_to)
+    finally:
+        await db_client.close()
+
+
+def main():
+    """
+    Async runtime entrypoint
+    """
+    sys.exit(asyncio.run(run(get_config())))
@@ -0,0 +1,189 @@
+"""
+Historical backfill module
+"""
+import datetime
+import json
+import os.path
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from cbr_data_receiver import config_system_dir
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.parser import ParsingError, ValCurs, parse_val_curs
+from cbr_data_receiver.records import Currency, Quote
+from cbr_data_receiver.singletons import get_config
+from cbr_data_receiver.worker import CurrenciesTask, PostgreSQLClient, QuotesTask, Requester
+
+
+def parse_backfill_args():
+    parser = ArgumentParser("cbr_data_receiver_backfill")
+
+    parser.add_argument(
+        "--from", dest="date_from", type=datetime.date.fromisoformat, required=True,
+        help="First day of the range, YYYY-MM-DD.")
+    parser.add_argument(
+        "--to", dest="date_to", type=datetime.date.fromisoformat, required=True,
+        help="Last day of the range, YYYY-MM-DD.")
+    parser.add_argument(
+        "-w", "--workers", type=int, required=False, default=8,
+        help="Number of concurrent requests to the CBR API.")
+    parser.add_argument(
+        "--batch-size", type=int, required=False, default=64,
+        help="Number of days loaded into the DB at once.")
+    parser.add_argument(
+        "--checkpoint", type=str, required=False,
+        default=os.path.join(config_system_dir(), "backfill_checkpoint.json"),
+        help="File with the backfill progress.")
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true",
+        help="Run on the asyncio clients, requires the async extra.")
+    # The remaining arguments are the ones of the config
+    return parser.parse_known_args(sys.argv[1:])
+
+
+class Checkpoint:
+    """
+    Backfill progress, all the days up to the saved one are loaded
+    """
+
+    def __init__(self, filename: str,
+                 date_from: datetime.date,
+                 date_to: datetime.date) -> None:
+        self._filename = filename
+        self._range = [date_from.isoformat(), date_to.isoformat()]
+
+    def load(self) -> Optional[datetime.date]:
+        """
+        Returns the last loaded day of the same range, if any
+        """
+        try:
+            with open(self._filename) as file:
+                state = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if state.get("range") != self._range:
+            return None
+        return datetime.date.fromisoformat(state["done"])
+
+    def save(self, done: datetime.date) -> None:
+        """
+        Atomically saves the last loaded day
+        """
+        tmp_filename = f"{self._filename}.tmp"
+        with open(tmp_filename, "w") as file:
+            json.dump({"range": self._range, "done": done.isoformat()}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_filename, self._filename)
+
+    def clear(self) -> None:
+        """
+        Removes the progress of a finished backfill
+        """
+        if os.path.exists(self._filename):
+            os.remove(self._filename)
+
+
+class Backfill:
+    """
+    Loads the rates of every day in the range.
+    Days are fetched concurrently and loaded into the DB batch by batch,
+    the checkpoint is moved after every loaded batch
+    """
+
+    def __init__(self, requester: Requester,
+                 db_client: PostgreSQLClient,
+                 checkpoint: Checkpoint,
+                 workers: int = 8,
+                 batch_size: int = 64) -> None:
+        self._requester = requester
+        self._db_client = db_client
+        self._checkpoint = checkpoint
+        self._workers = workers
+        self._batch_size = batch_size
+        self._loaded_dates: set = set()
+        self._logger = get_logger()
+
+    def run(self, date_from: datetime.date, date_to: datetime.date) -> None:
+        """
+        Starts the backfill, resuming an interrupted one
+        """
+        done = self._checkpoint.load()
+        if done:
+            self._logger.info(f"Resuming backfill after {done}")
+            date_from = done + datetime.timedelta(days=1)
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            for batch in self._batches(date_from, date_to):
+                documents = executor.map(self._fetch, batch)
+                self._load([doc for doc in documents if doc])
+                self._checkpoint.save(batch[-1])
+                self._logger.info(f"Backfill loaded up to {batch[-1]}")
+        self._checkpoint.clear()
+
+    def _batches(self, date_from: datetime.date,
+                 date_to: datetime.date) -> Iterator[List[datetime.date]]:
+        batch = []
+        day = date_from
+        while day <= date_to:
+            batch.append(day)
+            if len(batch) == self._batch_size:
+                yield batch
+                batch = []
+            day += datetime.timedelta(days=1)
+        if batch:
+            yield batch
+
+    def _fetch(self, day: datetime.date) -> Optional[ValCurs]:
+        return self._parse(day, self._requester.make_cbrf_request(day))
+
+    def _parse(self, day: datetime.date, server_response: Optional[bytes]) -> Optional[ValCurs]:
+        if server_response is None:
+            return None
+        try:
+            return parse_val_curs(server_response)
+        except ParsingError as exc:
+            self._logger.warning(f"Rates for {day} were not parsed: {exc}")
+        return None
+
+    def _load(self, documents: List[ValCurs]) -> None:
+        currencies_data, quotes_data = self._collect(documents)
+        if quotes_data:
+            self._db_client.insert_data_currencies(currencies_data)
+            self._db_client.insert_data_quotes(quotes_data)
+
+    def _collect(self, documents: List[ValCurs]) -> Tuple[List[Currency], List[Quote]]:
+        """
+        Days without a publication repeat the previous document,
+        so every document date is loaded only once
+        """
+        quotes_data: List[Quote] = []
+        currencies_data: Dict[str, Currency] = {}
+        for document in documents:
+            if document.date in self._loaded_dates:
+                continue
+            self._loaded_dates.add(document.date)
+            quotes_data.extend(QuotesTask._get_quotes(document.date, document.valutes))
+            for currency in CurrenciesTask._get_currencies(document.valutes):
+                currencies_data[currency.id] = currency
+        return list(currencies_data.values()), quotes_data
+
+
+def main():
+    """
+    Backfill entrypoint
+    """
+    params, config_argv = parse_backfill_args()
+    config = get_config(config_argv)
+    if params.use_async:
+        # aiohttp and asyncpg are optional dependencies
+        import asyncio
+        from cbr_data_receiver.async_worker import run_backfill
+        asyncio.run(run_backfill(config, params))
+        return
+    Backfill(requester=Requester(config.cbrf_api, cache_dir=config.cache_dir),
+             db_client=PostgreSQLClient.get_client(conf=config.pgdb),
+             checkpoint=Checkpoint(params.checkpoint, params.date_from, params.date_to),
+             workers=params.workers,
+             batch_size=params.batch_size).run(params.date_from, params.date_to)
@@ -0,0 +1,43 @@
+"""
+Bulk loading helpers for PostgreSQL COPY
+"""
+from typing import Any, Iterable, Iterator, Sequence
+
+_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value: Any) -> str:
+    """
+    Formats a value for the COPY text format
+    """
+    if value is None:
+        return '\\N'
+    return str(value).translate(_ESCAPES)
+
+
+class CopyReader:
+    """
+    File-like object streaming rows to COPY ... FROM STDIN,
+    the rows are formatted lazily, while the server reads them.
+    Columns are the attributes of the row records
+    """
+
+    def __init__(self, rows: Iterable[Any], columns: Sequence[str]) -> None:
+        self._lines = self._iter_lines(rows, columns)
+        self._buffer = ''
+
+    @staticmethod
+    def _iter_lines(rows: Iterable[Any], columns: Sequence[str]) -> Iterator[str]:
+        for row in rows:
+            yield '\t'.join(copy_value(getattr(row, column)) for column in columns) + '\n'
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
@@ -0,0 +1,63 @@
+"""
+On-disk cache of the CBR API responses
+"""
+import hashlib
+import json
+import os
+import os.path
+import threading
+from typing import Dict, NamedTuple, Optional
+
+
+class CachedResponse(NamedTuple):
+    """
+    Response body with the validators used for conditional requests
+    """
+    content: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+
+class ResponseCache:
+    """
+    Stores the responses in a directory, one body file and
+    one metadata file per request URL and date_req
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self._cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url: str, params: Optional[Dict[str, str]]) -> str:
+        key = url if not params else f"{url}?date_req={params.get('date_req', '')}"
+        return os.path.join(self._cache_dir, hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, url: str, params: Optional[Dict[str, str]] = None) -> Optional[CachedResponse]:
+        """
+        Returns the cached response, if any
+        """
+        path = self._path(url, params)
+        try:
+            with open(f"{path}.json") as file:
+                meta = json.load(file)
+            with open(f"{path}.xml", "rb") as file:
+                content = file.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        return CachedResponse(content, meta.get("etag"), meta.get("last_modified"))
+
+    def put(self, url: str, params: Optional[Dict[str, str]], response: CachedResponse) -> None:
+        """
+        Atomically replaces the cached response
+        """
+        path = self._path(url, params)
+        self._write(f"{path}.xml", response.content)
+        self._write(f"{path}.json", json.dumps({"etag": response.etag,
+                                                 "last_modified": response.last_modified}).encode())
+
+    @staticmethod
+    def _write(filename: str, content: bytes) -> None:
+        tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_filename, "wb") as file:
+            file.write(content)
+        os.replace(tmp_filename, filename)
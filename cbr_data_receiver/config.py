@@ -10,13 +10,27 @@ class Config:
     """
     raw = None
     loglevel = None
+    bind = None
+    port = None
+    once = False
+    profile = False
 
     def __init__(self, config_file, **params):
         self.loglevel = params.get("loglevel", 'INFO')
+        self.bind = params.get("bind", '127.0.0.1')
+        self.port = params.get("port", 8080)
+        self.once = params.get("once", False)
+        self.profile = params.get("profile", False)
 
         with open(config_file) as file:
             self.raw = yaml.safe_load(file)
 
         self.pgdb = self.raw["postgres"]
         self.cbrf_api = self.raw["cbrf_api"]
-        self.waiting_time = self.raw["waiting_time"]
+        self.schedule = self.raw.get("schedule", {})
+        self.cache_dir = self.raw.get("cache_dir")
+        self.matrix_dir = self.raw.get("matrix_dir")
+        self.metrics = self.raw.get("metrics")
+        self.spool_file = self.raw.get("spool_file")
+        self.sinks = self.raw.get("sinks")
+        self.profiling = self.raw.get("profiling")
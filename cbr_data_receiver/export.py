@@ -0,0 +1,218 @@
+"""
+Incremental Parquet export of the quotes joined with the currencies.
+
+Files are partitioned by year and month:
+
+    <output>/year=2022/month=06/part-2022-06-01.parquet
+
+Only the dates after the last exported one are written, the last
+exported date and the number of exported rows of every month are kept in
+the state file of the output directory. A month whose number of rows in
+the DB has changed since, e.g. by a backfill of older dates, is written
+again, as are the months from --since on. Requires the "export" extra.
+"""
+import datetime
+import json
+import os
+import os.path
+import sys
+from argparse import ArgumentParser
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlalchemy as sa
+
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.models import UNIT_RATE_SCALE, VALUE_SCALE, schema_name
+from cbr_data_receiver.singletons import get_config
+from cbr_data_receiver.worker import PostgreSQLClient
+
+SCHEMA = pa.schema([
+    ('date', pa.date32()),
+    ('currency', pa.string()),
+    ('code', pa.string()),
+    ('name_rus', pa.string()),
+    ('nominal', pa.int32()),
+    ('value', pa.decimal128(18, VALUE_SCALE)),
+    ('unit_rate', pa.decimal128(24, UNIT_RATE_SCALE)),
+])
+
+
+def parse_export_args():
+    parser = ArgumentParser("cbr_data_receiver_export")
+
+    parser.add_argument(
+        "-o", "--output", type=str, required=True,
+        help="Directory of the Parquet dataset.")
+    parser.add_argument(
+        "--batch-size", type=int, required=False, default=50000,
+        help="Number of rows fetched from the DB at once.")
+    parser.add_argument(
+        "--since", type=datetime.date.fromisoformat, required=False, default=None,
+        help="Export again the months from this date (YYYY-MM-DD) on.")
+    # The remaining arguments are the ones of the config
+    return parser.parse_known_args(sys.argv[1:])
+
+
+class ParquetExporter:
+    """
+    Streams the new quotes from the DB into the Parquet dataset
+    """
+    STATE_FILE = '_export_state.json'
+
+    def __init__(self, output: str, batch_size: int = 50000) -> None:
+        self._output = output
+        self._batch_size = batch_size
+        self._logger = get_logger()
+
+    @property
+    def last_date(self) -> Optional[datetime.date]:
+        """
+        The last exported date
+        """
+        last_date = self._read_state()['last_date']
+        return datetime.date.fromisoformat(last_date) if last_date else None
+
+    def export(self, engine: sa.engine.Engine, since: Optional[datetime.date] = None) -> int:
+        """
+        Exports the dates after the last exported one and the months
+        changed in the DB since they were exported, or starting from since.
+        Rows are read with a server-side cursor, batch by batch.
+        Returns the number of exported rows
+        """
+        count_stmt = sa.text(f"""
+            SELECT to_char(q.date, 'YYYY-MM') AS month, count(*) AS rows
+            FROM {schema_name}.quotes q
+            JOIN {schema_name}.currencies c ON c.id = q.currency
+            WHERE q.date <= :last_date
+            GROUP BY 1
+        """)
+        stmt = sa.text(f"""
+            SELECT q.date, q.currency, c.code, c.name_rus, c.nominal, q.value, q.unit_rate
+            FROM {schema_name}.quotes q
+            JOIN {schema_name}.currencies c ON c.id = q.currency
+            WHERE q.date > :after OR date_trunc('month', q.date)::date = ANY(:months)
+            ORDER BY q.date, q.currency
+        """)
+        last_date = self.last_date
+        exported = self._read_state()['months']
+        with engine.connect() as connection:
+            stale = []
+            if last_date:
+                counts = {row.month: row.rows for row in
+                          connection.execute(count_stmt, last_date=last_date)}
+                stale = self._stale_months(counts, exported, since)
+            for month in stale:
+                self._remove_month(month)
+                exported.pop(month, None)
+            if stale:
+                self._logger.info(f"Months {', '.join(stale)} are exported again")
+            result = connection.execution_options(stream_results=True).execute(
+                stmt, after=last_date or datetime.date.min,
+                months=[datetime.date.fromisoformat(f"{month}-01") for month in stale])
+            return self.write(iter(lambda: result.fetchmany(self._batch_size), []), exported)
+
+    def write(self, batches: Iterable[list], months: Optional[Dict[str, int]] = None) -> int:
+        """
+        Writes the batches of rows ordered by date, one file per month.
+        months are the rows of the exported months the written rows are
+        added to, those of the state by default.
+        The state is saved once all the files are closed
+        """
+        state = self._read_state()
+        months = dict(state['months'] if months is None else months)
+        writer, month, last_date, count = None, None, None, 0
+        try:
+            for rows in batches:
+                for month_key, month_rows in self._split_by_month(rows):
+                    if month_key != month:
+                        if writer:
+                            writer.close()
+                        writer, month = self._open_writer(month_rows[0][0]), month_key
+                    writer.write_table(pa.Table.from_pylist(
+                        [dict(row._mapping) if hasattr(row, '_mapping') else dict(row)
+                         for row in month_rows], schema=SCHEMA))
+                    months[month_key] = months.get(month_key, 0) + len(month_rows)
+                    last_date = month_rows[-1][0]
+                    count += len(month_rows)
+        finally:
+            if writer:
+                writer.close()
+        # Rewritten months precede the last exported date
+        last_date = max(filter(None, (last_date, self.last_date)), default=None)
+        if last_date:
+            self._save_state(last_date, months)
+        self._logger.info(f"{count} rows were exported up to {last_date}")
+        return count
+
+    @staticmethod
+    def _stale_months(counts: Dict[str, int], exported: Dict[str, int],
+                      since: Optional[datetime.date] = None) -> List[str]:
+        """
+        The months (YYYY-MM) whose rows in the DB differ from the exported
+        ones, and all the months from since on
+        """
+        first = f"{since:%Y-%m}" if since else None
+        return sorted(month for month in set(counts) | set(exported)
+                      if counts.get(month) != exported.get(month)
+                      or first is not None and month >= first)
+
+    @staticmethod
+    def _split_by_month(rows: list) -> Iterable[Tuple[str, list]]:
+        start = 0
+        for i in range(1, len(rows) + 1):
+            if i == len(rows) or (rows[i][0].year, rows[i][0].month) != \
+                    (rows[start][0].year, rows[start][0].month):
+                yield f"{rows[start][0]:%Y-%m}", rows[start:i]
+                start = i
+
+    def _month_directory(self, year: int, month: int) -> str:
+        return os.path.join(self._output, f"year={year}", f"month={month:02d}")
+
+    def _remove_month(self, month: str) -> None:
+        """
+        Removes the files of the month (YYYY-MM) before it is written again
+        """
+        year, month_number = month.split('-')
+        directory = self._month_directory(int(year), int(month_number))
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(directory, name))
+
+    def _open_writer(self, first_date: datetime.date) -> pq.ParquetWriter:
+        """
+        The file is named by its first date, so an export interrupted
+        before saving the state overwrites its files when repeated
+        """
+        directory = self._month_directory(first_date.year, first_date.month)
+        os.makedirs(directory, exist_ok=True)
+        return pq.ParquetWriter(os.path.join(directory, f"part-{first_date}.parquet"), SCHEMA)
+
+    def _read_state(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self._output, self.STATE_FILE)) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return {'last_date': None, 'months': {}}
+        # The months of a state saved without them are written again
+        state.setdefault('months', {})
+        return state
+
+    def _save_state(self, last_date: datetime.date, months: Dict[str, int]) -> None:
+        filename = os.path.join(self._output, self.STATE_FILE)
+        with open(f"{filename}.tmp", 'w') as file:
+            json.dump({'last_date': last_date.isoformat(), 'months': months}, file)
+        os.replace(f"{filename}.tmp", filename)
+
+
+def main():
+    """
+    Exporter entrypoint
+    """
+    params, config_argv = parse_export_args()
+    config = get_config(config_argv)
+    db_client = PostgreSQLClient.get_client(conf=config.pgdb)
+    ParquetExporter(params.output, params.batch_size).export(db_client.engine, params.since)
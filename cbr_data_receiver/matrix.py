@@ -0,0 +1,370 @@
+"""
+Memory-mapped rate matrix.
+
+The quotes history is kept as a dense dates x currencies float64 array
+of unit rates (value / nominal), stored in a file and opened with
+numpy.memmap, so several processes share one copy through the page
+cache. Days are rows in date order, currencies are columns, missing
+quotes are NaN. Every update reads only the quotes changed since the
+previous one, by the revision column of the quotes table: the corrected
+rates of the dates in the matrix are written in place and newer dates
+are appended. Quotes of a date missing between the rows, e.g. after a
+backfill of older dates, rebuild the matrix. Requires the "matrix" extra.
+
+    matrix = RateMatrix.open('/var/lib/cbr_data_receiver/matrix')
+    usd = matrix.column('R01235')
+    returns = log_returns(matrix.values)
+"""
+import datetime
+import json
+import os
+import os.path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import sqlalchemy as sa
+
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.metrics import STAGE_ERRORS
+from cbr_data_receiver.models import schema_name
+from cbr_data_receiver.parser import ValCurs
+from cbr_data_receiver.singletons import get_config
+from cbr_data_receiver.worker import PostgreSQLClient
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+class RateMatrix:
+    """
+    Dates x currencies matrix of unit rates.
+    The meta file is the commit point: it holds the number of rows and the
+    currency columns, data written after it is ignored by the readers
+    """
+    META_FILE = 'meta.json'
+    CAPACITY = 128
+
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._meta = self._read_meta()
+
+    @classmethod
+    def open(cls, path: str) -> 'RateMatrix':
+        """
+        Opens the matrix for reading
+        """
+        return cls(path)
+
+    @property
+    def currencies(self) -> List[str]:
+        """
+        CBR ids of the currency columns
+        """
+        return self._meta['currencies']
+
+    @property
+    def last_date(self) -> Optional[datetime.date]:
+        """
+        Date of the last row
+        """
+        if not self._meta['rows']:
+            return None
+        return EPOCH + datetime.timedelta(days=int(self._dates_map()[-1]))
+
+    @property
+    def dates(self) -> np.ndarray:
+        """
+        Row dates as datetime64[D]
+        """
+        return self._dates_map().astype('datetime64[D]')
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        Read-only memory-mapped unit rates, rows x currencies
+        """
+        rows, capacity = self._meta['rows'], self._meta['capacity']
+        if not rows:
+            return np.empty((0, len(self.currencies)))
+        values = np.memmap(self._file('rates', 'f8'), dtype='<f8', mode='r',
+                           shape=(rows, capacity))
+        return values[:, :len(self.currencies)]
+
+    def column(self, currency: str) -> np.ndarray:
+        """
+        Unit rates of one currency
+        """
+        return self.values[:, self.currencies.index(currency)]
+
+    def update(self, engine: sa.engine.Engine) -> int:
+        """
+        Applies the quotes changed in the DB since the last update.
+        Returns the number of the corrected and appended rows,
+        all the rows on a rebuild
+        """
+        with engine.connect() as connection:
+            # The transactions before the snapshot xmin are finished, the
+            # quotes of the later ones are read again by the next update
+            revision = connection.execute(sa.text(
+                "SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")).scalar()
+            # A matrix of the version without revisions is rebuilt
+            rebuild = 'revision' not in self._meta and self._meta['rows'] > 0
+            if not rebuild:
+                quotes_by_date = self._changed_quotes(connection, self._meta.get('revision', 0))
+                rebuild = self._has_missing_dates(quotes_by_date)
+            if rebuild:
+                get_logger().info("Quotes were added between the rows of the rate matrix, "
+                                  "it is rebuilt")
+                quotes_by_date = self._changed_quotes(connection, 0)
+        if rebuild:
+            rows = self.replace(quotes_by_date)
+        else:
+            last_date = self.last_date
+            rows = self.correct({day: quotes for day, quotes in quotes_by_date.items()
+                                 if last_date is not None and day <= last_date})
+            rows += self.append({day: quotes for day, quotes in quotes_by_date.items()
+                                 if last_date is None or day > last_date})
+        self._write_meta(dict(self._meta, revision=revision))
+        return rows
+
+    @staticmethod
+    def _changed_quotes(connection: sa.engine.Connection,
+                        revision: int) -> Dict[datetime.date, Dict[str, float]]:
+        """
+        Unit rates of the quotes changed since the revision, by date
+        """
+        stmt = sa.text(f"""
+            SELECT date, currency, unit_rate::float8 AS unit_rate
+            FROM {schema_name}.quotes
+            WHERE revision >= :revision
+            ORDER BY date
+        """)
+        quotes_by_date: Dict[datetime.date, Dict[str, float]] = {}
+        result = connection.execution_options(stream_results=True).execute(
+            stmt, revision=revision)
+        for row in result:
+            quotes_by_date.setdefault(row.date, {})[row.currency] = row.unit_rate
+        return quotes_by_date
+
+    def _has_missing_dates(self, quotes_by_date: Dict[datetime.date, Dict[str, float]]) -> bool:
+        """
+        Whether some dates up to the last row are not rows of the matrix
+        """
+        last_date = self.last_date
+        older = [day for day in quotes_by_date if last_date is not None and day <= last_date]
+        return len(self._row_numbers(older)) < len(older)
+
+    def _row_numbers(self, dates: List[datetime.date]) -> np.ndarray:
+        """
+        Numbers of the rows of the dates, the dates missing in the matrix are skipped
+        """
+        day_numbers = np.array([(day - EPOCH).days for day in dates], dtype='<i4')
+        rows = np.searchsorted(self._dates_map(), day_numbers)
+        found = rows < self._meta['rows']
+        found[found] = self._dates_map()[rows[found]] == day_numbers[found]
+        return rows[found]
+
+    @property
+    def quotes_count(self) -> int:
+        """
+        Number of the quotes in the matrix, not NaN
+        """
+        return int(np.count_nonzero(~np.isnan(self.values)))
+
+    def correct(self, quotes_by_date: Dict[datetime.date, Dict[str, float]]) -> int:
+        """
+        Writes the rates of the dates already in the matrix in place
+        """
+        if not quotes_by_date:
+            return 0
+        currencies = self._currencies_of(quotes_by_date)
+        dates = sorted(quotes_by_date)
+        rows = self._row_numbers(dates)
+        if len(rows) < len(dates):
+            raise ValueError("Only the dates of the matrix rows are corrected")
+        values = np.memmap(self._file('rates', 'f8'), dtype='<f8', mode='r+',
+                           shape=(self._meta['rows'], self._meta['capacity']))
+        columns = {currency: i for i, currency in enumerate(currencies)}
+        for row, day in zip(rows, dates):
+            for currency, unit_rate in quotes_by_date[day].items():
+                values[row, columns[currency]] = unit_rate
+        values.flush()
+        del values
+        self._write_meta(dict(self._meta, currencies=currencies))
+        return len(dates)
+
+    def replace(self, quotes_by_date: Dict[datetime.date, Dict[str, float]]) -> int:
+        """
+        Replaces all the rows, the readers keep the old files until they
+        open the matrix again
+        """
+        if not quotes_by_date:
+            return 0
+        old_files = [self._file('rates', 'f8'), self._file('dates', 'i4')]
+        meta = self._meta
+        # Committed by the append into the files of the next generation
+        self._meta = dict(meta, generation=meta['generation'] + 1, rows=0, currencies=[])
+        try:
+            rows = self.append(quotes_by_date)
+        except BaseException:
+            self._meta = meta
+            raise
+        for filename in old_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+        return rows
+
+    def append(self, quotes_by_date: Dict[datetime.date, Dict[str, float]]) -> int:
+        """
+        Appends rows, dates must be newer than the last row
+        """
+        if not quotes_by_date:
+            return 0
+        currencies = self._currencies_of(quotes_by_date)
+        dates = sorted(quotes_by_date)
+        block = np.full((len(dates), self._meta['capacity']), np.nan, dtype='<f8')
+        columns = {currency: i for i, currency in enumerate(currencies)}
+        for row, day in enumerate(dates):
+            for currency, unit_rate in quotes_by_date[day].items():
+                block[row, columns[currency]] = unit_rate
+        day_numbers = np.array([(day - EPOCH).days for day in dates], dtype='<i4')
+
+        rows = self._meta['rows']
+        os.makedirs(self._path, exist_ok=True)
+        self._append_file(self._file('rates', 'f8'), block, rows * block.shape[1] * 8)
+        self._append_file(self._file('dates', 'i4'), day_numbers, rows * 4)
+        self._write_meta(dict(self._meta, rows=rows + len(dates), currencies=currencies))
+        return len(dates)
+
+    def _currencies_of(self, quotes_by_date: Dict[datetime.date, Dict[str, float]]) -> List[str]:
+        """
+        Currency columns with the new currencies of the quotes,
+        the capacity is extended if they do not fit
+        """
+        currencies = list(self.currencies)
+        for day_quotes in quotes_by_date.values():
+            currencies.extend(c for c in day_quotes if c not in currencies)
+        if len(currencies) > self._meta['capacity']:
+            self._extend_capacity(len(currencies))
+        return currencies
+
+    def _extend_capacity(self, columns: int) -> None:
+        """
+        Copies the matrix into files with a larger capacity
+        """
+        capacity = self._meta['capacity']
+        while capacity < columns:
+            capacity *= 2
+        get_logger().info(f"Rate matrix capacity is extended to {capacity} currencies")
+        rows = self._meta['rows']
+        generation = self._meta['generation'] + 1
+        values = np.full((rows, capacity), np.nan, dtype='<f8')
+        values[:, :len(self.currencies)] = self.values
+        old_files = [self._file('rates', 'f8'), self._file('dates', 'i4')]
+        meta = dict(self._meta, generation=generation, capacity=capacity)
+        values.tofile(self._file('rates', 'f8', meta))
+        np.array(self._dates_map()).tofile(self._file('dates', 'i4', meta))
+        self._write_meta(meta)
+        for filename in old_files:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _dates_map(self) -> np.ndarray:
+        if not self._meta['rows']:
+            return np.empty(0, dtype='<i4')
+        return np.memmap(self._file('dates', 'i4'), dtype='<i4', mode='r',
+                         shape=(self._meta['rows'],))
+
+    def _file(self, name: str, suffix: str, meta: Optional[Dict[str, Any]] = None) -> str:
+        generation = (meta or self._meta)['generation']
+        return os.path.join(self._path, f"{name}.{generation}.{suffix}")
+
+    @staticmethod
+    def _append_file(filename: str, array: np.ndarray, committed_size: int) -> None:
+        """
+        Drops the data of an interrupted append and appends the array
+        """
+        with open(filename, 'ab') as file:
+            file.truncate(committed_size)
+            file.write(array.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _read_meta(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self._path, self.META_FILE)) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'generation': 0, 'rows': 0, 'capacity': self.CAPACITY, 'currencies': []}
+
+    def _write_meta(self, meta: Dict[str, Any]) -> None:
+        os.makedirs(self._path, exist_ok=True)
+        filename = os.path.join(self._path, self.META_FILE)
+        with open(f"{filename}.tmp", 'w') as file:
+            json.dump(meta, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{filename}.tmp", filename)
+        self._meta = meta
+
+
+def log_returns(values: np.ndarray) -> np.ndarray:
+    """
+    Day to day log returns of every currency
+    """
+    return np.diff(np.log(values), axis=0)
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Rolling mean over the rows, computed with cumulative sums
+    """
+    cumsum = np.cumsum(np.insert(values, 0, 0.0, axis=0), axis=0)
+    return (cumsum[window:] - cumsum[:-window]) / window
+
+
+def rolling_volatility(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Rolling standard deviation of the log returns
+    """
+    returns = log_returns(values)
+    mean = rolling_mean(returns, window)
+    mean_square = rolling_mean(returns ** 2, window)
+    return np.sqrt(np.maximum(mean_square - mean ** 2, 0.0))
+
+
+class RateMatrixTask:
+    """
+    Task extends the rate matrix with the ingested document.
+    Bound to the matrix directory with RateMatrixTask.bind
+    """
+    path: str
+
+    @classmethod
+    def bind(cls, path: str) -> type:
+        """
+        Returns the task class writing into the matrix directory
+        """
+        return type(cls.__name__, (cls,), {'path': path})
+
+    @classmethod
+    def start(cls, document: ValCurs, db_client: PostgreSQLClient,
+              params: Dict[str, Any]) -> None:
+        """
+        Starting the rate matrix task, the quotes are already in the DB.
+        The matrix is an optional output, its errors do not fail the iteration
+        """
+        try:
+            RateMatrix(cls.path).update(db_client.engine)
+        except Exception as exc:
+            STAGE_ERRORS.inc(stage='task', task=cls.__name__)
+            get_logger().error(f"The rate matrix was not updated: {exc!r}")
+
+
+def main():
+    """
+    Brings the rate matrix up to date with the DB
+    """
+    config = get_config()
+    db_client = PostgreSQLClient.get_client(conf=config.pgdb)
+    rows = RateMatrix(config.matrix_dir).update(db_client.engine)
+    get_logger().info(f"{rows} dates were added to the rate matrix")
@@ -0,0 +1,306 @@
+"""
+Worker metrics.
+
+Counters, gauges and latency histograms of the worker stages, served in
+the Prometheus text exposition format:
+
+    GET /metrics
+
+The endpoint is started by the worker when the "metrics" section is set
+in the config.
+"""
+import datetime
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.scheduler import MSK
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+LabelValues = Tuple[str, ...]
+M = TypeVar('M', bound='Metric')
+
+
+class Metric(ABC):
+    """
+    Base class of the metrics, keeps the values by label values
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _format_labels(self, values: LabelValues, extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labels, values)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        Sample lines of the metric in the text exposition format
+        """
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}',
+                f'# TYPE {self.name} {self.type}'] + self.samples()
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Increments the value of the labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._format_labels(key)} {_number(value)}'
+                for key, value in values]
+
+
+class Gauge(Metric):
+    """
+    Value that is set, or computed by a function on every scrape
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], Optional[float]]] = None) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._function = function
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Sets the value of the labels
+        """
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels: str) -> Optional[float]:
+        if self._function:
+            return self._function()
+        return self._values.get(self._key(labels))
+
+    def samples(self) -> List[str]:
+        if self._function:
+            value = self._function()
+            return [] if value is None else [f'{self.name} {_number(value)}']
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._format_labels(key)} {_number(value)}'
+                for key, value in values]
+
+
+class Histogram(Metric):
+    """
+    Distribution of the observed values over cumulative buckets
+    """
+    type = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = BUCKETS) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: bucket counts, the last one is +Inf, and the sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Adds the value to the distribution of the labels
+        """
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observes the duration of the block in seconds
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(counts), self._sums[key])
+                           for key, counts in self._counts.items())
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _number(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': le})} "
+                             f"{cumulative}")
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {_number(total)}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {cumulative}')
+        return lines
+
+
+class Registry:
+    """
+    Collection of the metrics rendered by the endpoint
+    """
+
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: M) -> M:
+        """
+        Adds the metric to the registry
+        """
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Renders all the metrics in the text exposition format
+        """
+        return ''.join(line + '\n' for metric in self._metrics for line in metric.render())
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    'cbr_stage_duration_seconds',
+    'Duration of the worker stages: fetch, parse, transform and write of every task.',
+    labels=('stage', 'task')))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'cbr_stage_errors_total', 'Failed worker stages.', labels=('stage', 'task')))
+ITERATIONS = REGISTRY.register(Counter(
+    'cbr_iterations_total', 'Worker iterations by outcome.', labels=('outcome',)))
+REQUESTS = REGISTRY.register(Counter(
+    'cbr_requester_responses_total',
+    'CBR API responses by source: "200", "304", "cache" or another HTTP status.',
+    labels=('status',)))
+RETRIES = REGISTRY.register(Counter(
+    'cbr_requester_retries_total', 'Retried CBR API requests.'))
+ROWS = REGISTRY.register(Counter(
+    'cbr_rows_total', 'Rows passed to the DB by table.', labels=('table',)))
+SINK_BATCHES = REGISTRY.register(Counter(
+    'cbr_sink_batches_total', 'Batches of rows by sink and outcome '
+    '(delivered, spooled, replayed, failed, dropped).',
+    labels=('sink', 'outcome')))
+SINK_RETRIES = REGISTRY.register(Counter(
+    'cbr_sink_retries_total', 'Retried sink writes.', labels=('sink',)))
+LEADER = REGISTRY.register(Gauge(
+    'cbr_leader', '1 if the replica is the leader running the ingest loop, 0 on standby.'))
+LAST_DATE = REGISTRY.register(Gauge(
+    'cbr_last_date_timestamp_seconds',
+    'Start of the @Date (Moscow time) of the last successfully ingested document.'))
+LAST_SUCCESS = REGISTRY.register(Gauge(
+    'cbr_last_success_timestamp_seconds', 'Time of the last successful iteration.'))
+
+
+def _staleness() -> Optional[float]:
+    # The CBR publishes the rates of the next day, their @Date starts later
+    last_date = LAST_DATE.value()
+    return None if last_date is None else max(time.time() - last_date, 0.0)
+
+
+STALENESS = REGISTRY.register(Gauge(
+    'cbr_data_staleness_seconds', 'Seconds since the start of the last ingested @Date '
+    '(Moscow time), 0 until it starts.',
+    function=_staleness))
+
+
+def count_retry(retry_state) -> None:
+    """
+    Counts the retries of the CBR API requests, tenacity before_sleep hook
+    """
+    RETRIES.inc()
+
+
+def set_last_date(date: datetime.date) -> None:
+    """
+    Records the @Date of a successfully ingested document,
+    the dates are Moscow days like those of the scheduler
+    """
+    LAST_DATE.set(datetime.datetime.combine(date, datetime.time(tzinfo=MSK)).timestamp())
+    LAST_SUCCESS.set(time.time())
+
+
+def start_metrics_server(bind: str, port: int,
+                         registry: Registry = REGISTRY) -> 'ThreadingHTTPServer':
+    """
+    Serves the metrics from a daemon thread.
+    http.server is imported here, a worker without the endpoint does not load it
+    """
+    from http import HTTPStatus
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        """
+        HTTP handler of the metrics endpoint
+        """
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(HTTPStatus.NOT_FOUND)
+                return
+            body = registry.render().encode()
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            get_logger().debug(f"{self.address_string()} {format % args}")
+
+    server = ThreadingHTTPServer((bind, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    get_logger().info(f"Metrics are served on {bind}:{port}/metrics")
+    return server
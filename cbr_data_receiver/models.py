@@ -1,5 +1,9 @@
-from sqlalchemy.schema import Column, Table, MetaData, ForeignKey
-from sqlalchemy.types import Integer, String, Date, Float
+import datetime
+from typing import Tuple
+
+from sqlalchemy.schema import Column, Table, MetaData, ForeignKey, Index
+from sqlalchemy.sql import text
+from sqlalchemy.types import BigInteger, Integer, String, Date, Numeric
 
 metadata = MetaData()
 schema_name = 'cbr_data'
@@ -11,9 +15,150 @@ currencies = Table('currencies', metadata,
                    Column('nominal', Integer),
                    schema=schema_name)
 
+# Exact rates: CBR values have 4 decimal places,
+# unit_rate is value / nominal, computed at ingestion
+VALUE_SCALE = 4
+UNIT_RATE_SCALE = 12
+
+# Id of the transaction that inserted or last changed the quote,
+# the rate matrix reads the quotes changed since its last update
+CURRENT_REVISION = "pg_current_xact_id()::text::bigint"
+
+# Partitioned by year, see quotes_partition_ddl
 quotes = Table('quotes', metadata,
                Column('id', Integer, primary_key=True, autoincrement=True),
                Column('currency', String),
-               Column('date', Date),
-               Column('value', Float),
-               schema=schema_name)
+               Column('date', Date, primary_key=True),
+               Column('value', Numeric(18, VALUE_SCALE)),
+               Column('unit_rate', Numeric(24, UNIT_RATE_SCALE)),
+               Column('revision', BigInteger, nullable=False,
+                      server_default=text(CURRENT_REVISION)),
+               Index('quotes_currency_date_idx', 'currency', 'date', unique=True),
+               Index('quotes_date_brin_idx', 'date', postgresql_using='brin'),
+               Index('quotes_revision_idx', 'revision'),
+               schema=schema_name,
+               postgresql_partition_by='RANGE (date)')
+
+
+def quotes_partition_ddl(year: int) -> str:
+    """
+    DDL of the quotes partition for the year
+    """
+    return (f"CREATE TABLE IF NOT EXISTS {schema_name}.quotes_y{year} "
+            f"PARTITION OF {schema_name}.quotes "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')")
+
+
+# Staging table of the quotes loaded with COPY, merged by quotes_merge_sql.
+# seq numbers the rows in the COPY order, the COPY names the other columns
+QUOTES_STAGING_DDL = ("CREATE TEMPORARY TABLE quotes_staging "
+                      "(currency varchar, date date, value numeric, unit_rate numeric, "
+                      "seq bigserial) ON COMMIT DROP")
+CURRENCIES_SELECT_SQL = f"SELECT id, name_rus, code, nominal FROM {schema_name}.currencies"
+
+
+def _quotes_upsert(rows: str) -> str:
+    return (f"INSERT INTO {schema_name}.quotes AS q (currency, date, value, unit_rate) {rows} "
+            f"ON CONFLICT (currency, date) DO UPDATE "
+            f"SET value = EXCLUDED.value, unit_rate = EXCLUDED.unit_rate, "
+            f"revision = {CURRENT_REVISION} "
+            f"WHERE (q.value, q.unit_rate) IS DISTINCT FROM "
+            f"(EXCLUDED.value, EXCLUDED.unit_rate) "
+            f"RETURNING currency, date")
+
+
+def quotes_upsert_sql(currency: str, date: str, value: str, unit_rate: str) -> str:
+    """
+    Upsert of the quotes passed as arrays of the columns, the arguments are
+    the placeholders of the driver. A quote is updated only if its value
+    changed, the keys of the inserted and changed quotes are returned
+    """
+    return _quotes_upsert(f"SELECT * FROM unnest(CAST({currency} AS varchar[]), "
+                          f"CAST({date} AS date[]), CAST({value} AS numeric[]), "
+                          f"CAST({unit_rate} AS numeric[]))")
+
+
+def quotes_merge_sql() -> str:
+    """
+    Upsert of the quotes of the staging table, as quotes_upsert_sql.
+    One statement cannot update a row twice, the last copied row wins
+    """
+    return _quotes_upsert("SELECT DISTINCT ON (currency, date) currency, date, value, unit_rate "
+                          "FROM quotes_staging ORDER BY currency, date, seq DESC")
+
+
+def quotes_ingested_sql(date: str, currency_ids: str) -> str:
+    """
+    Number of the quotes of the currencies (an array) for the date,
+    the arguments are the placeholders of the driver
+    """
+    return (f"SELECT count(*) FROM {schema_name}.quotes "
+            f"WHERE date = {date} AND currency = ANY(CAST({currency_ids} AS varchar[]))")
+
+
+def currencies_upsert_sql(id: str, name_rus: str, code: str, nominal: str) -> str:
+    """
+    Upsert of a currency, the arguments are the placeholders of the driver
+    """
+    return (f"INSERT INTO {schema_name}.currencies (id, name_rus, code, nominal) "
+            f"VALUES ({id}, {name_rus}, {code}, {nominal}) "
+            f"ON CONFLICT ON CONSTRAINT currencies_pkey DO UPDATE SET "
+            f"name_rus = EXCLUDED.name_rus, code = EXCLUDED.code, nominal = EXCLUDED.nominal")
+
+
+# Min/max/avg/last unit rate of every currency by day, week, month and year.
+# A bucket is identified by its first day, weeks start on Monday
+AGGREGATE_PERIODS = ('day', 'week', 'month', 'year')
+
+rate_aggregates = Table('rate_aggregates', metadata,
+                        Column('period', String, primary_key=True),
+                        Column('currency', String, primary_key=True),
+                        Column('bucket', Date, primary_key=True),
+                        Column('min_rate', Numeric(24, UNIT_RATE_SCALE)),
+                        Column('max_rate', Numeric(24, UNIT_RATE_SCALE)),
+                        Column('avg_rate', Numeric(24, UNIT_RATE_SCALE)),
+                        Column('last_rate', Numeric(24, UNIT_RATE_SCALE)),
+                        Column('last_date', Date),
+                        Column('count', Integer),
+                        schema=schema_name)
+
+
+def bucket_bounds(period: str, date_from: datetime.date,
+                  date_to: datetime.date) -> Tuple[datetime.date, datetime.date]:
+    """
+    First day of the bucket of date_from and the day after the bucket of date_to
+    """
+    if period == 'day':
+        return date_from, date_to + datetime.timedelta(days=1)
+    if period == 'week':
+        return (date_from - datetime.timedelta(days=date_from.weekday()),
+                date_to + datetime.timedelta(days=7 - date_to.weekday()))
+    if period == 'month':
+        end = date_to.replace(day=28) + datetime.timedelta(days=4)
+        return date_from.replace(day=1), end.replace(day=1)
+    if period == 'year':
+        return date_from.replace(month=1, day=1), datetime.date(date_to.year + 1, 1, 1)
+    raise ValueError(f"Unknown aggregate period {period}")
+
+
+def rate_aggregates_sql(period: str, date_from: datetime.date, date_to: datetime.date) -> str:
+    """
+    Recomputes the buckets of the period covering the dates from the quotes,
+    the rows of the unchanged buckets are not rewritten
+    """
+    start, end = bucket_bounds(period, date_from, date_to)
+    return (f"INSERT INTO {schema_name}.rate_aggregates AS a "
+            f"(period, currency, bucket, min_rate, max_rate, avg_rate, last_rate, last_date, count) "
+            f"SELECT '{period}', currency, date_trunc('{period}', date::timestamp)::date, "
+            f"min(unit_rate), max(unit_rate), round(avg(unit_rate), {UNIT_RATE_SCALE}), "
+            f"(array_agg(unit_rate ORDER BY date DESC))[1], max(date), count(*) "
+            f"FROM {schema_name}.quotes "
+            f"WHERE date >= '{start}' AND date < '{end}' AND unit_rate IS NOT NULL "
+            f"GROUP BY 2, 3 "
+            f"ON CONFLICT (period, currency, bucket) DO UPDATE SET "
+            f"min_rate = EXCLUDED.min_rate, max_rate = EXCLUDED.max_rate, "
+            f"avg_rate = EXCLUDED.avg_rate, last_rate = EXCLUDED.last_rate, "
+            f"last_date = EXCLUDED.last_date, count = EXCLUDED.count "
+            f"WHERE (a.min_rate, a.max_rate, a.avg_rate, a.last_rate, a.last_date, a.count) "
+            f"IS DISTINCT FROM (EXCLUDED.min_rate, EXCLUDED.max_rate, EXCLUDED.avg_rate, "
+            f"EXCLUDED.last_rate, EXCLUDED.last_date, EXCLUDED.count)")
@@ -0,0 +1,138 @@
+"""
+Notifications of the new rates.
+
+Every quotes load sends a NOTIFY on the cbr_quotes channel for each date
+with inserted or changed quotes, the payload is
+
+    {"date": "2022-06-11", "currencies": ["R01010", "R01020A"]}
+
+A payload must be shorter than 8000 bytes, so the currencies of a date
+are split over several notifications when needed. The notifications are
+delivered when the load commits. RatesListener blocks on the connection
+socket until one arrives, without polling:
+
+    with RatesListener(config.pgdb) as listener:
+        for notification in listener:
+            ...
+
+The notifications sent while the listener is disconnected are lost,
+so a consumer checks the latest date after (re)connecting.
+"""
+import datetime
+import json
+import select
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import psycopg2
+from psycopg2 import sql
+
+CHANNEL = 'cbr_quotes'
+# Bytes, pg_notify rejects payloads of 8000 bytes and longer
+MAX_PAYLOAD = 7999
+
+
+class RatesNotification(NamedTuple):
+    """
+    The date and the currencies of the quotes added or changed by a load
+    """
+    date: datetime.date
+    currencies: List[str]
+
+
+def notification_payloads(rows: Iterable[Tuple[str, datetime.date]],
+                          max_payload: int = MAX_PAYLOAD) -> List[str]:
+    """
+    Payloads of the notifications by date for the (currency, date)
+    pairs of the changed quotes, each at most max_payload bytes
+    """
+    by_date: Dict[datetime.date, List[str]] = {}
+    for currency, date in rows:
+        by_date.setdefault(date, []).append(currency)
+    payloads = []
+    for date, currencies in sorted(by_date.items()):
+        empty = _payload(date, [])
+        batch: List[str] = []
+        size = len(empty)
+        for currency in sorted(currencies):
+            # The quoted id and the separator
+            currency_size = len(json.dumps(currency).encode()) + (2 if batch else 0)
+            if batch and size + currency_size > max_payload:
+                payloads.append(_payload(date, batch))
+                batch, size = [], len(empty)
+                currency_size -= 2
+            batch.append(currency)
+            size += currency_size
+        payloads.append(_payload(date, batch))
+    return payloads
+
+
+def _payload(date: datetime.date, currencies: List[str]) -> str:
+    return json.dumps({'date': date.isoformat(), 'currencies': currencies})
+
+
+class RatesListener:
+    """
+    Blocking subscriber of the rates notifications
+    """
+    CONNECT_TIMEOUT = 5
+
+    def __init__(self, conf: Dict[str, Any], channel: str = CHANNEL) -> None:
+        self.conf = conf
+        self._channel = channel
+        self._connection = None
+        self._pending: Deque[RatesNotification] = deque()
+
+    def __enter__(self) -> 'RatesListener':
+        self.connect()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[RatesNotification]:
+        while True:
+            yield self.wait()
+
+    def connect(self) -> None:
+        """
+        Opens the connection and starts listening on the channel
+        """
+        self._connection = psycopg2.connect(user=self.conf['user'],
+                                            password=self.conf['password'],
+                                            host=self.conf['host'],
+                                            port=self.conf['port'],
+                                            dbname=self.conf['dbname'],
+                                            connect_timeout=self.conf.get(
+                                                'connect_timeout', self.CONNECT_TIMEOUT))
+        self._connection.autocommit = True
+        with self._connection.cursor() as cursor:
+            cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self._channel)))
+
+    def close(self) -> None:
+        """
+        Closes the connection
+        """
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[RatesNotification]:
+        """
+        Blocks until a notification arrives, returns None on timeout.
+        A lost connection raises psycopg2.OperationalError
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._pending:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            if not select.select([self._connection], [], [], remaining)[0]:
+                return None
+            self._connection.poll()
+            while self._connection.notifies:
+                notify = self._connection.notifies.pop(0)
+                if notify.channel == self._channel:
+                    payload = json.loads(notify.payload)
+                    self._pending.append(RatesNotification(
+                        datetime.date.fromisoformat(payload['date']), payload['currencies']))
+        return self._pending.popleft()
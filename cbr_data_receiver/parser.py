@@ -0,0 +1,116 @@
+"""
+CBR response parser module.
+
+The ValCurs document is read with a pull parser: every Valute element
+is turned into a record as soon as it is closed and then dropped from
+the tree, so memory stays flat however large the response is.
+"""
+import datetime
+from typing import IO, Iterable, Iterator, List, NamedTuple, Optional, Union
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+CHUNK_SIZE = 64 * 1024
+
+Source = Union[str, bytes, IO[bytes]]
+
+
+class ParsingError(Exception):
+    """
+    The server response does not look like a ValCurs document
+    """
+
+
+class Valute(NamedTuple):
+    """
+    Single currency record of the ValCurs document
+    """
+    id: str
+    num_code: str
+    char_code: str
+    nominal: str
+    name: str
+    value: str
+
+
+class ValCurs(NamedTuple):
+    """
+    Parsed ValCurs document, shared by all worker tasks
+    """
+    date: datetime.date
+    valutes: List[Valute]
+
+
+class ValCursReader:
+    """
+    Streaming reader of the ValCurs document.
+    The document date is available as soon as the root element is read
+    """
+
+    def __init__(self, source: Source) -> None:
+        self._source = source
+        self.date: Optional[datetime.date] = None
+
+    def __iter__(self) -> Iterator[Valute]:
+        parser = XMLPullParser(events=('start', 'end'))
+        root = None
+        try:
+            for chunk in _iter_chunks(self._source):
+                parser.feed(chunk)
+                for event, elem in parser.read_events():
+                    if event == 'start':
+                        if root is None:
+                            root = self._read_root(elem)
+                    elif elem.tag == 'Valute' and root is not None:
+                        yield _get_valute(elem)
+                        root.clear()
+            parser.close()
+        except ParseError as exc:
+            raise ParsingError(exc) from exc
+        if root is None:
+            raise ParsingError('Empty server response')
+
+    def _read_root(self, elem):
+        if elem.tag != 'ValCurs':
+            raise ParsingError(f'Unexpected root element {elem.tag}')
+        date = elem.get('Date')
+        if date is None:
+            raise ParsingError('ValCurs Date attribute is missing')
+        try:
+            self.date = datetime.datetime.strptime(date, '%d.%m.%Y').date()
+        except ValueError as exc:
+            raise ParsingError(exc) from exc
+        return elem
+
+
+def parse_val_curs(server_response: Source) -> ValCurs:
+    """
+    Parses the server response once into a ValCurs document.
+    Raises ParsingError if the date or the currencies are missing
+    """
+    reader = ValCursReader(server_response)
+    valutes = list(reader)
+    if not valutes:
+        raise ParsingError('ValCurs has no Valute elements')
+    return ValCurs(date=reader.date, valutes=valutes)
+
+
+def _iter_chunks(source: Source) -> Iterable[Union[str, bytes]]:
+    if isinstance(source, (str, bytes)):
+        for i in range(0, len(source), CHUNK_SIZE):
+            yield source[i:i + CHUNK_SIZE]
+        return
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _get_valute(elem) -> Valute:
+    fields = {child.tag: (child.text or '').strip() for child in elem}
+    return Valute(id=elem.get('ID', ''),
+                  num_code=fields.get('NumCode', ''),
+                  char_code=fields.get('CharCode', ''),
+                  nominal=fields.get('Nominal', ''),
+                  name=fields.get('Name', ''),
+                  value=fields.get('Value', ''))
@@ -0,0 +1,146 @@
+"""
+Opt-in profiling of the worker iterations.
+
+With profiling on, every iteration runs under cProfile and the parse and
+task stages are wrapped in tracemalloc snapshots. The iteration writes
+<dir>/iteration-<timestamp>.prof (open it with pstats or snakeviz) and a
+.txt summary, the top entries by cumulative time and the top allocations
+of every stage, which is also logged. Enabled by the "profiling" config
+section or --profile:
+
+    profiling:
+      dir: /var/tmp/cbr_data_receiver/profiles
+      cprofile: true
+      tracemalloc: true
+      top: 20
+
+When profiling is off, the hooks return a shared no-op context manager.
+"""
+import datetime
+import io
+import os
+import os.path
+import tempfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from cbr_data_receiver.logger import get_logger
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Profiler:
+    """
+    Profiles the worker iterations and their stages
+    """
+    DIRECTORY = os.path.join(tempfile.gettempdir(), 'cbr_data_receiver_profiles')
+    TOP = 20
+    # Frames of the traceback stored per allocation
+    TRACEMALLOC_FRAMES = 1
+
+    def __init__(self, directory: str = DIRECTORY, cprofile: bool = False,
+                 tracemalloc: bool = False, top: int = TOP) -> None:
+        self._directory = directory
+        self._cprofile = cprofile
+        self._tracemalloc = tracemalloc
+        self._top = top
+        # Stage snapshots of the current profiled iteration
+        self._snapshots: Optional[List[Tuple[str, Any, Any]]] = None
+
+    @classmethod
+    def from_config(cls, profiling: Optional[Dict[str, Any]],
+                    enabled: bool = False) -> 'Profiler':
+        """
+        Creates the profiler from the "profiling" config section,
+        enabled (--profile) turns on both profilers
+        """
+        profiling = profiling or {}
+        return cls(directory=profiling.get('dir', cls.DIRECTORY),
+                   cprofile=enabled or profiling.get('cprofile', False),
+                   tracemalloc=enabled or profiling.get('tracemalloc', False),
+                   top=profiling.get('top', cls.TOP))
+
+    @property
+    def enabled(self) -> bool:
+        return self._cprofile or self._tracemalloc
+
+    def iteration(self) -> ContextManager[None]:
+        """
+        Profiles the worker iteration run in the context
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._profile_iteration()
+
+    def stage(self, name: str) -> ContextManager[None]:
+        """
+        Reports the memory allocated by the stage run in the context
+        """
+        if not self._tracemalloc or self._snapshots is None:
+            return _NULL_CONTEXT
+        return self._trace_stage(name)
+
+    @contextmanager
+    def _profile_iteration(self) -> Iterator[None]:
+        # Loaded only with profiling on
+        import cProfile
+
+        self._snapshots = []
+        started_tracing = self._tracemalloc and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.TRACEMALLOC_FRAMES)
+        profile = cProfile.Profile() if self._cprofile else None
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            try:
+                self._dump(profile)
+            except OSError as exc:
+                get_logger().warning(f"The iteration profile is not saved: {exc}")
+            finally:
+                if started_tracing:
+                    tracemalloc.stop()
+                self._snapshots = None
+
+    @contextmanager
+    def _trace_stage(self, name: str) -> Iterator[None]:
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            # Filtered and compared in _dump, out of the cProfile profile
+            self._snapshots.append((name, before, tracemalloc.take_snapshot()))
+
+    def _dump(self, profile: Any) -> None:
+        """
+        Writes the cProfile stats and the summary, logs the summary
+        """
+        import pstats
+
+        stamp = datetime.datetime.now().strftime('%Y%m%dT%H%M%S.%f')
+        os.makedirs(self._directory, exist_ok=True)
+        path = os.path.join(self._directory, f"iteration-{stamp}")
+        report = []
+        if profile is not None:
+            profile.dump_stats(f"{path}.prof")
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(self._top)
+            report.append(stream.getvalue().strip())
+        own_traces = (tracemalloc.Filter(False, tracemalloc.__file__),)
+        for name, before, after in self._snapshots:
+            stats = after.filter_traces(own_traces).compare_to(
+                before.filter_traces(own_traces), 'lineno')[:self._top]
+            report.append(f"Top {len(stats)} allocations of {name}:")
+            report.extend(f"  {stat}" for stat in stats)
+        summary = '\n'.join(report)
+        with open(f"{path}.txt", 'w') as file:
+            file.write(summary + '\n')
+        get_logger().info(f"The iteration profile is saved to {path}.*\n{summary}")
+
+
+NO_PROFILER = Profiler()
@@ -0,0 +1,76 @@
+"""
+Rows of the quotes and currencies tables.
+
+Tuples without a per-row dict, fields are in the column order. asyncpg
+takes the records as they are, the SQLAlchemy statements bind them by
+name with _asdict() and COPY reads their attributes.
+"""
+import datetime
+import time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Union
+
+
+class Quote(NamedTuple):
+    """
+    Row of the quotes table
+    """
+    currency: str
+    date: datetime.date
+    value: Decimal
+    unit_rate: Decimal
+
+
+class Currency(NamedTuple):
+    """
+    Row of the currencies table
+    """
+    id: str
+    name_rus: str
+    code: str
+    nominal: int
+
+
+Record = Union[Quote, Currency]
+
+
+def json_default(value: Any) -> str:
+    """
+    Encodes the dates and decimals of the records for json.dumps
+    """
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+class CurrencyCache:
+    """
+    Currencies as they are stored in the DB. The dimension almost never
+    changes, so only the currencies that differ from the cached ones are sent.
+    Other writers (the backfill, another replica) change the table too, so
+    the cache expires after ttl seconds and is read again
+    """
+
+    def __init__(self, rows: Iterable[Currency] = (), ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self._rows: Dict[str, Currency] = {row.id: row for row in rows}
+        self._clock = clock
+        self._expires_at = None if ttl is None else clock() + ttl
+
+    @property
+    def expired(self) -> bool:
+        return self._expires_at is not None and self._clock() >= self._expires_at
+
+    def changed(self, rows: Iterable[Currency]) -> List[Currency]:
+        """
+        New currencies and the ones with a changed name, code or nominal
+        """
+        return [row for row in rows if self._rows.get(row.id) != row]
+
+    def update(self, rows: Iterable[Currency]) -> None:
+        """
+        Records the committed rows
+        """
+        self._rows.update((row.id, row) for row in rows)
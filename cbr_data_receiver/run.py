@@ -1,11 +1,19 @@
 """
-Project entrypoint
+Project entrypoint.
+
+The worker modules (SQLAlchemy, requests, tenacity) are imported by the
+commands that use them, so the migration commands start without them
 """
 import os.path
+import sys
+import time
 from os import system
 from cbr_data_receiver import config_system_dir
+from cbr_data_receiver.logger import get_logger
 from cbr_data_receiver.singletons import get_config
-from cbr_data_receiver.worker import CbrWorker, Requester, PostgreSQLClient
+
+# Seconds between the attempts of a standby replica to become the leader
+LEADER_POLL_INTERVAL = 2
 
 
 def main():
@@ -13,12 +21,111 @@ def main():
     Project entrypoint
     """
     config = get_config()
+    if config.once:
+        sys.exit(run_once(config))
+    from cbr_data_receiver.scheduler import PublicationScheduler
+    from cbr_data_receiver.spool import SpoolDrainer
+    from cbr_data_receiver.worker import CbrWorker, PostgreSQLClient, Requester
+
     db_client = PostgreSQLClient.get_client(conf=config.pgdb)
-    requester = Requester(config.cbrf_api)
-    while True:
-        CbrWorker(config=config,
-                  db_client=db_client,
-                  requester=requester).start()
+    requester = Requester(config.cbrf_api, cache_dir=config.cache_dir)
+    scheduler = PublicationScheduler.from_config(config.schedule)
+    fanout = get_fanout(config)
+    tasks = get_tasks(config, fanout)
+    spool = get_spool(config)
+    profiler = get_profiler(config)
+    SpoolDrainer(spool, db_client).start()
+    if config.metrics:
+        from cbr_data_receiver.metrics import start_metrics_server
+        start_metrics_server(config.metrics.get('bind', '127.0.0.1'), config.metrics['port'])
+    try:
+        while True:
+            if not db_client.acquire_leadership():
+                # Another replica runs the ingest loop
+                time.sleep(LEADER_POLL_INTERVAL)
+                continue
+            CbrWorker(config=config,
+                      db_client=db_client,
+                      requester=requester,
+                      scheduler=scheduler,
+                      tasks=tasks,
+                      spool=spool,
+                      profiler=profiler).start()
+    finally:
+        db_client.release_leadership()
+        if fanout is not None:
+            fanout.close()
+
+
+def run_once(config) -> int:
+    """
+    Runs one worker iteration, for cron jobs.
+    The spool left by a previous run is replayed first. The leader lock is
+    not taken, the loads are idempotent. Returns the exit code of the job
+    """
+    from cbr_data_receiver.spool import SpoolDrainer
+    from cbr_data_receiver.worker import CbrWorker, PostgreSQLClient, Requester
+
+    db_client = PostgreSQLClient.get_client(conf=config.pgdb)
+    spool = get_spool(config)
+    SpoolDrainer(spool, db_client).drain_pending()
+    fanout = get_fanout(config)
+    try:
+        worker = CbrWorker(config=config,
+                           db_client=db_client,
+                           requester=Requester(config.cbrf_api, cache_dir=config.cache_dir),
+                           tasks=get_tasks(config, fanout),
+                           spool=spool,
+                           profiler=get_profiler(config)).run_once()
+    finally:
+        if fanout is not None:
+            fanout.close()
+    if not worker.completed:
+        get_logger().error('The iteration failed.')
+    return 0 if worker.completed else 1
+
+
+def get_spool(config):
+    """
+    Spool of the rows loaded while the DB is unavailable
+    """
+    from cbr_data_receiver.spool import Spool
+    return Spool(config.spool_file or os.path.join(config_system_dir(), "spool.jsonl"))
+
+
+def get_profiler(config):
+    """
+    Profiler of the worker iterations, a no-op unless enabled
+    """
+    from cbr_data_receiver.profiling import Profiler
+    return Profiler.from_config(config.profiling, config.profile)
+
+
+def get_fanout(config):
+    """
+    Fan-out to the sinks of the config, None without sinks
+    """
+    if not config.sinks:
+        return None
+    from cbr_data_receiver.sinks import FanOut
+    return FanOut.from_config(config.sinks)
+
+
+def get_tasks(config, fanout=None):
+    """
+    Worker tasks enabled in the config
+    """
+    from cbr_data_receiver.worker import CurrenciesTask, QuotesTask
+    tasks = [QuotesTask, CurrenciesTask]
+    if fanout is not None:
+        # The sinks get the records even while the DB is unavailable
+        from cbr_data_receiver.sinks import SinkTask
+        tasks.insert(0, SinkTask.bind(fanout))
+    if config.matrix_dir:
+        # numpy is an optional dependency
+        from cbr_data_receiver.matrix import RateMatrixTask
+        tasks.append(RateMatrixTask.bind(config.matrix_dir))
+    return tasks
 
 
 def run_migrations():
@@ -36,3 +143,11 @@ def down_migration():
     alembic_ini: str = os.path.join(config_system_dir(), "alembic.ini")
     system(f"alembic -c '{alembic_ini}' downgrade -1")
 
+
+def rebuild_aggregates():
+    """
+    Recomputes the rate aggregates from the quotes
+    """
+    from cbr_data_receiver.worker import PostgreSQLClient
+    config = get_config()
+    PostgreSQLClient.get_client(conf=config.pgdb).rebuild_aggregates()
@@ -0,0 +1,108 @@
+"""
+Publication-aware scheduler of the worker iterations.
+
+The CBR publishes the rates for the next day on working days, in the
+afternoon (Moscow time). The worker sleeps until that window and then
+polls the API until a document with a newer date appears.
+"""
+import datetime
+import random
+from typing import Any, Callable, Dict, Optional, Type
+
+from tenacity import TryAgain, retry, retry_if_exception_type, stop_after_attempt, \
+    wait_random_exponential
+
+MSK = datetime.timezone(datetime.timedelta(hours=3), 'MSK')
+
+RETRY_ATTEMPTS = 8
+RETRY_MULTIPLIER = 2
+RETRY_MAX_WAIT = 300
+
+
+def backoff_retry(*exception_types: Type[BaseException],
+                  before_sleep: Optional[Callable[[Any], None]] = None):
+    """
+    Retries the request on TryAgain and the given exceptions with
+    a capped exponential backoff and full jitter, so that an outage
+    does not turn into a retry storm. Gives up with tenacity.RetryError.
+    before_sleep is called with the retry state before every retry
+    """
+    return retry(retry=retry_if_exception_type((TryAgain,) + exception_types),
+                 wait=wait_random_exponential(multiplier=RETRY_MULTIPLIER, max=RETRY_MAX_WAIT),
+                 stop=stop_after_attempt(RETRY_ATTEMPTS),
+                 before_sleep=before_sleep)
+
+
+class PublicationScheduler:
+    """
+    Computes the delay before the next worker iteration
+    """
+    PUBLICATION_TIME = '15:30'
+    POLL_INTERVAL = 300
+    POLL_WINDOW = 6 * 3600
+    JITTER = 0.1
+
+    def __init__(self, publication_time: str = PUBLICATION_TIME,
+                 poll_interval: float = POLL_INTERVAL,
+                 poll_window: float = POLL_WINDOW) -> None:
+        hour, minute = publication_time.split(':')
+        self._publication_time = datetime.time(int(hour), int(minute), tzinfo=MSK)
+        self._poll_interval = poll_interval
+        self._poll_window = datetime.timedelta(seconds=poll_window)
+        self._last_date: Optional[datetime.date] = None
+
+    @classmethod
+    def from_config(cls, schedule: Optional[Dict[str, Any]]) -> 'PublicationScheduler':
+        """
+        Creates the scheduler from the "schedule" config section
+        """
+        schedule = schedule or {}
+        return cls(publication_time=schedule.get('publication_time', cls.PUBLICATION_TIME),
+                   poll_interval=schedule.get('poll_interval', cls.POLL_INTERVAL),
+                   poll_window=schedule.get('poll_window', cls.POLL_WINDOW))
+
+    @property
+    def last_date(self) -> Optional[datetime.date]:
+        """
+        Date of the latest received document
+        """
+        return self._last_date
+
+    def next_delay(self, date: Optional[datetime.date],
+                   now: Optional[datetime.datetime] = None) -> float:
+        """
+        Returns the number of seconds to wait after an iteration that
+        received a document with the date (None if nothing new was received).
+        After a new date the worker sleeps until the next publication,
+        otherwise it keeps polling while the publication window is open
+        """
+        now = (now or datetime.datetime.now(MSK)).astimezone(MSK)
+        if date is not None and (self._last_date is None or date > self._last_date):
+            self._last_date = date
+            return self._until(self._next_publication(now), now)
+        if self._last_date is None or self._in_window(now):
+            return self._poll_delay()
+        return self._until(self._next_publication(now), now)
+
+    def _publication(self, day: datetime.date) -> datetime.datetime:
+        return datetime.datetime.combine(day, self._publication_time)
+
+    def _next_publication(self, now: datetime.datetime) -> datetime.datetime:
+        """
+        The nearest publication after now, the CBR does not publish on weekends
+        """
+        day = now.date()
+        while self._publication(day) <= now or day.weekday() > 4:
+            day += datetime.timedelta(days=1)
+        return self._publication(day)
+
+    def _in_window(self, now: datetime.datetime) -> bool:
+        start = self._publication(now.date())
+        return now.weekday() <= 4 and start <= now < start + self._poll_window
+
+    def _poll_delay(self) -> float:
+        return self._poll_interval * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+
+    @staticmethod
+    def _until(moment: datetime.datetime, now: datetime.datetime) -> float:
+        return max((moment - now).total_seconds(), 0.0)
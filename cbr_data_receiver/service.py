@@ -0,0 +1,238 @@
+"""
+Rate lookup HTTP service.
+
+GET  /rate?currency=USD&date=2022-06-11
+GET  /rates?currency=USD&currency=EUR&date=2022-06-11
+POST /rates  [{"currency": "USD", "date": "2022-06-11"}, ...]
+
+Rates are looked up "as of" the date: on weekends and holidays the
+rate of the previous published day is returned. Lookups are kept in
+an in-process LRU cache, which is dropped on every rates notification
+of the loads, so the updated quotes of a date are served too.
+"""
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import psycopg2
+import sqlalchemy as sa
+
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.models import schema_name
+from cbr_data_receiver.notify import CHANNEL, RatesListener
+from cbr_data_receiver.singletons import Config, get_config
+from cbr_data_receiver.worker import PostgreSQLClient
+
+
+class RateRepository:
+    """
+    Reads the rates from the quotes and currencies tables
+    """
+
+    def __init__(self, db_client: PostgreSQLClient) -> None:
+        self._engine = db_client.engine
+
+    def get_rate(self, currency: str, date: datetime.date) -> Optional[Dict[str, Any]]:
+        """
+        Returns the latest rate of the currency (char code or CBR id)
+        published on or before the date
+        """
+        stmt = sa.text(f"""
+            SELECT c.id, c.code, c.nominal, q.date, q.value, q.unit_rate
+            FROM {schema_name}.currencies c
+            JOIN {schema_name}.quotes q ON q.currency = c.id
+            WHERE (c.code = :currency OR c.id = :currency) AND q.date <= :date
+            ORDER BY q.date DESC
+            LIMIT 1
+        """)
+        with self._engine.connect() as connection:
+            row = connection.execute(stmt, currency=currency, date=date).fetchone()
+        if row is None:
+            return None
+        return {'currency': row.code,
+                'id': row.id,
+                'date': row.date.isoformat(),
+                'nominal': row.nominal,
+                'value': float(row.value),
+                'unit_rate': float(row.unit_rate)}
+
+    def latest_date(self) -> Optional[datetime.date]:
+        """
+        The latest ingested date
+        """
+        with self._engine.connect() as connection:
+            return connection.execute(
+                sa.text(f"SELECT max(date) FROM {schema_name}.quotes")).scalar()
+
+
+class RateCache:
+    """
+    LRU cache of the rate lookups.
+    The cache is cleared on every rates notification (see listen) and when
+    the latest ingested date changes, which is checked at most once per
+    refresh_interval. A lookup started before the last invalidation is
+    not cached
+    """
+    MAXSIZE = 10000
+    REFRESH_INTERVAL = 10.0
+    # Seconds between the reconnects of the listener
+    RECONNECT_DELAY = 5.0
+
+    def __init__(self, repository: RateRepository,
+                 maxsize: int = MAXSIZE,
+                 refresh_interval: float = REFRESH_INTERVAL,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self._repository = repository
+        self._maxsize = maxsize
+        self._refresh_interval = refresh_interval
+        self._clock = clock
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented by every invalidation
+        self._generation = 0
+        self._latest_date: Optional[datetime.date] = None
+        self._checked_at: Optional[float] = None
+
+    def get_rate(self, currency: str, date: datetime.date) -> Optional[Dict[str, Any]]:
+        """
+        Returns the rate from the cache, looking it up on a miss
+        """
+        self._refresh()
+        key = (currency, date)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+            generation = self._generation
+        rate = self._repository.get_rate(currency, date)
+        with self._lock:
+            if generation == self._generation:
+                self._items[key] = rate
+                if len(self._items) > self._maxsize:
+                    self._items.popitem(last=False)
+        return rate
+
+    def invalidate(self) -> None:
+        """
+        Drops all the cached lookups
+        """
+        with self._lock:
+            self._generation += 1
+            self._items.clear()
+
+    def listen(self, conf: Dict[str, Any], channel: str = CHANNEL) -> threading.Thread:
+        """
+        Starts a daemon thread clearing the cache on the rates notifications
+        """
+        thread = threading.Thread(target=self._listen, args=(RatesListener(conf, channel),),
+                                  name='rate-cache-listener', daemon=True)
+        thread.start()
+        return thread
+
+    def _listen(self, listener: RatesListener) -> None:
+        while True:
+            try:
+                with listener:
+                    # The notifications sent while disconnected are lost
+                    self.invalidate()
+                    for _ in listener:
+                        self.invalidate()
+            except psycopg2.OperationalError as exc:
+                get_logger().warning(f"The rates listener is disconnected: {exc}")
+                time.sleep(self.RECONNECT_DELAY)
+
+    def _refresh(self) -> None:
+        now = self._clock()
+        if self._checked_at is not None and now - self._checked_at < self._refresh_interval:
+            return
+        self._checked_at = now
+        latest_date = self._repository.latest_date()
+        if latest_date != self._latest_date:
+            self._latest_date = latest_date
+            self.invalidate()
+
+
+class RateRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP handler of the rate lookups
+    """
+    cache: RateCache
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            date = _parse_date(query.get('date', [None])[0])
+            currencies = [c for value in query.get('currency', []) for c in value.split(',')]
+            if not currencies:
+                raise ValueError('currency is required')
+        except ValueError as exc:
+            return self._send(HTTPStatus.BAD_REQUEST, {'error': str(exc)})
+        if url.path == '/rate':
+            rate = self.cache.get_rate(currencies[0], date)
+            if rate is None:
+                return self._send(HTTPStatus.NOT_FOUND, {'error': 'Rate not found'})
+            return self._send(HTTPStatus.OK, rate)
+        if url.path == '/rates':
+            return self._send(HTTPStatus.OK, self._lookup([(c, date) for c in currencies]))
+        return self._send(HTTPStatus.NOT_FOUND, {'error': 'Not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/rates':
+            return self._send(HTTPStatus.NOT_FOUND, {'error': 'Not found'})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            lookups = [(item['currency'], _parse_date(item.get('date'))) for item in body]
+        except (ValueError, KeyError, TypeError) as exc:
+            return self._send(HTTPStatus.BAD_REQUEST, {'error': str(exc)})
+        return self._send(HTTPStatus.OK, self._lookup(lookups))
+
+    def _lookup(self, lookups: List[Tuple[str, datetime.date]]) -> List[Dict[str, Any]]:
+        return [{'currency': currency,
+                 'requested_date': date.isoformat(),
+                 'rate': self.cache.get_rate(currency, date)}
+                for currency, date in lookups]
+
+    def _send(self, status: HTTPStatus, payload: Any) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        get_logger().debug(f"{self.address_string()} {format % args}")
+
+
+def _parse_date(value: Optional[str]) -> datetime.date:
+    if not value:
+        return datetime.date.today()
+    return datetime.date.fromisoformat(value)
+
+
+def make_server(cache: RateCache, bind: str, port: int) -> ThreadingHTTPServer:
+    """
+    Creates the HTTP server of the service
+    """
+    handler = type('BoundRateRequestHandler', (RateRequestHandler,), {'cache': cache})
+    return ThreadingHTTPServer((bind, port), handler)
+
+
+def main():
+    """
+    Rate service entrypoint
+    """
+    config: Config = get_config()
+    db_client = PostgreSQLClient.get_client(conf=config.pgdb)
+    cache = RateCache(RateRepository(db_client))
+    cache.listen(config.pgdb, config.pgdb.get('notify_channel', CHANNEL))
+    server = make_server(cache, config.bind, config.port)
+    get_logger().info(f"Rate service is listening on {config.bind}:{config.port}")
+    server.serve_forever()
@@ -1,6 +1,7 @@
 import os.path
 import sys
 from argparse import ArgumentParser
+from typing import List, Optional
 
 from . import config_system_dir
 from .config import Config as BaseConfig
@@ -15,7 +16,7 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-def parse_args():
+def parse_args(argv: Optional[List[str]] = None):
     parser = ArgumentParser("CHANGE ME!")
 
     parser.add_argument(
@@ -31,13 +32,19 @@ def parse_args():
     parser.add_argument(
         "-p", "--port", type=int, required=False,
         help="The service port.")
-    params = parser.parse_args(sys.argv[1:]).__dict__
+    parser.add_argument(
+        "--once", action="store_true", default=None,
+        help="Run one worker iteration and exit.")
+    parser.add_argument(
+        "--profile", action="store_true", default=None,
+        help="Profile the worker iterations.")
+    params = parser.parse_args(sys.argv[1:] if argv is None else argv).__dict__
     return {k: v for k, v in params.items() if v is not None}
 
 
 class Config(BaseConfig, metaclass=Singleton):
-    def __init__(self):
-        params = parse_args()
+    def __init__(self, argv: Optional[List[str]] = None):
+        params = parse_args(argv)
         config_file = params.get("config")
         if not config_file:
             config_file = os.path.join(config_system_dir(), "access.yaml")
@@ -50,5 +57,10 @@ class ConfigForMigrations(BaseConfig, metaclass=Singleton):
         BaseConfig.__init__(self, config_file=config_file, alembic=True)
 
 
-def get_config():
-    return Config()
+def get_config(argv: Optional[List[str]] = None):
+    """
+    The service config, argv are the command line arguments of the
+    config, sys.argv by default. The commands with their own arguments
+    pass the arguments they did not recognize, the first call wins
+    """
+    return Config(argv)
@@ -0,0 +1,353 @@
+"""
+Output sinks of the ingested records.
+
+Besides the DB, the quotes and currencies of every document can be
+delivered to other stores: an append-only JSON lines event log, a Redis
+cache and an AMQP exchange. Every sink has its own thread and a bounded
+queue, the batches are queued without waiting, so a slow sink stalls
+neither the others nor the DB load. Failed writes are retried with the
+backoff of the CBR requests.
+
+A sink with an overflow spool appends the batches that do not fit in its
+queue, or whose writes failed, to the spool and replays them once its
+queue is empty; the following batches go to the spool until then, so the
+rows keep their order. Delivery to such a sink is at least once, the
+consumers deduplicate the rows by their keys. A sink without a spool
+drops those batches.
+"""
+import json
+import os
+import os.path
+import queue
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.metrics import SINK_BATCHES, SINK_RETRIES
+from cbr_data_receiver.parser import ValCurs
+from cbr_data_receiver.records import Record, json_default
+from cbr_data_receiver.scheduler import backoff_retry
+from cbr_data_receiver.spool import Spool
+from cbr_data_receiver.worker import CurrenciesTask, PostgreSQLClient, QuotesTask
+
+
+class Sink:
+    """
+    Base class of the sinks, writes the batches of records of a table.
+    errors are the exceptions on which a write is retried
+    """
+    errors: Tuple[Type[BaseException], ...] = ()
+
+    def write(self, table: str, rows: Sequence[Record]) -> None:
+        """
+        Writes the batch of records of the table
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Releases the connections of the sink
+        """
+
+
+class JsonlSink(Sink):
+    """
+    Append-only JSON lines event log, a line per record with its table
+    """
+    errors = (OSError,)
+
+    def __init__(self, file: str) -> None:
+        self._filename = file
+
+    def write(self, table: str, rows: Sequence[Record]) -> None:
+        lines = ''.join(json.dumps({'table': table, **row._asdict()},
+                                   ensure_ascii=False, default=json_default) + '\n'
+                        for row in rows)
+        os.makedirs(os.path.dirname(os.path.abspath(self._filename)), exist_ok=True)
+        with open(self._filename, 'a', encoding='utf-8') as file:
+            file.write(lines)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+class RedisSink(Sink):
+    """
+    Redis cache of the records: a hash of the quotes by currency for every
+    date (<prefix>:quotes:<date>) and a hash of the currencies by id
+    (<prefix>:currencies)
+    """
+    PREFIX = 'cbr'
+
+    def __init__(self, url: str, prefix: str = PREFIX) -> None:
+        # redis is an optional dependency
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+        self.errors = (redis.RedisError,)
+
+    def write(self, table: str, rows: Sequence[Record]) -> None:
+        pipeline = self._client.pipeline(transaction=False)
+        for row in rows:
+            if table == 'quotes':
+                key, field = f"{self._prefix}:quotes:{row.date.isoformat()}", row.currency
+            else:
+                key, field = f"{self._prefix}:currencies", row.id
+            pipeline.hset(key, field, json.dumps(row._asdict(), ensure_ascii=False,
+                                                 default=json_default))
+        pipeline.execute()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class AmqpSink(Sink):
+    """
+    Publishes a persistent message per batch to a durable topic exchange,
+    the routing key is the table
+    """
+    EXCHANGE = 'cbr'
+
+    def __init__(self, url: str, exchange: str = EXCHANGE) -> None:
+        # pika is an optional dependency
+        import pika
+        self._pika = pika
+        self._parameters = pika.URLParameters(url)
+        self._exchange = exchange
+        self._connection = None
+        self._channel = None
+        self.errors = (pika.exceptions.AMQPError,)
+
+    def write(self, table: str, rows: Sequence[Record]) -> None:
+        body = json.dumps({'table': table, 'rows': [row._asdict() for row in rows]},
+                          ensure_ascii=False, default=json_default)
+        try:
+            if self._connection is None or self._connection.is_closed:
+                self._connection = self._pika.BlockingConnection(self._parameters)
+                self._channel = self._connection.channel()
+                self._channel.exchange_declare(self._exchange, exchange_type='topic',
+                                               durable=True)
+                self._channel.confirm_delivery()
+            self._channel.basic_publish(
+                self._exchange, table, body.encode(),
+                properties=self._pika.BasicProperties(content_type='application/json',
+                                                      delivery_mode=2))
+        except self.errors:
+            # Reconnect on the next attempt
+            self._connection = None
+            raise
+
+    def close(self) -> None:
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+
+SINKS: Dict[str, Type[Sink]] = {
+    'jsonl': JsonlSink,
+    'redis': RedisSink,
+    'amqp': AmqpSink,
+}
+
+
+class _SpoolReplay:
+    """
+    Writes the rows replayed from a spool to a sink, in place of the DB client
+    """
+
+    def __init__(self, write: Callable[[str, Sequence[Record]], None]) -> None:
+        self._write = write
+
+    def insert_data_currencies(self, rows: Sequence[Record]) -> None:
+        self._write('currencies', rows)
+
+    def insert_data_quotes(self, rows: Sequence[Record]) -> None:
+        self._write('quotes', rows)
+
+
+class SinkQueue:
+    """
+    Bounded queue of the batches of a sink, written from a daemon thread,
+    with an optional overflow spool
+    """
+    QUEUE_SIZE = 16
+    # Seconds between the replays of the spool while the sink is failing
+    REPLAY_INTERVAL = 10.0
+
+    def __init__(self, sink: Sink, name: str, queue_size: int = QUEUE_SIZE,
+                 spool: Optional[Spool] = None) -> None:
+        self._sink = sink
+        self._name = name
+        self._spool = spool
+        self._queue: 'queue.Queue[Optional[Tuple[str, Sequence[Record]]]]' = \
+            queue.Queue(maxsize=queue_size)
+        self._write = backoff_retry(*sink.errors, before_sleep=self._count_retry)(sink.write)
+        self._thread = threading.Thread(target=self._run, name=f"sink-{name}", daemon=True)
+        self._thread.start()
+
+    def put(self, table: str, rows: Sequence[Record]) -> bool:
+        """
+        Queues the batch without waiting. The batch goes to the spool when
+        the queue is full or earlier batches wait in the spool.
+        Returns False if the batch is dropped
+        """
+        if self._overflowing:
+            return self._overflow(table, rows)
+        try:
+            self._queue.put_nowait((table, rows))
+        except queue.Full:
+            return self._overflow(table, rows)
+        return True
+
+    @property
+    def _overflowing(self) -> bool:
+        return self._spool is not None and self._spool.pending
+
+    def _overflow(self, table: str, rows: Sequence[Record]) -> bool:
+        """
+        Appends the batch to the spool, drops it without one
+        """
+        if self._spool is not None:
+            try:
+                self._spool.append(table, rows)
+            except OSError as exc:
+                get_logger().error(f"The spool of the {self._name} sink is unavailable: {exc}")
+            else:
+                SINK_BATCHES.inc(sink=self._name, outcome='spooled')
+                return True
+        SINK_BATCHES.inc(sink=self._name, outcome='dropped')
+        get_logger().error(f"The {self._name} sink is behind, "
+                           f"{len(rows)} rows of {table} are dropped")
+        return False
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Writes the queued batches and closes the sink
+        """
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            get_logger().warning(f"{self._queue.qsize()} batches were not written "
+                                 f"to the {self._name} sink")
+            return
+        self._sink.close()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = self._queue.get(
+                    timeout=self.REPLAY_INTERVAL if self._overflowing else None)
+            except queue.Empty:
+                self._replay()
+                continue
+            if batch is None:
+                self._replay()
+                return
+            table, rows = batch
+            # Behind the spooled batches
+            if self._overflowing:
+                self._overflow(table, rows)
+            else:
+                self._deliver(table, rows)
+            if self._queue.empty():
+                self._replay()
+
+    def _deliver(self, table: str, rows: Sequence[Record]) -> None:
+        try:
+            self._write(table, rows)
+        except Exception as exc:
+            get_logger().error(f"{len(rows)} rows of {table} were not written "
+                               f"to the {self._name} sink: {exc!r}")
+            if self._spool is None:
+                SINK_BATCHES.inc(sink=self._name, outcome='failed')
+            else:
+                self._overflow(table, rows)
+        else:
+            SINK_BATCHES.inc(sink=self._name, outcome='delivered')
+
+    def _replay(self) -> None:
+        """
+        Writes the spooled batches to the sink, they stay in the spool
+        if the write fails
+        """
+        if not self._overflowing:
+            return
+        try:
+            self._spool.drain(_SpoolReplay(self._write))
+        except Exception as exc:
+            get_logger().warning(f"The spool of the {self._name} sink is not replayed: {exc!r}")
+        else:
+            SINK_BATCHES.inc(sink=self._name, outcome='replayed')
+
+    def _count_retry(self, retry_state: Any) -> None:
+        SINK_RETRIES.inc(sink=self._name)
+
+
+class FanOut:
+    """
+    Delivers every batch to all the sinks
+    """
+    CLOSE_TIMEOUT = 60.0
+
+    def __init__(self, queues: List[SinkQueue]) -> None:
+        self._queues = queues
+
+    @classmethod
+    def from_config(cls, sinks: List[Dict[str, Any]]) -> 'FanOut':
+        """
+        Creates the sinks of the "sinks" config section, e.g.
+        {'type': 'redis', 'url': 'redis://localhost/0', 'queue_size': 4}.
+        name (the type by default) labels the sink in the logs and metrics,
+        spool is the file of the overflow spool
+        """
+        queues = []
+        for options in sinks:
+            options = dict(options)
+            sink_type = options.pop('type')
+            name = options.pop('name', sink_type)
+            queue_options: Dict[str, Any] = {'queue_size': options.pop('queue_size')} \
+                if 'queue_size' in options else {}
+            if 'spool' in options:
+                queue_options['spool'] = Spool(options.pop('spool'))
+            queues.append(SinkQueue(SINKS[sink_type](**options), name, **queue_options))
+        return cls(queues)
+
+    def deliver(self, table: str, rows: Sequence[Record]) -> None:
+        """
+        Queues the batch for every sink
+        """
+        for sink_queue in self._queues:
+            sink_queue.put(table, rows)
+
+    def close(self, timeout: float = CLOSE_TIMEOUT) -> None:
+        """
+        Writes the queued batches and closes the sinks
+        """
+        for sink_queue in self._queues:
+            sink_queue.close(timeout)
+
+
+class SinkTask:
+    """
+    Task delivers the records of the document to the sinks.
+    Bound to the fan-out with SinkTask.bind
+    """
+    fanout: FanOut
+
+    @classmethod
+    def bind(cls, fanout: FanOut) -> type:
+        """
+        Returns the task class delivering to the fan-out
+        """
+        return type(cls.__name__, (cls,), {'fanout': fanout})
+
+    @classmethod
+    def start(cls, document: ValCurs, db_client: PostgreSQLClient,
+              params: Dict[str, Any]) -> None:
+        """
+        Starting the sink task, the writes run in the sink threads
+        """
+        if document.date and document.valutes:
+            cls.fanout.deliver('currencies', CurrenciesTask._get_currencies(document.valutes))
+            cls.fanout.deliver('quotes', QuotesTask._get_quotes(document.date, document.valutes))
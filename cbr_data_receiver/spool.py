@@ -0,0 +1,179 @@
+"""
+Local spool of the rows that could not be written to the DB.
+
+While the DB is unavailable the worker appends the parsed batches to an
+append-only JSON lines file, every append is fsync'd. The drainer thread
+replays the spool into the DB once it is back: all the spooled rows are
+deduplicated and loaded in bulk, quotes in date order. The sinks keep
+their overflow batches in spools of their own, replayed into the sink.
+"""
+import datetime
+import json
+import os
+import os.path
+import threading
+from decimal import Decimal
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+
+from cbr_data_receiver.logger import get_logger
+from cbr_data_receiver.records import Currency, Quote, Record, json_default
+from cbr_data_receiver.worker import PostgreSQLClient
+
+# Bytes read at a time when looking for the end of the last whole line
+TAIL_CHUNK = 4096
+
+
+class Spool:
+    """
+    Append-only file of the batches of rows by table.
+    The file is renamed before it is replayed, so the batches appended
+    during a drain go to a new file
+    """
+
+    def __init__(self, filename: str) -> None:
+        self._filename = filename
+        self._draining_filename = f"{filename}.draining"
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+
+    @property
+    def pending(self) -> bool:
+        """
+        Whether there are rows to replay
+        """
+        return os.path.exists(self._filename) or os.path.exists(self._draining_filename)
+
+    def append(self, table: str, rows: Sequence[Record]) -> None:
+        """
+        Durably appends the batch of records of the table.
+        A torn last line of an interrupted append is cut off first,
+        so that the batch does not merge with it
+        """
+        line = json.dumps({'table': table, 'rows': [row._asdict() for row in rows]},
+                          ensure_ascii=False, default=json_default)
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self._filename)), exist_ok=True)
+            with open(self._filename, 'ab+') as file:
+                self._truncate_torn_line(file)
+                file.write(line.encode('utf-8') + b'\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    @staticmethod
+    def _truncate_torn_line(file: BinaryIO) -> None:
+        """
+        Truncates the file opened for appending after its last newline
+        """
+        end = file.seek(0, os.SEEK_END)
+        if end == 0:
+            return
+        file.seek(end - 1)
+        if file.read(1) == b'\n':
+            return
+        position = end
+        while position > 0:
+            start = max(position - TAIL_CHUNK, 0)
+            file.seek(start)
+            chunk = file.read(position - start)
+            newline = chunk.rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        get_logger().warning(f"Truncating a torn line of the spool {file.name}")
+        file.truncate(position)
+
+    def drain(self, db_client: PostgreSQLClient) -> int:
+        """
+        Replays the spooled rows, the spool file is removed once they
+        are committed. Returns the number of loaded rows
+        """
+        with self._drain_lock:
+            with self._lock:
+                if not os.path.exists(self._draining_filename):
+                    if not os.path.exists(self._filename):
+                        return 0
+                    os.replace(self._filename, self._draining_filename)
+            currencies, quotes = self._read(self._draining_filename)
+            if currencies:
+                db_client.insert_data_currencies(currencies)
+            if quotes:
+                db_client.insert_data_quotes(quotes)
+            os.remove(self._draining_filename)
+        get_logger().info(f"{len(quotes)} quotes and {len(currencies)} currencies "
+                          f"were loaded from the spool")
+        return len(currencies) + len(quotes)
+
+    @staticmethod
+    def _read(filename: str) -> Tuple[List[Currency], List[Quote]]:
+        """
+        Reads the batches, the later rows win on duplicate keys.
+        A torn last line of an interrupted append is skipped
+        """
+        currencies: Dict[str, Currency] = {}
+        quotes: Dict[Tuple[str, datetime.date], Quote] = {}
+        with open(filename, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    get_logger().warning(f"Skipping a broken line of the spool {filename}")
+                    continue
+                for row in batch['rows']:
+                    if batch['table'] == 'quotes':
+                        quote = Quote(row['currency'], datetime.date.fromisoformat(row['date']),
+                                      Decimal(row['value']), Decimal(row['unit_rate']))
+                        quotes[(quote.currency, quote.date)] = quote
+                    else:
+                        currencies[row['id']] = Currency(**row)
+        return (list(currencies.values()),
+                sorted(quotes.values(), key=lambda row: (row.date, row.currency)))
+
+
+class SpoolDrainer:
+    """
+    Background thread replaying the spool while it is not empty
+    """
+    INTERVAL = 10.0
+
+    def __init__(self, spool: Spool, db_client: PostgreSQLClient,
+                 interval: float = INTERVAL) -> None:
+        self._spool = spool
+        self._db_client = db_client
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'SpoolDrainer':
+        """
+        Starts the daemon thread
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """
+        Stops the thread after the current drain
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def drain_pending(self) -> None:
+        """
+        Replays the spool if it is not empty, the DB being unavailable
+        is not an error
+        """
+        if not self._spool.pending:
+            return
+        try:
+            self._spool.drain(self._db_client)
+        except sa.exc.DBAPIError as exc:
+            get_logger().warning(f"The spool is not drained, the DB is unavailable: {exc}")
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            self.drain_pending()
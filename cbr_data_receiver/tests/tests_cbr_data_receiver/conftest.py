@@ -0,0 +1,54 @@
+import datetime
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from cbr_data_receiver.worker import CbrWorker
+
+VALUTES = {
+    'R01010': ('036', 'AUD', 1, 'Австралийский доллар', '41,1437'),
+    'R01020A': ('944', 'AZN', 1, 'Азербайджанский манат', '33,9871'),
+}
+
+
+def _server_response(day=datetime.date(2022, 6, 11), currencies=('R01010',)):
+    valutes = ''.join(f'''
+    <Valute ID="{currency}">
+        <NumCode>{num_code}</NumCode>
+        <CharCode>{char_code}</CharCode>
+        <Nominal>{nominal}</Nominal>
+        <Name>{name}</Name>
+        <Value>{value}</Value>
+    </Valute>''' for currency, (num_code, char_code, nominal, name, value)
+        in ((currency, VALUTES[currency]) for currency in currencies))
+    return f'''<?xml version="1.0" encoding="windows-1251"?>
+    <ValCurs Date="{day:%d.%m.%Y}" name="Foreign Currency Market">{valutes}
+    </ValCurs>'''.encode('windows-1251')
+
+
+@pytest.fixture()
+def make_server_response():
+    """
+    Builds the CBR response of the day with the currencies of VALUTES
+    """
+    return _server_response
+
+
+@pytest.fixture()
+def server_response():
+    """
+    The CBR response of 11.06.2022 with the AUD quote
+    """
+    return _server_response()
+
+
+@pytest.fixture()
+def cbrf_worker(server_response):
+    requester, db_client = Mock(), Mock()
+    requester.make_cbrf_request = MagicMock(return_value=server_response)
+    db_client.insert_data_quotes = MagicMock(return_value=None)
+    db_client.is_quotes_ingested = MagicMock(return_value=False)
+    db_client.insert_data_currencies = MagicMock(return_value=None)
+    return CbrWorker(config=Mock(),
+                     db_client=db_client,
+                     requester=requester)
@@ -0,0 +1,40 @@
+import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import pytest
+
+from cbr_data_receiver.models import bucket_bounds, rate_aggregates_sql
+from cbr_data_receiver.records import Quote
+from cbr_data_receiver.worker import PostgreSQLClient
+
+
+@pytest.mark.parametrize('period, bounds', [
+    ('day', (datetime.date(2022, 6, 11), datetime.date(2022, 6, 15))),
+    ('week', (datetime.date(2022, 6, 6), datetime.date(2022, 6, 20))),
+    ('month', (datetime.date(2022, 6, 1), datetime.date(2022, 7, 1))),
+    ('year', (datetime.date(2022, 1, 1), datetime.date(2023, 1, 1))),
+])
+def test_bucket_bounds(period, bounds):
+    assert bucket_bounds(period, datetime.date(2022, 6, 11), datetime.date(2022, 6, 14)) == bounds
+
+
+def test_month_bucket_of_december():
+    assert bucket_bounds('month', datetime.date(2021, 12, 31), datetime.date(2021, 12, 31)) == \
+        (datetime.date(2021, 12, 1), datetime.date(2022, 1, 1))
+
+
+def test_aggregates_sql_touches_only_the_buckets_of_the_dates():
+    sql = rate_aggregates_sql('month', datetime.date(2022, 6, 11), datetime.date(2022, 6, 11))
+    assert "date >= '2022-06-01' AND date < '2022-07-01'" in sql
+    assert "date_trunc('month', date::timestamp)" in sql
+
+
+def test_aggregates_are_updated_after_insert():
+    db_client = PostgreSQLClient(conf={})
+    db_client._create_partitions = MagicMock()
+    db_client._insert_data_quotes = MagicMock()
+    db_client.update_aggregates = MagicMock()
+    days = [datetime.date(2022, 6, 14), datetime.date(2022, 6, 11)]
+    db_client.insert_data_quotes([Quote('R01010', day, Decimal(1), Decimal(1)) for day in days])
+    db_client.update_aggregates.assert_called_once_with(*sorted(days))
@@ -0,0 +1,96 @@
+import asyncio
+import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock, Mock
+
+import pytest
+
+pytest.importorskip('aiohttp')
+pytest.importorskip('asyncpg')
+
+from cbr_data_receiver.async_worker import AsyncBackfill, AsyncCbrWorker, \
+    AsyncRequester  # noqa: E402
+from cbr_data_receiver.backfill import Checkpoint  # noqa: E402
+from cbr_data_receiver.records import Quote  # noqa: E402
+from cbr_data_receiver.spool import Spool  # noqa: E402
+from cbr_data_receiver.worker import Requester  # noqa: E402
+
+
+@pytest.fixture()
+def async_worker(server_response):
+    requester, db_client = Mock(), Mock()
+    requester.make_cbrf_request = AsyncMock(return_value=server_response)
+    db_client.is_quotes_ingested = AsyncMock(return_value=False)
+    db_client.insert_data_quotes = AsyncMock(return_value=None)
+    db_client.insert_data_currencies = AsyncMock(return_value=None)
+    return AsyncCbrWorker(config=Mock(), db_client=db_client, requester=requester)
+
+
+def test_async_worker_runs_tasks(async_worker):
+    worker = asyncio.run(async_worker.run_once())
+    assert worker._params['completed']
+    worker._db_client.insert_data_quotes.assert_awaited_once_with(
+        [Quote('R01010', datetime.date(2022, 6, 11), Decimal('41.1437'), Decimal('41.1437'))])
+    worker._db_client.insert_data_currencies.assert_awaited_once()
+
+
+def test_async_worker_params_parsing_error(async_worker):
+    async_worker._requester.make_cbrf_request = AsyncMock(return_value=b'<ValCurs/>')
+    worker = asyncio.run(async_worker.run_once())
+    assert not worker._params['completed']
+    worker._db_client.insert_data_quotes.assert_not_awaited()
+
+
+def test_async_worker_runs_sync_tasks_in_executor(async_worker):
+    sync_task = Mock(__name__='SyncTask', spec=['__name__', 'start'])
+    async_worker._tasks.append(sync_task)
+    async_worker._sync_db_client = Mock()
+    worker = asyncio.run(async_worker.run_once())
+    assert worker.completed
+    sync_task.start.assert_called_once()
+    assert sync_task.start.call_args[0][1] is async_worker._sync_db_client
+
+
+def test_async_worker_spools_when_db_is_unavailable(async_worker, tmp_path):
+    async_worker._db_client.is_quotes_ingested = AsyncMock(side_effect=ConnectionRefusedError)
+    async_worker._spool = Spool(str(tmp_path / 'spool.jsonl'))
+    worker = asyncio.run(async_worker.run_once())
+    assert worker.completed
+    assert 'spooled' in worker._params['message']
+    assert async_worker._spool.pending
+
+
+def test_async_requester_takes_past_days_from_cache(tmp_path, server_response):
+    day = datetime.date(2022, 6, 11)
+    Requester('http://cbr', cache_dir=str(tmp_path))._store(day, server_response, {})
+    requester = AsyncRequester('http://cbr', cache_dir=str(tmp_path))
+    # No session, the response must not be requested
+    assert asyncio.run(requester.make_cbrf_request(day)) == server_response
+
+
+def test_async_backfill_fetches_concurrently(tmp_path, make_server_response):
+    in_flight, peak = 0, 0
+
+    async def server_response(day):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return make_server_response(day)
+
+    requester, db_client = Mock(), Mock()
+    requester.make_cbrf_request = AsyncMock(side_effect=server_response)
+    db_client.insert_data_quotes = AsyncMock(return_value=None)
+    db_client.insert_data_currencies = AsyncMock(return_value=None)
+    checkpoint = Checkpoint(str(tmp_path / 'checkpoint.json'),
+                            datetime.date(2022, 6, 1), datetime.date(2022, 6, 14))
+    backfill = AsyncBackfill(requester=requester, db_client=db_client,
+                             checkpoint=checkpoint, workers=3, batch_size=5)
+    asyncio.run(backfill.run(datetime.date(2022, 6, 1), datetime.date(2022, 6, 14)))
+    assert peak == 3
+    assert db_client.insert_data_quotes.await_count == 3
+    dates = [row.date for call in db_client.insert_data_quotes.await_args_list
+             for row in call[0][0]]
+    assert len(dates) == len(set(dates)) == 14
+    assert checkpoint.load() is None
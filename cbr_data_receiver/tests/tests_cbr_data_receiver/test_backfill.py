@@ -0,0 +1,50 @@
+import datetime
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from cbr_data_receiver.backfill import Backfill, Checkpoint
+
+
+@pytest.fixture()
+def checkpoint(tmp_path):
+    return Checkpoint(str(tmp_path / 'checkpoint.json'),
+                      datetime.date(2022, 6, 1), datetime.date(2022, 6, 14))
+
+
+@pytest.fixture()
+def backfill(checkpoint, make_server_response):
+    def server_response(day):
+        # Weekends repeat the rates of the previous Friday
+        while day.weekday() > 4:
+            day -= datetime.timedelta(days=1)
+        return make_server_response(day)
+
+    requester, db_client = Mock(), Mock()
+    requester.make_cbrf_request = MagicMock(side_effect=server_response)
+    return Backfill(requester=requester, db_client=db_client,
+                    checkpoint=checkpoint, workers=4, batch_size=5)
+
+
+def test_backfill_loads_every_published_day_once(backfill):
+    backfill.run(datetime.date(2022, 6, 1), datetime.date(2022, 6, 14))
+    assert backfill._requester.make_cbrf_request.call_count == 14
+    assert backfill._db_client.insert_data_quotes.call_count == 3
+    dates = [row.date for call in backfill._db_client.insert_data_quotes.call_args_list
+             for row in call[0][0]]
+    assert len(dates) == len(set(dates)) == 10
+
+
+def test_backfill_resumes_from_checkpoint(backfill, checkpoint):
+    checkpoint.save(datetime.date(2022, 6, 10))
+    backfill.run(datetime.date(2022, 6, 1), datetime.date(2022, 6, 14))
+    requested = [call[0][0] for call in backfill._requester.make_cbrf_request.call_args_list]
+    assert min(requested) == datetime.date(2022, 6, 11)
+    assert checkpoint.load() is None
+
+
+def test_checkpoint_of_another_range_is_ignored(tmp_path):
+    filename = str(tmp_path / 'checkpoint.json')
+    Checkpoint(filename, datetime.date(2022, 1, 1), datetime.date(2022, 2, 1)).save(
+        datetime.date(2022, 1, 10))
+    assert Checkpoint(filename, datetime.date(2021, 1, 1), datetime.date(2022, 2, 1)).load() is None
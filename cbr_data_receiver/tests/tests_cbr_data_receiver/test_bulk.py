@@ -0,0 +1,48 @@
+import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from cbr_data_receiver.bulk import CopyReader
+from cbr_data_receiver.records import Quote
+from cbr_data_receiver.worker import PostgreSQLClient
+
+ROWS = [Quote('R01010', datetime.date(2022, 6, 11), Decimal('41.1437'), Decimal('4.11437')),
+        Quote('R0\t1\\', None, Decimal('33.9871'), None)]
+
+
+def test_copy_reader_formats_rows():
+    reader = CopyReader(ROWS, ('currency', 'date', 'value'))
+    assert reader.read() == 'R01010\t2022-06-11\t41.1437\nR0\\t1\\\\\t\\N\t33.9871\n'
+    assert reader.read() == ''
+
+
+def test_copy_reader_reads_in_chunks():
+    expected = CopyReader(ROWS * 100, ('currency', 'value')).read()
+    reader = CopyReader(ROWS * 100, ('currency', 'value'))
+    chunks = iter(lambda: reader.read(7), '')
+    assert ''.join(chunks) == expected
+
+
+def test_insert_data_quotes_selects_path_by_batch_size():
+    db_client = PostgreSQLClient(conf={'bulk_threshold': 2})
+    db_client._insert_data_quotes = MagicMock()
+    db_client._copy_data_quotes = MagicMock()
+    db_client._create_partitions = MagicMock()
+    db_client.update_aggregates = MagicMock()
+    db_client.insert_data_quotes(ROWS[:1])
+    db_client.insert_data_quotes(ROWS[:1] * 2)
+    db_client._insert_data_quotes.assert_called_once_with(ROWS[:1])
+    db_client._copy_data_quotes.assert_called_once_with(ROWS[:1] * 2)
+
+
+def test_partitions_are_created_once_per_year():
+    db_client = PostgreSQLClient(conf={})
+    db_client.engine = MagicMock()
+    db_client._insert_data_quotes = MagicMock()
+    db_client.update_aggregates = MagicMock()
+    db_client.insert_data_quotes([ROWS[0], ROWS[0]._replace(date=datetime.date(2021, 1, 1))])
+    db_client.insert_data_quotes(ROWS[:1])
+    connection = db_client.engine.begin.return_value.__enter__.return_value
+    ddl = [str(call[0][0]) for call in connection.execute.call_args_list]
+    assert len(ddl) == 2
+    assert 'quotes_y2021' in ddl[0] and "TO ('2022-01-01')" in ddl[0]
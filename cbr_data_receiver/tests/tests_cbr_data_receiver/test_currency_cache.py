@@ -0,0 +1,63 @@
+from unittest.mock import MagicMock
+
+from cbr_data_receiver.records import Currency, CurrencyCache
+from cbr_data_receiver.worker import PostgreSQLClient
+
+AUD = Currency('R01010', 'Австралийский доллар', 'AUD', 1)
+AZN = Currency('R01020A', 'Азербайджанский манат', 'AZN', 1)
+
+
+def db_client(stored):
+    client = PostgreSQLClient(conf={})
+    client.engine = MagicMock()
+    client.engine.connect.return_value.__enter__.return_value.execute.return_value = \
+        [tuple(row) for row in stored]
+    return client
+
+
+def upserted(client):
+    connection = client.engine.begin.return_value.__enter__.return_value
+    return [call[0][1] for call in connection.execute.call_args_list]
+
+
+def test_unchanged_currencies_are_not_sent():
+    client = db_client([AUD, AZN])
+    client.insert_data_currencies([AUD, AZN])
+    client.engine.begin.assert_not_called()
+
+
+def test_only_changed_currencies_are_sent():
+    client = db_client([AUD, AZN])
+    client.insert_data_currencies([AUD, AZN._replace(nominal=10)])
+    params = upserted(client)
+    assert len(params) == 1
+    assert params[0] == [AZN._replace(nominal=10)._asdict()]
+    client.insert_data_currencies([AUD, AZN._replace(nominal=10)])
+    assert len(upserted(client)) == 1
+    client.engine.connect.assert_called_once()
+
+
+def test_cache_is_read_again_when_it_expires():
+    client = db_client([AUD, AZN])
+    client.conf = {'currency_cache_ttl': 0}
+    client.insert_data_currencies([AUD, AZN])
+    client.insert_data_currencies([AUD, AZN])
+    assert client.engine.connect.call_count == 2
+    client.engine.begin.assert_not_called()
+
+
+def test_cache_is_read_again_by_a_new_leader():
+    client = db_client([AUD, AZN])
+    client.insert_data_currencies([AUD, AZN])
+    client._set_leader(True)
+    client.insert_data_currencies([AUD, AZN])
+    assert client.engine.connect.call_count == 2
+
+
+def test_currency_cache_expiry():
+    now = [0.0]
+    cache = CurrencyCache([AUD], ttl=10, clock=lambda: now[0])
+    assert not cache.expired
+    now[0] = 10
+    assert cache.expired
+    assert not CurrencyCache([AUD]).expired
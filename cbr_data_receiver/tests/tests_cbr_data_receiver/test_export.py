@@ -0,0 +1,61 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+pq = pytest.importorskip('pyarrow.parquet')
+
+from cbr_data_receiver.export import ParquetExporter  # noqa: E402
+
+
+def row(day, currency='R01235', value=Decimal('57.0')):
+    return {'date': day, 'currency': currency, 'code': 'USD', 'name_rus': 'Доллар США',
+            'nominal': 1, 'value': value, 'unit_rate': value}
+
+
+class Row(tuple):
+    """
+    Row of the DB result, accessed by index and by name
+    """
+
+    def __new__(cls, data):
+        self = super().__new__(cls, data.values())
+        self._mapping = data
+        return self
+
+
+def test_export_partitions_by_month(tmp_path):
+    exporter = ParquetExporter(str(tmp_path))
+    batches = [[Row(row(datetime.date(2022, 5, 31))), Row(row(datetime.date(2022, 6, 1)))],
+               [Row(row(datetime.date(2022, 6, 2)))]]
+    assert exporter.write(batches) == 3
+    assert exporter.last_date == datetime.date(2022, 6, 2)
+    june = pq.read_table(tmp_path / 'year=2022' / 'month=06' / 'part-2022-06-01.parquet')
+    assert june.column('date').to_pylist() == [datetime.date(2022, 6, 1), datetime.date(2022, 6, 2)]
+    assert (tmp_path / 'year=2022' / 'month=05' / 'part-2022-05-31.parquet').exists()
+
+
+def test_export_without_new_rows_keeps_state(tmp_path):
+    exporter = ParquetExporter(str(tmp_path))
+    exporter.write([[Row(row(datetime.date(2022, 6, 1)))]])
+    assert exporter.write([]) == 0
+    assert exporter.last_date == datetime.date(2022, 6, 1)
+
+
+def test_export_finds_changed_months():
+    exported = {'2022-05': 40, '2022-06': 20}
+    assert ParquetExporter._stale_months({'2022-05': 40, '2022-06': 22}, exported) == ['2022-06']
+    assert ParquetExporter._stale_months({'2022-04': 2, **exported}, exported) == ['2022-04']
+    assert ParquetExporter._stale_months(exported, exported, datetime.date(2022, 5, 15)) == \
+        ['2022-05', '2022-06']
+
+
+def test_export_rewrites_month(tmp_path):
+    exporter = ParquetExporter(str(tmp_path))
+    exporter.write([[Row(row(datetime.date(2022, 6, 1)))], [Row(row(datetime.date(2022, 6, 3)))]])
+    exporter._remove_month('2022-06')
+    assert exporter.write([[Row(row(datetime.date(2022, 6, day))) for day in (1, 2, 3)]], {}) == 3
+    june = pq.read_table(tmp_path / 'year=2022' / 'month=06')
+    assert june.num_rows == 3
+    assert exporter._read_state()['months'] == {'2022-06': 3}
+    assert exporter.last_date == datetime.date(2022, 6, 3)
@@ -0,0 +1,49 @@
+from unittest.mock import MagicMock, Mock
+
+import sqlalchemy as sa
+
+from cbr_data_receiver.worker import PostgreSQLClient
+
+
+def db_client(acquired):
+    client = PostgreSQLClient(conf={})
+    connection = Mock()
+    connection.execute = MagicMock(return_value=Mock(scalar=Mock(return_value=acquired)))
+    client.engine = Mock(connect=MagicMock(return_value=connection))
+    return client, connection
+
+
+def test_standby_does_not_keep_the_connection():
+    client, connection = db_client(acquired=False)
+    assert not client.acquire_leadership()
+    connection.close.assert_called_once()
+    assert client._leader_connection is None
+
+
+def test_leader_keeps_the_lock_connection():
+    client, connection = db_client(acquired=True)
+    assert client.acquire_leadership()
+    assert client.acquire_leadership()
+    client.engine.connect.assert_called_once()
+    client.release_leadership()
+    assert 'pg_advisory_unlock' in str(connection.execute.call_args[0][0])
+    connection.close.assert_called_once()
+
+
+def test_leader_keeps_running_while_the_db_is_unavailable():
+    client, connection = db_client(acquired=True)
+    assert client.acquire_leadership()
+    connection.execute.side_effect = sa.exc.OperationalError('SELECT 1', {}, Exception())
+    client.engine.connect.side_effect = sa.exc.OperationalError('connect', {}, Exception())
+    assert client.acquire_leadership()
+    connection.invalidate.assert_called_once()
+    assert client._leader_connection is None
+
+
+def test_leader_steps_down_when_another_replica_took_the_lock():
+    client, connection = db_client(acquired=True)
+    assert client.acquire_leadership()
+    connection.execute.side_effect = [sa.exc.OperationalError('SELECT 1', {}, Exception()),
+                                      Mock(scalar=Mock(return_value=False))]
+    assert not client.acquire_leadership()
+    assert client._leader_connection is None
@@ -0,0 +1,78 @@
+import datetime
+from unittest.mock import Mock
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from cbr_data_receiver.matrix import RateMatrix, RateMatrixTask, rolling_mean  # noqa: E402
+
+DAY = datetime.date(2022, 6, 10)
+
+
+def test_matrix_appends_new_dates(tmp_path):
+    matrix = RateMatrix(str(tmp_path))
+    assert matrix.append({DAY: {'R01235': 57.0, 'R01375': 0.9}}) == 1
+    assert matrix.append({DAY + datetime.timedelta(days=1): {'R01235': 58.0, 'R01010': 40.0}}) == 1
+
+    matrix = RateMatrix.open(str(tmp_path))
+    assert matrix.last_date == DAY + datetime.timedelta(days=1)
+    assert matrix.currencies == ['R01235', 'R01375', 'R01010']
+    np.testing.assert_array_equal(matrix.column('R01235'), [57.0, 58.0])
+    assert np.isnan(matrix.values[0, 2]) and np.isnan(matrix.values[1, 1])
+    assert str(matrix.dates[0]) == '2022-06-10'
+
+
+def test_matrix_extends_capacity(tmp_path, monkeypatch):
+    monkeypatch.setattr(RateMatrix, 'CAPACITY', 2)
+    matrix = RateMatrix(str(tmp_path))
+    matrix.append({DAY: {'A': 1.0, 'B': 2.0}})
+    matrix.append({DAY + datetime.timedelta(days=1): {'A': 1.5, 'C': 3.0, 'D': 4.0}})
+    matrix = RateMatrix.open(str(tmp_path))
+    assert matrix.values.shape == (2, 4)
+    np.testing.assert_array_equal(matrix.column('A'), [1.0, 1.5])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['dates.1.i4', 'meta.json', 'rates.1.f8']
+
+
+def test_matrix_ignores_interrupted_append(tmp_path):
+    matrix = RateMatrix(str(tmp_path))
+    matrix.append({DAY: {'A': 1.0}})
+    with open(tmp_path / 'rates.0.f8', 'ab') as file:
+        file.write(b'garbage')
+    matrix.append({DAY + datetime.timedelta(days=1): {'A': 2.0}})
+    np.testing.assert_array_equal(RateMatrix.open(str(tmp_path)).column('A'), [1.0, 2.0])
+
+
+def test_matrix_replace_writes_the_next_generation(tmp_path):
+    matrix = RateMatrix(str(tmp_path))
+    matrix.append({DAY: {'A': 1.0}, DAY + datetime.timedelta(days=2): {'A': 3.0}})
+    assert matrix.replace({DAY + datetime.timedelta(days=i): {'A': i + 1.0, 'B': 2.0}
+                           for i in range(3)}) == 3
+    matrix = RateMatrix.open(str(tmp_path))
+    np.testing.assert_array_equal(matrix.column('A'), [1.0, 2.0, 3.0])
+    assert matrix.quotes_count == 6
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['dates.1.i4', 'meta.json', 'rates.1.f8']
+
+
+def test_matrix_corrects_rates_in_place(tmp_path):
+    matrix = RateMatrix(str(tmp_path))
+    matrix.append({DAY: {'A': 1.0}, DAY + datetime.timedelta(days=1): {'A': 2.0}})
+    assert matrix.correct({DAY: {'A': 1.5, 'B': 7.0}}) == 1
+    matrix = RateMatrix.open(str(tmp_path))
+    assert matrix.currencies == ['A', 'B']
+    np.testing.assert_array_equal(matrix.column('A'), [1.5, 2.0])
+    assert matrix.values[0, 1] == 7.0 and np.isnan(matrix.values[1, 1])
+    assert not matrix._has_missing_dates({DAY + datetime.timedelta(days=1): {'A': 2.5}})
+    assert matrix._has_missing_dates({DAY - datetime.timedelta(days=1): {'A': 0.5}})
+
+
+def test_matrix_task_errors_are_logged(tmp_path, caplog):
+    db_client = Mock()
+    db_client.engine.connect.side_effect = RuntimeError('DB is gone')
+    RateMatrixTask.bind(str(tmp_path)).start(Mock(), db_client, {'completed': True})
+    assert 'The rate matrix was not updated' in caplog.text
+
+
+def test_rolling_mean():
+    values = np.array([[1.0, 10.0], [2.0, 20.0], [3.0, 30.0], [4.0, 40.0]])
+    np.testing.assert_allclose(rolling_mean(values, 2), [[1.5, 15.0], [2.5, 25.0], [3.5, 35.0]])
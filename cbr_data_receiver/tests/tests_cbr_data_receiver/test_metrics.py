@@ -0,0 +1,74 @@
+import datetime
+import urllib.request
+from unittest.mock import MagicMock
+
+import pytest
+
+from cbr_data_receiver import metrics
+from cbr_data_receiver.metrics import Counter, Gauge, Histogram, Registry, start_metrics_server
+from cbr_data_receiver.scheduler import MSK
+
+
+def test_registry_renders_text_format():
+    registry = Registry()
+    counter = registry.register(Counter('rows_total', 'Rows.', labels=('table',)))
+    histogram = registry.register(Histogram('duration_seconds', 'Duration.', buckets=(0.1, 1)))
+    counter.inc(3, table='quotes')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    lines = registry.render().splitlines()
+    assert '# TYPE rows_total counter' in lines
+    assert 'rows_total{table="quotes"} 3' in lines
+    assert 'duration_seconds_bucket{le="0.1"} 1' in lines
+    assert 'duration_seconds_bucket{le="1"} 2' in lines
+    assert 'duration_seconds_bucket{le="+Inf"} 3' in lines
+    assert 'duration_seconds_count 3' in lines
+    assert 'duration_seconds_sum 5.55' in lines
+
+
+def test_gauge_function_is_computed_on_render():
+    registry = Registry()
+    registry.register(Gauge('staleness_seconds', 'Staleness.', function=lambda: 42))
+    assert 'staleness_seconds 42' in registry.render().splitlines()
+
+
+def test_worker_records_stages(cbrf_worker, monkeypatch):
+    parse_count = metrics.STAGE_DURATION.count(stage='parse')
+    write_count = metrics.STAGE_DURATION.count(stage='write', task='QuotesTask')
+    rows = metrics.ROWS.value(table='quotes')
+    monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', MagicMock(return_value=None))
+    cbrf_worker.start()
+    assert metrics.STAGE_DURATION.count(stage='parse') == parse_count + 1
+    assert metrics.STAGE_DURATION.count(stage='write', task='QuotesTask') == write_count + 1
+    assert metrics.ROWS.value(table='quotes') == rows + 1
+    assert metrics.LAST_DATE.value() == datetime.datetime(2022, 6, 11, tzinfo=MSK).timestamp()
+    assert metrics.STALENESS.value() > 0
+
+
+def test_staleness_of_next_day_rates_is_zero():
+    tomorrow = datetime.datetime.now(MSK).date() + datetime.timedelta(days=1)
+    metrics.set_last_date(tomorrow)
+    assert metrics.STALENESS.value() == 0
+
+
+def test_metric_without_samples_is_abstract():
+    class Untyped(metrics.Metric):
+        pass
+
+    with pytest.raises(TypeError):
+        Untyped('untyped', 'Untyped.')
+
+
+def test_metrics_endpoint():
+    registry = Registry()
+    registry.register(Counter('iterations_total', 'Iterations.')).inc()
+    server = start_metrics_server('127.0.0.1', 0, registry)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/metrics'
+        with urllib.request.urlopen(url) as response:
+            body = response.read().decode()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert 'iterations_total 1' in body.splitlines()
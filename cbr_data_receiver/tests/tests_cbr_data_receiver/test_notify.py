@@ -0,0 +1,50 @@
+import datetime
+import json
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+from cbr_data_receiver.notify import notification_payloads
+from cbr_data_receiver.records import Quote
+from cbr_data_receiver.worker import PostgreSQLClient
+
+DAY = datetime.date(2022, 6, 11)
+
+
+def test_payloads_group_the_currencies_by_date():
+    payloads = notification_payloads([('R01020A', DAY), ('R01010', DAY),
+                                       ('R01010', datetime.date(2022, 6, 10))])
+    assert [json.loads(payload) for payload in payloads] == [
+        {'date': '2022-06-10', 'currencies': ['R01010']},
+        {'date': '2022-06-11', 'currencies': ['R01010', 'R01020A']}]
+
+
+def test_insert_notifies_the_changed_quotes_in_the_transaction():
+    db_client = PostgreSQLClient(conf={'notify_channel': 'rates'})
+    db_client.engine = MagicMock()
+    connection = db_client.engine.begin.return_value.__enter__.return_value
+    connection.execute.return_value.fetchall.return_value = [('R01010', DAY)]
+    db_client._insert_data_quotes([Quote('R01010', DAY, Decimal('41.1437'), Decimal('41.1437'))])
+    notify = connection.execute.call_args
+    assert 'pg_notify' in str(notify[0][0])
+    assert notify[1] == {'channel': 'rates',
+                         'payload': '{"date": "2022-06-11", "currencies": ["R01010"]}'}
+
+
+def test_unchanged_quotes_are_not_notified():
+    db_client = PostgreSQLClient(conf={})
+    db_client.engine = MagicMock()
+    connection = db_client.engine.begin.return_value.__enter__.return_value
+    connection.execute.return_value.fetchall.return_value = []
+    db_client._insert_data_quotes([Quote('R01010', DAY, Decimal('41.1437'), Decimal('41.1437'))])
+    assert connection.execute.call_count == 1
+
+
+def test_payloads_of_many_currencies_are_split():
+    currencies = [f'BENCH{i:05d}' for i in range(2000)]
+    payloads = notification_payloads([(currency, DAY) for currency in currencies])
+    assert len(payloads) > 1
+    assert all(len(payload.encode()) < 8000 for payload in payloads)
+    decoded = [json.loads(payload) for payload in payloads]
+    assert {payload['date'] for payload in decoded} == {'2022-06-11'}
+    assert [c for payload in decoded for c in payload['currencies']] == currencies
+    assert len(notification_payloads([('R01010', DAY)], max_payload=10)) == 1
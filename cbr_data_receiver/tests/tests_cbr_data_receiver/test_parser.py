@@ -0,0 +1,79 @@
+import datetime
+from decimal import Decimal
+import io
+
+import pytest
+
+from cbr_data_receiver.parser import ParsingError, ValCursReader, parse_val_curs
+from cbr_data_receiver.worker import CurrenciesTask, QuotesTask
+
+
+def make_server_response(count):
+    valutes = ''.join(f'''
+    <Valute ID="R{i % (count - 1 or 1):05d}">
+        <NumCode>{i:03d}</NumCode>
+        <CharCode>C{i:02d}</CharCode>
+        <Nominal>{10 ** (i % 3)}</Nominal>
+        <Name>Валюта номер {i}</Name>
+        <Value>{i},{i * 7 % 10000:04d}</Value>
+    </Valute>''' for i in range(count))
+    return (f'<?xml version="1.0" encoding="windows-1251"?>'
+            f'<ValCurs Date="11.06.2022" name="Foreign Currency Market">{valutes}'
+            f'</ValCurs>').encode('windows-1251')
+
+
+def reference_quotes_and_currencies(server_response):
+    """
+    The xmltodict implementation the streaming parser has replaced
+    """
+    xmltodict = pytest.importorskip('xmltodict')
+    val_curs = xmltodict.parse(server_response)['ValCurs']
+    date = datetime.datetime.strptime(val_curs['@Date'], '%d.%m.%Y').date()
+    currencies_data = val_curs['Valute']
+    quotes = [{'currency': val.get('@ID', ''),
+               'date': date,
+               'value': Decimal(val.get('Value', '').replace(',', '.')),
+               'unit_rate': (Decimal(val.get('Value', '').replace(',', '.')) /
+                             int(val.get('Nominal'))).quantize(Decimal('1e-12'))}
+              for val in currencies_data]
+    currencies = [{'id': val.get('@ID'),
+                   'name_rus': val.get('Name'),
+                   'code': val.get('CharCode'),
+                   'nominal': int(val.get('Nominal'))}
+                  for val in {i['@ID']: i for i in currencies_data}.values()]
+    return quotes, currencies
+
+
+@pytest.mark.parametrize('count', [2, 43, 1000])
+def test_parser_parity_with_xmltodict(count):
+    server_response = make_server_response(count)
+    document = parse_val_curs(server_response)
+    quotes = QuotesTask._get_quotes(document.date, document.valutes)
+    currencies = CurrenciesTask._get_currencies(document.valutes)
+    assert ([row._asdict() for row in quotes], [row._asdict() for row in currencies]) == \
+        reference_quotes_and_currencies(server_response)
+
+
+def test_parser_reads_file_object():
+    server_response = make_server_response(10)
+    assert parse_val_curs(io.BytesIO(server_response)) == parse_val_curs(server_response)
+
+
+def test_reader_yields_records_while_reading():
+    reader = ValCursReader(make_server_response(3))
+    first = next(iter(reader))
+    assert reader.date == datetime.date(2022, 6, 11)
+    assert first.name == 'Валюта номер 0'
+
+
+@pytest.mark.parametrize('server_response', [
+    b'',
+    b'<ValCurs></ValCurs>',
+    b'<ValCurs Date="11.06.2022"></ValCurs>',
+    b'<ValCurs Date="2022-06-11"><Valute ID="R01010"/></ValCurs>',
+    b'<Other Date="11.06.2022"><Valute ID="R01010"/></Other>',
+    b'<ValCurs Date="11.06.2022"><Valute',
+])
+def test_parser_errors(server_response):
+    with pytest.raises(ParsingError):
+        parse_val_curs(server_response)
@@ -0,0 +1,24 @@
+import tracemalloc
+
+from cbr_data_receiver.profiling import NO_PROFILER, Profiler
+
+
+def test_disabled_profiler_is_a_no_op(tmp_path):
+    profiler = Profiler(directory=str(tmp_path))
+    assert profiler.iteration() is NO_PROFILER.stage('parse')
+    with profiler.iteration(), profiler.stage('parse'):
+        pass
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profiled_iteration_writes_the_dump_and_summary(tmp_path):
+    profiler = Profiler.from_config({'dir': str(tmp_path), 'top': 5}, enabled=True)
+    with profiler.iteration():
+        with profiler.stage('parse'):
+            chunks = [bytes(1024) for _ in range(100)]
+    assert chunks and not tracemalloc.is_tracing()
+    names = sorted(path.suffix for path in tmp_path.iterdir())
+    assert names == ['.prof', '.txt']
+    summary = next(tmp_path.glob('*.txt')).read_text()
+    assert 'cumulative' in summary and 'allocations of parse' in summary
+    assert 'test_profiling.py' in summary
@@ -0,0 +1,65 @@
+import datetime
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from cbr_data_receiver import metrics
+from cbr_data_receiver.worker import Requester
+
+CBRF_API = 'https://www.cbr.ru/scripts/XML_daily.asp'
+
+
+def response(status_code, content=b'', headers=None):
+    return Mock(status_code=status_code, content=content, headers=headers or {})
+
+
+@pytest.fixture()
+def requester(tmp_path):
+    requester = Requester(CBRF_API, cache_dir=str(tmp_path))
+    requester._session = Mock()
+    return requester
+
+
+def test_requester_revalidates_cached_response(requester, tmp_path):
+    requester._session.get = MagicMock(return_value=response(200, b'<ValCurs/>', {'ETag': '"v1"'}))
+    assert requester.make_cbrf_request() == b'<ValCurs/>'
+
+    restarted = Requester(CBRF_API, cache_dir=str(tmp_path))
+    restarted._session = Mock()
+    restarted._session.get = MagicMock(return_value=response(304))
+    assert restarted.make_cbrf_request() == b'<ValCurs/>'
+    assert restarted._session.get.call_args[1]['headers'] == {'If-None-Match': '"v1"'}
+
+
+def test_requester_returns_none_for_unchanged_response(requester):
+    requester._session.get = MagicMock(return_value=response(200, b'<ValCurs/>'))
+    assert requester.make_cbrf_request() == b'<ValCurs/>'
+    requester.commit()
+    assert requester.make_cbrf_request() is None
+
+
+def test_requester_returns_uncommitted_response_again(requester):
+    requester._session.get = MagicMock(return_value=response(200, b'<ValCurs/>'))
+    assert requester.make_cbrf_request() == b'<ValCurs/>'
+    assert requester.make_cbrf_request() == b'<ValCurs/>'
+
+
+def test_requester_takes_past_days_from_cache(requester, tmp_path):
+    day = datetime.date(2022, 6, 11)
+    requester._session.get = MagicMock(return_value=response(200, b'<ValCurs/>'))
+    requester.make_cbrf_request(day)
+    assert requester._session.get.call_args[1]['params'] == {'date_req': '11/06/2022'}
+
+    restarted = Requester(CBRF_API, cache_dir=str(tmp_path))
+    restarted._session = Mock()
+    assert restarted.make_cbrf_request(day) == b'<ValCurs/>'
+    restarted._session.get.assert_not_called()
+
+
+def test_requester_counts_retries(requester, monkeypatch):
+    monkeypatch.setattr(Requester._request.retry, 'wait', lambda retry_state: 0)
+    requester._session.get = MagicMock(side_effect=[response(503), response(200, b'<ValCurs/>')])
+    retries = metrics.RETRIES.value()
+    assert requester.make_cbrf_request() == b'<ValCurs/>'
+    assert metrics.RETRIES.value() == retries + 1
+    assert metrics.REQUESTS.value(status='503') >= 1
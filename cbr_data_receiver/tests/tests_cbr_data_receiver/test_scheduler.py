@@ -0,0 +1,44 @@
+import datetime
+
+import pytest
+
+from cbr_data_receiver.scheduler import MSK, PublicationScheduler
+
+FRIDAY = datetime.date(2022, 6, 10)
+
+
+def at(day, hour, minute=0):
+    return datetime.datetime.combine(day, datetime.time(hour, minute, tzinfo=MSK))
+
+
+@pytest.fixture()
+def scheduler():
+    return PublicationScheduler(publication_time='15:30', poll_interval=300, poll_window=3600)
+
+
+def test_new_date_waits_for_the_next_publication(scheduler):
+    assert scheduler.next_delay(FRIDAY, now=at(FRIDAY, 10)) == 5.5 * 3600
+    assert scheduler.last_date == FRIDAY
+
+
+def test_polls_within_the_publication_window(scheduler):
+    scheduler.next_delay(FRIDAY, now=at(FRIDAY, 10))
+    delay = scheduler.next_delay(None, now=at(FRIDAY, 15, 35))
+    assert 270 <= delay <= 330
+    assert 270 <= scheduler.next_delay(FRIDAY, now=at(FRIDAY, 15, 40)) <= 330
+
+
+def test_skips_weekends_after_the_window(scheduler):
+    scheduler.next_delay(FRIDAY, now=at(FRIDAY, 10))
+    monday = FRIDAY + datetime.timedelta(days=3)
+    assert scheduler.next_delay(None, now=at(FRIDAY, 17)) == (
+        at(monday, 15, 30) - at(FRIDAY, 17)).total_seconds()
+
+
+def test_polls_until_the_first_document(scheduler):
+    assert 270 <= scheduler.next_delay(None, now=at(FRIDAY, 3)) <= 330
+
+
+def test_scheduler_from_config():
+    scheduler = PublicationScheduler.from_config({'publication_time': '11:30'})
+    assert scheduler.next_delay(FRIDAY, now=at(FRIDAY, 11)) == 1800
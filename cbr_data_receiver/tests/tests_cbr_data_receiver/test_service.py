@@ -0,0 +1,114 @@
+import datetime
+import json
+import threading
+from unittest.mock import MagicMock
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from cbr_data_receiver.notify import RatesNotification
+from cbr_data_receiver.service import RateCache, make_server
+
+RATE = {'currency': 'USD', 'id': 'R01235', 'date': '2022-06-10',
+        'nominal': 1, 'value': 57.0, 'unit_rate': 57.0}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def repository():
+    repository = MagicMock()
+    repository.get_rate = MagicMock(side_effect=lambda c, d: RATE if c == 'USD' else None)
+    repository.latest_date = MagicMock(return_value=datetime.date(2022, 6, 10))
+    return repository
+
+
+def test_cache_is_dropped_when_a_new_date_is_ingested(repository):
+    clock = Clock()
+    cache = RateCache(repository, refresh_interval=10, clock=clock)
+    day = datetime.date(2022, 6, 12)
+    cache.get_rate('USD', day)
+    cache.get_rate('USD', day)
+    assert repository.get_rate.call_count == 1
+
+    repository.latest_date.return_value = datetime.date(2022, 6, 11)
+    clock.now = 5
+    cache.get_rate('USD', day)
+    assert repository.get_rate.call_count == 1
+    clock.now = 11
+    cache.get_rate('USD', day)
+    assert repository.get_rate.call_count == 2
+
+
+def test_cache_drops_lookup_started_before_invalidation(repository):
+    cache = RateCache(repository)
+    day = datetime.date(2022, 6, 12)
+
+    def get_rate(currency, date):
+        cache.invalidate()
+        return RATE
+
+    repository.get_rate.side_effect = get_rate
+    cache.get_rate('USD', day)
+    cache.get_rate('USD', day)
+    assert repository.get_rate.call_count == 2
+
+
+def test_cache_is_dropped_on_notification(repository):
+    cache = RateCache(repository)
+    day = datetime.date(2022, 6, 12)
+    cache.get_rate('USD', day)
+    listener = MagicMock()
+    listener.__enter__.return_value = listener
+    listener.__iter__.return_value = iter([RatesNotification(day, ['R01235'])])
+    listener.__exit__.side_effect = RuntimeError('stop')
+    generation = cache._generation
+    with pytest.raises(RuntimeError):
+        cache._listen(listener)
+    # On connecting and on the notification
+    assert cache._generation == generation + 2
+    cache.get_rate('USD', day)
+    assert repository.get_rate.call_count == 2
+
+
+def test_cache_evicts_least_recently_used(repository):
+    cache = RateCache(repository, maxsize=2)
+    for day in (1, 2, 1, 3, 1):
+        cache.get_rate('USD', datetime.date(2022, 6, day))
+    assert repository.get_rate.call_count == 3
+
+
+@pytest.fixture()
+def server_url(repository):
+    server = make_server(RateCache(repository), '127.0.0.1', 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def test_service_rate(server_url):
+    with urlopen(f'{server_url}/rate?currency=USD&date=2022-06-12') as response:
+        assert json.load(response) == RATE
+    with pytest.raises(HTTPError) as exc:
+        urlopen(f'{server_url}/rate?currency=XXX&date=2022-06-12')
+    assert exc.value.code == 404
+    with pytest.raises(HTTPError) as exc:
+        urlopen(f'{server_url}/rate?currency=USD&date=12.06.2022')
+    assert exc.value.code == 400
+
+
+def test_service_batch_rates(server_url):
+    request = Request(f'{server_url}/rates', method='POST',
+                      data=json.dumps([{'currency': 'USD', 'date': '2022-06-12'},
+                                       {'currency': 'XXX', 'date': '2022-06-12'}]).encode())
+    with urlopen(request) as response:
+        rates = json.load(response)
+    assert [item['rate'] for item in rates] == [RATE, None]
@@ -0,0 +1,12 @@
+import pytest
+
+from cbr_data_receiver.singletons import parse_args
+
+
+def test_misspelled_flag_is_rejected():
+    with pytest.raises(SystemExit):
+        parse_args(['--onec'])
+
+
+def test_config_args_are_parsed():
+    assert parse_args(['--once', '-l', 'DEBUG']) == {'once': True, 'loglevel': 'DEBUG'}
@@ -0,0 +1,131 @@
+import datetime
+import json
+import threading
+import time
+from decimal import Decimal
+from unittest.mock import MagicMock, Mock
+
+import pytest
+
+from cbr_data_receiver import metrics, scheduler
+from cbr_data_receiver.records import Currency, Quote
+from cbr_data_receiver.sinks import FanOut, JsonlSink, Sink, SinkQueue, SinkTask
+from cbr_data_receiver.spool import Spool
+
+QUOTES = [Quote('R01010', datetime.date(2022, 6, 11), Decimal('41.1437'), Decimal('41.1437'))]
+
+
+class ListSink(Sink):
+    errors = (OSError,)
+
+    def __init__(self, release=None, failures=0):
+        self.batches = []
+        self._release = release
+        self._failures = failures
+
+    def write(self, table, rows):
+        if self._release is not None:
+            self._release.wait()
+        if self._failures:
+            self._failures -= 1
+            raise OSError('unavailable')
+        self.batches.append((table, rows))
+
+
+def test_jsonl_sink_writes_a_line_per_record(tmp_path):
+    sink = JsonlSink(str(tmp_path / 'events' / 'rates.jsonl'))
+    sink.write('quotes', QUOTES)
+    sink.write('currencies', [Currency('R01010', 'Австралийский доллар', 'AUD', 1)])
+    lines = (tmp_path / 'events' / 'rates.jsonl').read_text(encoding='utf-8').splitlines()
+    assert json.loads(lines[0]) == {'table': 'quotes', 'currency': 'R01010',
+                                    'date': '2022-06-11', 'value': '41.1437',
+                                    'unit_rate': '41.1437'}
+    assert json.loads(lines[1])['code'] == 'AUD'
+
+
+def test_slow_sink_does_not_stall_the_others():
+    release = threading.Event()
+    slow, fast = ListSink(release), ListSink()
+    fanout = FanOut([SinkQueue(slow, 'slow'), SinkQueue(fast, 'fast')])
+    fanout.deliver('quotes', QUOTES)
+    fanout.deliver('quotes', QUOTES)
+    fanout._queues[1].close()
+    assert len(fast.batches) == 2 and slow.batches == []
+    release.set()
+    fanout.close()
+    assert len(slow.batches) == 2
+
+
+def test_full_sink_queue_does_not_stall_the_others():
+    release = threading.Event()
+    slow, fast = ListSink(release), ListSink()
+    fanout = FanOut([SinkQueue(slow, 'full', queue_size=1), SinkQueue(fast, 'free')])
+    dropped = metrics.SINK_BATCHES.value(sink='full', outcome='dropped')
+    started = time.perf_counter()
+    for _ in range(4):
+        fanout.deliver('quotes', QUOTES)
+    assert time.perf_counter() - started < 0.5
+    assert metrics.SINK_BATCHES.value(sink='full', outcome='dropped') >= dropped + 2
+    fanout._queues[1].close()
+    assert len(fast.batches) == 4
+    release.set()
+    fanout.close()
+    assert 1 <= len(slow.batches) <= 2
+
+
+def test_full_sink_queue_overflows_into_spool(tmp_path):
+    release = threading.Event()
+    sink = ListSink(release)
+    sink_queue = SinkQueue(sink, 'spooled', queue_size=1, spool=Spool(str(tmp_path / 'spool')))
+    days = [datetime.date(2022, 6, day) for day in range(1, 6)]
+    for day in days:
+        assert sink_queue.put('quotes', [QUOTES[0]._replace(date=day)])
+    release.set()
+    sink_queue.close()
+    assert [row.date for _, rows in sink.batches for row in rows] == days
+    assert not (tmp_path / 'spool').exists()
+
+
+def test_failed_sink_write_is_spooled(tmp_path, monkeypatch):
+    monkeypatch.setattr(scheduler, 'RETRY_MULTIPLIER', 0)
+    monkeypatch.setattr(scheduler, 'RETRY_ATTEMPTS', 1)
+    sink = ListSink(failures=1)
+    sink_queue = SinkQueue(sink, 'recovered', spool=Spool(str(tmp_path / 'spool')))
+    sink_queue.put('quotes', QUOTES)
+    sink_queue.close()
+    assert sink.batches == [('quotes', QUOTES)]
+    assert metrics.SINK_BATCHES.value(sink='recovered', outcome='spooled') == 1
+    assert metrics.SINK_BATCHES.value(sink='recovered', outcome='replayed') == 1
+
+
+def test_sink_write_is_retried(monkeypatch):
+    monkeypatch.setattr(scheduler, 'RETRY_MULTIPLIER', 0)
+    sink = ListSink(failures=2)
+    sink_queue = SinkQueue(sink, 'flaky')
+    sink_queue.put('quotes', QUOTES)
+    sink_queue.close()
+    assert sink.batches == [('quotes', QUOTES)]
+    assert metrics.SINK_RETRIES.value(sink='flaky') == 2
+    assert metrics.SINK_BATCHES.value(sink='flaky', outcome='delivered') == 1
+
+
+def test_sink_task_delivers_the_document_records():
+    fanout = Mock()
+    document = Mock(date=datetime.date(2022, 6, 11), valutes=[
+        Mock(id='R01010', char_code='AUD', nominal='1', value='41,1437')])
+    document.valutes[0].name = 'Австралийский доллар'
+    SinkTask.bind(fanout).start(document, db_client=None, params={})
+    assert [call[0][0] for call in fanout.deliver.call_args_list] == ['currencies', 'quotes']
+    assert fanout.deliver.call_args[0][1] == QUOTES
+
+
+def test_redis_sink_keys():
+    pytest.importorskip('redis')
+    from cbr_data_receiver.sinks import RedisSink
+
+    sink = RedisSink('redis://localhost:6379/0')
+    sink._client = MagicMock()
+    sink.write('quotes', QUOTES)
+    pipeline = sink._client.pipeline.return_value
+    assert pipeline.hset.call_args[0][:2] == ('cbr:quotes:2022-06-11', 'R01010')
+    pipeline.execute.assert_called_once()
@@ -0,0 +1,87 @@
+import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock, Mock
+
+import pytest
+import sqlalchemy as sa
+
+from cbr_data_receiver.records import Currency, Quote
+from cbr_data_receiver.spool import Spool
+
+
+def quote(currency, day, value):
+    return Quote(currency, day, Decimal(value), Decimal(value))
+
+
+@pytest.fixture()
+def spool(tmp_path):
+    return Spool(str(tmp_path / 'spool.jsonl'))
+
+
+def test_spool_replays_rows_in_date_order_without_duplicates(spool):
+    day1, day2 = datetime.date(2022, 6, 10), datetime.date(2022, 6, 11)
+    spool.append('quotes', [quote('R01010', day2, '41.0')])
+    spool.append('quotes', [quote('R01010', day1, '40.0')])
+    spool.append('quotes', [quote('R01010', day2, '41.5')])
+    spool.append('currencies', [Currency('R01010', 'AUD', 'AUD', 1)])
+    db_client = Mock()
+    assert spool.drain(db_client) == 3
+    assert db_client.insert_data_quotes.call_args[0][0] == [
+        quote('R01010', day1, '40.0'),
+        quote('R01010', day2, '41.5'),
+    ]
+    db_client.insert_data_currencies.assert_called_once()
+    assert not spool.pending
+    assert spool.drain(db_client) == 0
+
+
+def test_spool_is_kept_when_the_db_is_unavailable(spool):
+    spool.append('quotes', [quote('R01010', datetime.date(2022, 6, 11), '41.0')])
+    db_client = Mock()
+    db_client.insert_data_quotes.side_effect = sa.exc.OperationalError('COPY', {}, Exception())
+    with pytest.raises(sa.exc.OperationalError):
+        spool.drain(db_client)
+    spool.append('quotes', [quote('R01020A', datetime.date(2022, 6, 11), '33.0')])
+    assert spool.pending
+    db_client.insert_data_quotes.side_effect = None
+    assert spool.drain(db_client) == 1
+    assert spool.drain(db_client) == 1
+    assert not spool.pending
+
+
+def test_spool_skips_torn_line(spool, tmp_path):
+    spool.append('quotes', [quote('R01010', datetime.date(2022, 6, 11), '41.0')])
+    with open(tmp_path / 'spool.jsonl', 'a') as file:
+        file.write('{"table": "quo')
+    db_client = Mock()
+    assert spool.drain(db_client) == 1
+
+
+def test_worker_spools_document_when_the_db_is_unavailable(cbrf_worker, spool):
+    cbrf_worker._db_client.is_quotes_ingested.side_effect = \
+        sa.exc.OperationalError('SELECT', {}, Exception())
+    cbrf_worker._spool = spool
+    cbrf_worker._wait_for_the_next_iteration = MagicMock(return_value=None)
+    worker = cbrf_worker.start()
+    assert worker._params['completed']
+    assert worker._date == datetime.date(2022, 6, 11)
+    assert spool.pending
+    loader = Mock()
+    assert spool.drain(loader) == 2
+    assert loader.insert_data_quotes.call_args[0][0][0].value == Decimal('41.1437')
+
+
+def test_spool_appends_after_torn_line(spool, tmp_path):
+    spool.append('quotes', [quote('R01010', datetime.date(2022, 6, 10), '40.0')])
+    with open(tmp_path / 'spool.jsonl', 'a') as file:
+        file.write('{"table": "quo')
+    spool.append('quotes', [quote('R01010', datetime.date(2022, 6, 11), '41.0')])
+    db_client = Mock()
+    assert spool.drain(db_client) == 2
+    assert [row.date.day for row in db_client.insert_data_quotes.call_args[0][0]] == [10, 11]
+
+
+def test_spool_first_append_logs_no_warning(spool, caplog):
+    spool.append('quotes', [quote('R01010', datetime.date(2022, 6, 10), '40.0')])
+    spool.append('quotes', [quote('R01010', datetime.date(2022, 6, 11), '41.0')])
+    assert not [record for record in caplog.records if record.levelname == 'WARNING']
@@ -1,34 +1,17 @@
+import datetime
+from decimal import Decimal
+
 import pytest
 from unittest.mock import Mock, MagicMock
 
-from cbr_data_receiver.worker import CbrWorker
+from tenacity import RetryError
+
+from cbr_data_receiver import worker as worker_module
+from cbr_data_receiver.records import Currency, Quote
 
 @pytest.fixture()
-def cbrf_worker():
-    server_responce = '''<?xml version="1.0" encoding="windows-1251"?>
-    <ValCurs Date="11.06.2022" name="Foreign Currency Market">
-    <Valute ID="R01010">
-        <NumCode>036</NumCode>
-        <CharCode>AUD</CharCode>
-        <Nominal>1</Nominal>
-        <Name>Австралийский доллар</Name>
-        <Value>41,1437</Value>
-    </Valute>
-    <Valute ID="R01020A">
-        <NumCode>944</NumCode>
-        <CharCode>AZN</CharCode>
-        <Nominal>1</Nominal>
-        <Name>Азербайджанский манат</Name>
-        <Value>33,9871</Value>
-    </Valute>
-    </ValCurs>'''
-    requester, db_client = Mock(), Mock()
-    requester.make_cbrf_request = MagicMock(return_value=server_responce)
-    db_client.insert_data_quotes = MagicMock(return_value=None)
-    db_client.insert_data_currencies = MagicMock(return_value=None)
-    return CbrWorker(config=Mock(),
-                     db_client=db_client,
-                     requester=requester)
+def server_response(make_server_response):
+    return make_server_response(currencies=('R01010', 'R01020A'))
 
 
 def test_worker_params_completed(cbrf_worker, monkeypatch):
@@ -41,3 +24,73 @@ def test__worker_params_message(cbrf_worker, monkeypatch):
     monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', MagicMock(return_value=None))
     worker = cbrf_worker.start()
     assert worker._params['completed']
+
+
+def test_worker_parses_response_once(cbrf_worker, monkeypatch):
+    monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', MagicMock(return_value=None))
+    parse = MagicMock(wraps=worker_module.parse_val_curs)
+    monkeypatch.setattr(worker_module, 'parse_val_curs', parse)
+    worker = cbrf_worker.start()
+    assert parse.call_count == 1
+    worker._requester.commit.assert_called_once_with(None)
+    quotes = worker._db_client.insert_data_quotes.call_args[0][0]
+    assert quotes[0] == Quote('R01010', datetime.date(2022, 6, 11),
+                             Decimal('41.1437'), Decimal('41.1437'))
+    currencies = worker._db_client.insert_data_currencies.call_args[0][0]
+    assert currencies[1] == Currency('R01020A', 'Азербайджанский манат', 'AZN', 1)
+
+
+def test_worker_params_parsing_error(cbrf_worker, monkeypatch):
+    monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', MagicMock(return_value=None))
+    cbrf_worker._requester.make_cbrf_request = MagicMock(return_value='<ValCurs></ValCurs>')
+    worker = cbrf_worker.start()
+    assert not worker._params['completed']
+    worker._db_client.insert_data_quotes.assert_not_called()
+    worker._requester.commit.assert_not_called()
+
+
+def test_worker_skips_ingested_date(cbrf_worker, monkeypatch):
+    monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', MagicMock(return_value=None))
+    cbrf_worker._db_client.is_quotes_ingested = MagicMock(return_value=True)
+    worker = cbrf_worker.start()
+    assert worker._params['completed']
+    worker._db_client.is_quotes_ingested.assert_called_once_with(
+        datetime.date(2022, 6, 11), ['R01010', 'R01020A'])
+    worker._db_client.insert_data_quotes.assert_not_called()
+
+
+def test_worker_skips_unchanged_response(cbrf_worker, monkeypatch):
+    monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', MagicMock(return_value=None))
+    cbrf_worker._requester.make_cbrf_request = MagicMock(return_value=None)
+    worker = cbrf_worker.start()
+    assert worker._params['completed']
+    worker._db_client.insert_data_currencies.assert_not_called()
+
+
+def test_worker_params_api_unavailable(cbrf_worker, monkeypatch):
+    monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', MagicMock(return_value=None))
+    cbrf_worker._requester.make_cbrf_request = MagicMock(side_effect=RetryError(None))
+    worker = cbrf_worker.start()
+    assert not worker._params['completed']
+    worker._db_client.insert_data_quotes.assert_not_called()
+
+
+def test_run_once_does_not_wait(cbrf_worker, monkeypatch):
+    wait = MagicMock(return_value=None)
+    monkeypatch.setattr(cbrf_worker, '_wait_for_the_next_iteration', wait)
+    assert cbrf_worker.run_once().completed
+    wait.assert_not_called()
+
+
+def test_run_once_exit_code(cbrf_worker, monkeypatch, tmp_path):
+    from cbr_data_receiver import run
+
+    config = Mock(spool_file=str(tmp_path / 'spool.jsonl'), matrix_dir=None, sinks=None,
+                  profiling=None, profile=False)
+    monkeypatch.setattr(worker_module.PostgreSQLClient, 'get_client',
+                        MagicMock(return_value=cbrf_worker._db_client))
+    monkeypatch.setattr(worker_module, 'Requester',
+                        MagicMock(return_value=cbrf_worker._requester))
+    assert run.run_once(config) == 0
+    cbrf_worker._requester.make_cbrf_request.side_effect = RetryError(None)
+    assert run.run_once(config) == 1
@@ -1,38 +1,151 @@
 """
 CbrWorker module
 """
+import datetime
+import hashlib
 import time
-from typing import Any, Dict, List, Tuple
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Sequence, Tuple, Type
 
 import requests
-import xmltodict
 
 import sqlalchemy as sa
+from cbr_data_receiver.bulk import CopyReader
+from cbr_data_receiver.cache import CachedResponse, ResponseCache
 from cbr_data_receiver.logger import get_logger
-from cbr_data_receiver.models import currencies, quotes, schema_name
+from cbr_data_receiver.metrics import ITERATIONS, LEADER, REQUESTS, ROWS, STAGE_DURATION, \
+    STAGE_ERRORS, count_retry, set_last_date
+from cbr_data_receiver.models import AGGREGATE_PERIODS, CURRENCIES_SELECT_SQL, \
+    QUOTES_STAGING_DDL, UNIT_RATE_SCALE, currencies_upsert_sql, quotes, quotes_ingested_sql, \
+    quotes_merge_sql, quotes_partition_ddl, quotes_upsert_sql, rate_aggregates, \
+    rate_aggregates_sql, schema_name
+from cbr_data_receiver.notify import CHANNEL, notification_payloads
+from cbr_data_receiver.parser import ParsingError, ValCurs, Valute, parse_val_curs
+from cbr_data_receiver.profiling import NO_PROFILER, Profiler
+from cbr_data_receiver.records import Currency, CurrencyCache, Quote
+from cbr_data_receiver.scheduler import PublicationScheduler, backoff_retry
 from cbr_data_receiver.singletons import Config
-from sqlalchemy.dialects.postgresql import insert
-from tenacity import TryAgain, retry
+from tenacity import RetryError, TryAgain
 
+UNIT_RATE_QUANTUM = Decimal(1).scaleb(-UNIT_RATE_SCALE)
 
-class Requester:
+if TYPE_CHECKING:
+    from cbr_data_receiver.async_worker import AsyncPostgreSQLClient
+    from cbr_data_receiver.spool import Spool
+
+
+class BaseRequester:
     """
-    HTTP client
+    Response cache and change detection of the HTTP clients.
+    Rates of the past days do not change, so they are taken from the
+    cache without a request. Otherwise the cached response is revalidated
+    with a conditional request
     """
 
-    def __init__(self, cbrf_api: str) -> None:
+    def __init__(self, cbrf_api: str, cache_dir: Optional[str] = None) -> None:
         self._cbrf_api = cbrf_api
+        self._cache = ResponseCache(cache_dir) if cache_dir else None
+        self._last_digests: Dict[Optional[datetime.date], bytes] = {}
+        self._pending_digests: Dict[Optional[datetime.date], bytes] = {}
+
+    def commit(self, date_req: Optional[datetime.date] = None) -> None:
+        """
+        Records the last response of the day as processed, the same
+        response is reported as unchanged from then on
+        """
+        digest = self._pending_digests.pop(date_req, None)
+        if digest is not None:
+            self._last_digests[date_req] = digest
+
+    def _changed(self, date_req: Optional[datetime.date], content: bytes) -> Optional[bytes]:
+        """
+        Returns None if the content is the last committed response of the day,
+        otherwise its digest is pending until the commit
+        """
+        digest = hashlib.sha1(content).digest()
+        if self._last_digests.get(date_req) == digest:
+            return None
+        self._pending_digests[date_req] = digest
+        return content
+
+    @staticmethod
+    def _request_params(date_req: Optional[datetime.date]) -> Optional[Dict[str, str]]:
+        return {'date_req': date_req.strftime('%d/%m/%Y')} if date_req else None
+
+    def _cached(self, date_req: Optional[datetime.date]) -> Optional[CachedResponse]:
+        """
+        The cached response of the day, reads the cache directory
+        """
+        if self._cache is None:
+            return None
+        return self._cache.get(self._cbrf_api, self._request_params(date_req))
+
+    @staticmethod
+    def _is_final(date_req: Optional[datetime.date], cached: Optional[CachedResponse]) -> bool:
+        """
+        Whether the cached response is used without a request
+        """
+        return bool(cached and date_req and date_req < datetime.date.today())
+
+    @staticmethod
+    def _conditional_headers(cached: Optional[CachedResponse]) -> Dict[str, str]:
+        headers = {}
+        if cached and cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached and cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+        return headers
+
+    def _store(self, date_req: Optional[datetime.date], content: bytes,
+               headers: Mapping[str, str]) -> None:
+        """
+        Caches the response with its validators, writes the cache directory
+        """
+        if self._cache is not None:
+            self._cache.put(self._cbrf_api, self._request_params(date_req),
+                            CachedResponse(content, headers.get('ETag'),
+                                           headers.get('Last-Modified')))
+
 
-    @retry()
-    def make_cbrf_request(self) -> str:
+class Requester(BaseRequester):
+    """
+    HTTP client.
+    Keeps the connection alive between requests and, if a cache
+    directory is set, stores the responses on disk
+    """
+
+    def __init__(self, cbrf_api: str, cache_dir: Optional[str] = None) -> None:
+        super().__init__(cbrf_api, cache_dir)
+        self._session = requests.Session()
+
+    def make_cbrf_request(self, date_req: Optional[datetime.date] = None) -> Optional[bytes]:
         """
         Making a request.
-        In case of unsuccessful result, repeat.
+        The raw windows-1251 body is returned, it is decoded by the parser.
+        If date_req is set, the rates published for that day are requested.
+        Returns None if the response did not change since the last
+        committed response of the same day
         """
-        result = requests.get(self._cbrf_api)
+        cached = self._cached(date_req)
+        if self._is_final(date_req, cached):
+            REQUESTS.inc(status='cache')
+            return self._changed(date_req, cached.content)
+        return self._changed(date_req, self._request(date_req, cached))
+
+    @backoff_retry(requests.RequestException, before_sleep=count_retry)
+    def _request(self, date_req: Optional[datetime.date],
+                 cached: Optional[CachedResponse]) -> bytes:
+        """
+        In case of unsuccessful result, repeat with a backoff.
+        """
+        result = self._session.get(self._cbrf_api, params=self._request_params(date_req),
+                                   headers=self._conditional_headers(cached))
+        REQUESTS.inc(status=str(result.status_code))
+        if result.status_code == 304 and cached:
+            return cached.content
         if result.status_code == 200:
-            return result.text
-        time.sleep(10)
+            self._store(date_req, result.content, result.headers)
+            return result.content
         raise TryAgain
 
 
@@ -40,10 +153,30 @@ class PostgreSQLClient:
     """
     PostgreSQL DB client
     """
+    # Batches of at least this size are loaded with COPY
+    BULK_THRESHOLD = 5000
+    # Seconds, an unavailable DB must not block the worker for long
+    CONNECT_TIMEOUT = 5
+    # Advisory lock held by the leader of the replicas
+    LEADER_LOCK_KEY = 6513522
+    # The server drops the connection of a dead leader after
+    # idle + interval * count seconds, releasing the lock
+    LEADER_KEEPALIVES = {'tcp_keepalives_idle': 5,
+                         'tcp_keepalives_interval': 2,
+                         'tcp_keepalives_count': 3}
+    # Seconds, the currencies cache is read again from the table after that
+    CURRENCY_CACHE_TTL = 3600
 
     def __init__(self, conf: Config) -> None:
         self.conf = conf
         self._schema = schema_name
+        self._bulk_threshold = conf.get('bulk_threshold', self.BULK_THRESHOLD)
+        self._partition_years: set = set()
+        self._leader_lock_key = conf.get('leader_lock_key', self.LEADER_LOCK_KEY)
+        self._leader_connection: Optional[sa.engine.Connection] = None
+        self._is_leader = False
+        self._currency_cache: Optional[CurrencyCache] = None
+        self._notify_channel = conf.get('notify_channel', CHANNEL)
 
     @classmethod
     def get_client(cls, **options):
@@ -62,29 +195,189 @@ class PostgreSQLClient:
                                        f":{self.conf['password']}"
                                        f"@{self.conf['host']}"
                                        f":{self.conf['port']}"
-                                       f"/{self.conf['dbname']}")
+                                       f"/{self.conf['dbname']}",
+                                       connect_args={'connect_timeout': self.conf.get(
+                                           'connect_timeout', self.CONNECT_TIMEOUT)})
+
+    def acquire_leadership(self) -> bool:
+        """
+        Tries to become the leader of the replicas, only the leader runs
+        the ingest loop. The session advisory lock is held by a dedicated
+        connection, so it is released by the server as soon as the
+        connection of a dead leader is closed. The leader checks that
+        its connection is alive on every call.
+        While the DB is unavailable nobody can take the lock, so the leader
+        keeps running the loop (spooling the data) until it reconnects
+        """
+        if self._leader_connection is not None:
+            try:
+                self._leader_connection.execute(sa.text("SELECT 1"))
+                return True
+            except sa.exc.DBAPIError:
+                get_logger().warning('The leader lost the connection to the DB.')
+                self._leader_connection.invalidate()
+                self._leader_connection = None
+        try:
+            connection = self.engine.connect()
+        except sa.exc.DBAPIError:
+            return self._is_leader
+        try:
+            acquired = connection.execute(sa.text("SELECT pg_try_advisory_lock(:key)"),
+                                          key=self._leader_lock_key).scalar()
+            if acquired:
+                for name, value in self.LEADER_KEEPALIVES.items():
+                    connection.execute(sa.text(f"SET {name} = {int(value)}"))
+        except sa.exc.DBAPIError:
+            connection.invalidate()
+            return self._is_leader
+        if acquired:
+            self._leader_connection = connection
+        else:
+            connection.close()
+        self._set_leader(bool(acquired))
+        return self._is_leader
+
+    def release_leadership(self) -> None:
+        """
+        Releases the advisory lock, a standby replica takes over
+        """
+        if self._leader_connection is not None:
+            try:
+                self._leader_connection.execute(sa.text("SELECT pg_advisory_unlock(:key)"),
+                                                key=self._leader_lock_key)
+                self._leader_connection.close()
+            except sa.exc.DBAPIError:
+                self._leader_connection.invalidate()
+            self._leader_connection = None
+        self._set_leader(False)
+
+    def _set_leader(self, is_leader: bool) -> None:
+        if is_leader != self._is_leader:
+            get_logger().info('The replica became the leader.' if is_leader else
+                              'The replica is on standby.')
+        if is_leader and not self._is_leader:
+            # The table may have been changed while another replica was leading
+            self._currency_cache = None
+        self._is_leader = is_leader
+        LEADER.set(int(is_leader))
+
+    def insert_data_quotes(self, data_lst: List[Quote]) -> None:
+        """
+        Adds data to the quotes table.
+        Large batches are streamed with COPY, small ones are inserted.
+        Quotes already in the table are updated only if the value changed.
+        The listeners are notified of the changed quotes on commit.
+        The aggregates of the loaded dates are updated once the quotes are committed
+        """
+        if not data_lst:
+            return
+        self._create_partitions({row.date.year for row in data_lst})
+        if len(data_lst) >= self._bulk_threshold:
+            self._copy_data_quotes(data_lst)
+        else:
+            self._insert_data_quotes(data_lst)
+        self.update_aggregates(min(row.date for row in data_lst),
+                               max(row.date for row in data_lst))
+
+    def update_aggregates(self, date_from: datetime.date, date_to: datetime.date) -> None:
+        """
+        Recomputes the aggregate buckets covering the dates
+        """
+        with self.engine.begin() as connection:
+            for period in AGGREGATE_PERIODS:
+                connection.execute(sa.text(rate_aggregates_sql(period, date_from, date_to)))
+
+    def rebuild_aggregates(self) -> None:
+        """
+        Recomputes all the aggregates from the quotes
+        """
+        with self.engine.begin() as connection:
+            date_from, date_to = connection.execute(
+                sa.select([sa.func.min(quotes.c.date), sa.func.max(quotes.c.date)])).fetchone()
+            connection.execute(rate_aggregates.delete())
+            if date_from is None:
+                return
+            for period in AGGREGATE_PERIODS:
+                connection.execute(sa.text(rate_aggregates_sql(period, date_from, date_to)))
+
+    def _create_partitions(self, years: set) -> None:
+        """
+        Creates the yearly partitions of the quotes table,
+        which were not created by this client yet
+        """
+        new_years = years - self._partition_years
+        if not new_years:
+            return
+        with self.engine.begin() as connection:
+            for year in sorted(new_years):
+                connection.execute(sa.text(quotes_partition_ddl(year)))
+        self._partition_years |= new_years
+
+    def _insert_data_quotes(self, data_lst: List[Quote]) -> None:
+        """
+        Inserts the rows in one statement, which cannot update a row twice,
+        so the last row of a repeated key wins
+        """
+        unique_rows = {(row.currency, row.date): row for row in data_lst}
+        columns = dict(zip(Quote._fields, map(list, zip(*unique_rows.values()))))
+        with self.engine.begin() as connection:
+            stmt = sa.text(quotes_upsert_sql(':currency', ':date', ':value', ':unit_rate'))
+            self._notify(connection, connection.execute(stmt, **columns).fetchall())
 
-    def insert_data_quotes(self, data_lst: List) -> None:
+    def _copy_data_quotes(self, data_lst: List[Quote]) -> None:
         """
-        Adds data to the quotes table
+        Streams the rows with COPY into a temporary (not WAL-logged)
+        staging table and merges them into the quotes table in one statement
         """
+        columns = ('currency', 'date', 'value', 'unit_rate')
         with self.engine.begin() as connection:
-            connection.execute(quotes.insert(), data_lst)
+            cursor = connection.connection.cursor()
+            cursor.execute(QUOTES_STAGING_DDL)
+            cursor.copy_expert("COPY quotes_staging (currency, date, value, unit_rate) FROM STDIN",
+                               CopyReader(data_lst, columns))
+            cursor.execute(quotes_merge_sql())
+            self._notify(connection, cursor.fetchall())
+
+    def _notify(self, connection: sa.engine.Connection,
+                changed: Sequence[Tuple[str, datetime.date]]) -> None:
+        """
+        Notifies the listeners of the changed quotes by date,
+        the notifications are delivered when the transaction commits
+        """
+        for payload in notification_payloads(changed):
+            connection.execute(sa.text("SELECT pg_notify(:channel, :payload)"),
+                               channel=self._notify_channel, payload=payload)
+
+    def is_quotes_ingested(self, date: datetime.date, currency_ids: List[str]) -> bool:
+        """
+        Checks whether the quotes of all the currencies are already
+        in the quotes table for the date
+        """
+        stmt = sa.text(quotes_ingested_sql(':date', ':currency_ids'))
+        with self.engine.connect() as connection:
+            return connection.execute(stmt, date=date, currency_ids=list(currency_ids)).scalar() \
+                >= len(set(currency_ids))
 
-    def insert_data_currencies(self, data_lst: List) -> None:
+    def insert_data_currencies(self, data_lst: List[Currency]) -> None:
         """
         Adds data to the currencies table.
-        In case of conflict currencies_pkey, update the data
+        In case of conflict currencies_pkey, update the data.
+        Only the currencies changed since the last load are sent, the cache
+        is read from the table on the first call, when it expires and when
+        the replica becomes the leader
         """
+        if self._currency_cache is None or self._currency_cache.expired:
+            with self.engine.connect() as connection:
+                self._currency_cache = CurrencyCache(
+                    (Currency(*row) for row in connection.execute(sa.text(CURRENCIES_SELECT_SQL))),
+                    ttl=self.conf.get('currency_cache_ttl', self.CURRENCY_CACHE_TTL))
+        changed = self._currency_cache.changed(data_lst)
+        if not changed:
+            return
         with self.engine.begin() as connection:
-            stmt = insert(currencies).values(data_lst)
-            stmt = stmt.on_conflict_do_update(constraint="currencies_pkey",
-                                              set_={
-                                                  "name_rus": stmt.excluded.name_rus,
-                                                  "code": stmt.excluded.code,
-                                                  "nominal": stmt.excluded.nominal,
-                                              })
-            connection.execute(stmt)
+            connection.execute(sa.text(currencies_upsert_sql(':id', ':name_rus', ':code', ':nominal')),
+                               [row._asdict() for row in changed])
+        self._currency_cache.update(changed)
 
 
 class CbrWorker:
@@ -92,36 +385,134 @@ class CbrWorker:
     The worker receives data from the Central Bank of the
     Russian Federation and adds it to the user database
     """
+    # Errors of the tasks on which the document is spooled
+    DB_UNAVAILABLE: Tuple[Type[BaseException], ...] = (sa.exc.OperationalError,)
 
     def __init__(self, config: Config,
                  db_client: PostgreSQLClient,
-                 requester: Requester) -> None:
+                 requester: Requester,
+                 scheduler: Optional[PublicationScheduler] = None,
+                 tasks: Optional[List[type]] = None,
+                 spool: Optional['Spool'] = None,
+                 profiler: Profiler = NO_PROFILER) -> None:
         self._db_client = db_client
         self._requester = requester
-        self._waiting_time = config.waiting_time
-        self._tasks = [QuotesTask, CurrenciesTask]
+        self._spool = spool
+        self._profiler = profiler
+        self._scheduler = scheduler or PublicationScheduler()
+        self._date: Optional[datetime.date] = None
+        self._tasks = tasks or [QuotesTask, CurrenciesTask]
         self._params = {'completed': True, 'message': 'Data received and successfully added to DB.'}
         self._logger = get_logger()
 
+    @property
+    def completed(self) -> bool:
+        """
+        Whether the last iteration succeeded
+        """
+        return self._params['completed']
+
     def start(self):
         """
         Starts running tasks
         """
-        server_response = self._requester.make_cbrf_request()
-        for task in self._tasks:
-            if self._params['completed']:
-                task.start(server_response, self._db_client, self._params)
-            # TODO telegram notifier, to inform about CB RF format changes
-        self._logger.info(f"{self._params['message']}")
+        self.run_once()
         self._logger.info(f'Waiting for the next iteration ...')
         self._wait_for_the_next_iteration()
         return self
 
+    def run_once(self, date_req: Optional[datetime.date] = None):
+        """
+        Fetches, parses and stores the rates of one day
+        """
+        with self._profiler.iteration():
+            self._run_iteration(date_req)
+        return self
+
+    def _run_iteration(self, date_req: Optional[datetime.date]) -> None:
+        try:
+            with STAGE_DURATION.time(stage='fetch'):
+                server_response = self._requester.make_cbrf_request(date_req)
+        except RetryError:
+            self._fetch_failed()
+            server_response = None
+        else:
+            self._fetched(server_response)
+        if server_response is not None:
+            document = self._parse(server_response)
+            spooled = False
+            for task in self._tasks:
+                if not self._params['completed']:
+                    break
+                try:
+                    with self._profiler.stage(task.__name__), \
+                            STAGE_DURATION.time(stage='task', task=task.__name__):
+                        task.start(document, self._db_client, self._params)
+                except self.DB_UNAVAILABLE:
+                    if self._spool is None:
+                        raise
+                    self._spool_document(task, document)
+                    spooled = True
+                    break
+            self._complete(date_req, document, spooled)
+        self._finish()
+
+    def _fetch_failed(self) -> None:
+        STAGE_ERRORS.inc(stage='fetch')
+        self._params['completed'] = False
+        self._params['message'] = 'The Central Bank of the Russian Federation ' \
+                                  'API is unavailable.'
+
+    def _fetched(self, server_response: Optional[bytes]) -> None:
+        if server_response is None:
+            self._params['message'] = 'Data has not changed since the last request.'
+
+    def _complete(self, date_req: Optional[datetime.date], document: Optional[ValCurs],
+                  spooled: bool) -> None:
+        """
+        Commits the response of a completed iteration
+        """
+        if self._params['completed']:
+            self._date = document.date
+            self._requester.commit(date_req)
+            if not spooled:
+                set_last_date(document.date)
+            # TODO telegram notifier, to inform about CB RF format changes
+
+    def _finish(self) -> None:
+        ITERATIONS.inc(outcome='completed' if self._params['completed'] else 'failed')
+        self._logger.info(f"{self._params['message']}")
+
+    def _parse(self, server_response: bytes) -> Optional[ValCurs]:
+        """
+        Parses the server response once for all tasks
+        """
+        try:
+            with self._profiler.stage('parse'), STAGE_DURATION.time(stage='parse'):
+                return parse_val_curs(server_response)
+        except ParsingError:
+            STAGE_ERRORS.inc(stage='parse')
+            self._params['completed'] = False
+            self._params['message'] = 'Problem with parsing data, ' \
+                                      'received from the Central Bank ' \
+                                      'of the Russian Federation'
+        return None
+
+    def _spool_document(self, task: type, document: ValCurs) -> None:
+        """
+        The DB is unavailable, the rows are kept in the spool until
+        the drainer loads them
+        """
+        STAGE_ERRORS.inc(stage='task', task=task.__name__)
+        self._spool.append('currencies', CurrenciesTask._get_currencies(document.valutes))
+        self._spool.append('quotes', QuotesTask._get_quotes(document.date, document.valutes))
+        self._params['message'] = f'The DB is unavailable, data for {document.date} is spooled.'
+
     def _wait_for_the_next_iteration(self):
         """
-        Wait a day for the next update
+        Wait for the next publication, or poll while it is expected
         """
-        time.sleep(self._waiting_time)
+        time.sleep(self._scheduler.next_delay(self._date))
 
 
 class BaseTask:
@@ -130,26 +521,13 @@ class BaseTask:
     """
 
     def __init__(self,
-                 server_response: str,
+                 document: ValCurs,
                  db_client: PostgreSQLClient,
                  params: Dict[str, Any]) -> None:
-        self._server_response = server_response
+        self._document = document
         self._db_client = db_client
         self._params = params
 
-    def _get_date_and_currencies(self, json_server_response: Dict[str, Any]) -> Tuple:
-        date, currencies_data = None, None
-        try:
-            val_curs = json_server_response['ValCurs']
-            date = val_curs['@Date']
-            currencies_data = val_curs['Valute']
-        except KeyError:
-            self._params['completed'] = False
-            self._params['message'] = 'Problem with parsing data, ' \
-                                      'received from the Central Bank ' \
-                                      'of the Russian Federation'
-        return date, currencies_data
-
 
 class QuotesTask(BaseTask):
     """
@@ -157,30 +535,53 @@ class QuotesTask(BaseTask):
     """
 
     @classmethod
-    def start(cls, server_response: str,
+    def start(cls, document: ValCurs,
               db_client: PostgreSQLClient,
               params: Dict[str, Any]) -> None:
         """
         Starting the quotes task
         """
-        self = cls(server_response, db_client, params)
-        json_server_response = xmltodict.parse(server_response)
-        date, currencies_data = self._get_date_and_currencies(json_server_response)
-        if date and currencies_data:
-            clean_data = self._get_quotes(date, currencies_data)
-            self._db_client.insert_data_quotes(clean_data)
+        self = cls(document, db_client, params)
+        if document.date and document.valutes:
+            if self._db_client.is_quotes_ingested(document.date,
+                                                  [val.id for val in document.valutes]):
+                self._params['message'] = f'Data for {document.date} is already in DB.'
+                return
+            with STAGE_DURATION.time(stage='transform', task='QuotesTask'):
+                clean_data = self._get_quotes(document.date, document.valutes)
+            with STAGE_DURATION.time(stage='write', task='QuotesTask'):
+                self._db_client.insert_data_quotes(clean_data)
+            ROWS.inc(len(clean_data), table='quotes')
+
+    @classmethod
+    async def start_async(cls, document: ValCurs,
+                          db_client: 'AsyncPostgreSQLClient',
+                          params: Dict[str, Any]) -> None:
+        """
+        Starting the quotes task with the async DB client
+        """
+        self = cls(document, db_client, params)
+        if document.date and document.valutes:
+            if await self._db_client.is_quotes_ingested(document.date,
+                                                        [val.id for val in document.valutes]):
+                self._params['message'] = f'Data for {document.date} is already in DB.'
+                return
+            with STAGE_DURATION.time(stage='transform', task='QuotesTask'):
+                clean_data = self._get_quotes(document.date, document.valutes)
+            with STAGE_DURATION.time(stage='write', task='QuotesTask'):
+                await self._db_client.insert_data_quotes(clean_data)
+            ROWS.inc(len(clean_data), table='quotes')
 
     @staticmethod
-    def _get_quotes(date: str, currencies_data: List) -> List:
+    def _get_quotes(date: datetime.date, currencies_data: List[Valute]) -> List[Quote]:
         """
-        Parsing quotes data
+        Parsing quotes data, values are exact decimals
         """
         result = []
         for val in currencies_data:
-            result.append({'currency': val.get('@ID', ''),
-                           'date': date,
-                           'value': float(val.get('Value', '').replace(',', '.')),
-                           })
+            value = Decimal(val.value.replace(',', '.'))
+            result.append(Quote(val.id, date, value,
+                                (value / int(val.nominal)).quantize(UNIT_RATE_QUANTUM)))
         return result
 
 
@@ -190,28 +591,39 @@ class CurrenciesTask(BaseTask):
     """
 
     @classmethod
-    def start(cls, server_response: str, db_client: PostgreSQLClient, params: Dict[str, Any]):
+    def start(cls, document: ValCurs, db_client: PostgreSQLClient, params: Dict[str, Any]):
         """
         Starting the currencies task
         """
-        self = cls(server_response, db_client, params)
-        json_server_response = xmltodict.parse(server_response)
-        date, currencies_data = self._get_date_and_currencies(json_server_response)
-        if date and currencies_data:
-            clean_data = self._get_currencies(currencies_data)
-            self._db_client.insert_data_currencies(clean_data)
+        self = cls(document, db_client, params)
+        if document.date and document.valutes:
+            with STAGE_DURATION.time(stage='transform', task='CurrenciesTask'):
+                clean_data = self._get_currencies(document.valutes)
+            with STAGE_DURATION.time(stage='write', task='CurrenciesTask'):
+                self._db_client.insert_data_currencies(clean_data)
+            ROWS.inc(len(clean_data), table='currencies')
+
+    @classmethod
+    async def start_async(cls, document: ValCurs,
+                          db_client: 'AsyncPostgreSQLClient',
+                          params: Dict[str, Any]) -> None:
+        """
+        Starting the currencies task with the async DB client
+        """
+        self = cls(document, db_client, params)
+        if document.date and document.valutes:
+            with STAGE_DURATION.time(stage='transform', task='CurrenciesTask'):
+                clean_data = self._get_currencies(document.valutes)
+            with STAGE_DURATION.time(stage='write', task='CurrenciesTask'):
+                await self._db_client.insert_data_currencies(clean_data)
+            ROWS.inc(len(clean_data), table='currencies')
 
     @staticmethod
-    def _get_currencies(currencies: List) -> List:
+    def _get_currencies(currencies: List[Valute]) -> List[Currency]:
         """
-        Parsing currencies data
+        Parsing currencies data, the last entry of a repeated currency wins
         """
-        result = []
-        unique_currencies = {i['@ID']: i for i in currencies}.values()
-        for val in unique_currencies:
-            result.append({'id': val.get('@ID'),
-                           'name_rus': val.get('Name'),
-                           'code': val.get('CharCode'),
-                           'nominal': int(val.get('Nominal')),
-                           })
-        return result
+        unique_currencies: Dict[str, Currency] = {}
+        for val in currencies:
+            unique_currencies[val.id] = Currency(val.id, val.name, val.char_code, int(val.nominal))
+        return list(unique_currencies.values())
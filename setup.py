@@ -24,7 +24,6 @@ REQUIRED = [
     'alembic==1.7.7',
     'python-json-logger>=0.1.9',
     'pyyaml>=3.13',
-    'xmltodict',
     'psycopg2-binary==2.8.6',
     'sqlalchemy>=1.2.12',
     'pytest',
@@ -34,7 +33,12 @@ REQUIRED = [
 
 # What packages are optional?
 EXTRAS = {
-    # 'fancy feature': ['django'],
+    'async': ['aiohttp>=3.8', 'asyncpg>=0.25'],
+    'matrix': ['numpy>=1.21'],
+    'export': ['pyarrow>=8.0'],
+    'redis': ['redis>=4.0'],
+    'amqp': ['pika>=1.2'],
+    'bench': ['xmltodict'],
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -109,7 +113,7 @@ setupparams = dict(
     author_email=EMAIL,
     python_requires=REQUIRES_PYTHON,
     url=URL,
-    packages=find_packages(exclude=('tests',)),
+    packages=find_packages(exclude=('tests', 'benchmarks', 'benchmarks.*')),
     # If your package is a single module, use this instead of 'packages':
     # py_modules=['mypackage'],
 
@@ -119,6 +123,12 @@ setupparams = dict(
             f"{NAME}_setconfiguration={NAME}.cli:set_configuration",
             f"{NAME}_runmigrations = {NAME}.run:run_migrations",
             f"{NAME}_downmigration = {NAME}.run:down_migration",
+            f"{NAME}_rebuildaggregates = {NAME}.run:rebuild_aggregates",
+            f"{NAME}_backfill = {NAME}.backfill:main",
+            f"{NAME}_async = {NAME}.async_worker:main",
+            f"{NAME}_service = {NAME}.service:main",
+            f"{NAME}_matrix = {NAME}.matrix:main",
+            f"{NAME}_export = {NAME}.export:main",
         ]
     },
     install_requires=REQUIRED,